@@ -1,84 +1,226 @@
-from fastapi import FastAPI, File, UploadFile, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from pathlib import Path
 import tempfile
-import shutil
-from ultralytics import YOLO
-from scripts.utils import get_device, smooth_point, detect_up, detect_down, score_prediction
 from scripts.shot_tracker import process_video
+from scripts.model_registry import load_models, model_stats
+from scripts.jobs import JobQueue, QueueFull, DONE
+from scripts.ingest import COMPLETE, ABORTED, remove_file
+from scripts.live import LiveSession, LocalCameraFeed, LIVE_SOURCES
+from scripts.session_store import SessionStore
+from scripts.outputs import OUTPUT_DIR, SWEEP_SECONDS, evict_outputs, output_path, profile_path, touch
+from scripts.metrics import Metrics, METRICS, StageTimer
+from scripts.detection_cache import content_hash
+import asyncio
 import json
-from datetime import datetime
 import os 
-import time
 #create fastapi instance
 app = FastAPI(title="Basketball Shot Tracker API")
+#old json shot log, imported into the session store once on startup
 LOG_FILE = "shot_log.json"
 #ensure output folder exists 
-Path("outputs").mkdir(exist_ok=True)
+OUTPUT_DIR.mkdir(exist_ok=True)
+
+#base url the app uses to reach the server, used to build download links
+SERVER_URL = os.environ.get("SERVER_URL", "http://192.168.1.218:8000")
+#pool of worker processes that run uploads off the event loop, created at startup
+jobs = None
+#shot history of every session, opened at startup
+sessions = None
+#background task that deletes expired annotated videos
+output_sweeper = None
+#counters and stage times of every video this server processed, served on /metrics
+metrics = Metrics()
+#size of the pieces an upload is written to disk in
+CHUNK_SIZE = 1024 * 1024
+#how long a live session waits for its last events to go out before it sends the summary anyway
+LIVE_DRAIN_SECONDS = float(os.environ.get("LIVE_DRAIN_SECONDS", 5))
+
+#load and warm up every model once when the worker starts so no request pays the cold start
+@app.on_event("startup")
+def warmup_models():
+    load_models()
+
+#open the shot history, sessions from the old json log are moved over the first time
+@app.on_event("startup")
+def open_sessions():
+    global sessions
+    sessions = SessionStore()
+    sessions.import_json(LOG_FILE)
+
+#start the upload workers, every finished upload is logged to the shot history and added to the metrics
+@app.on_event("startup")
+def start_jobs():
+    global jobs
+    jobs = JobQueue(on_done=finish_job, on_failed=lambda job: metrics.observe_run(None, status="failed"))
+    metrics.gauge("jobs_pending", jobs.pending)
+
+def finish_job(job, results):
+    metrics.observe_run(results)
+    log_session(results["FGM"], results["FGA"], job)
+
+@app.on_event("shutdown")
+def stop_jobs():
+    if jobs is not None:
+        jobs.shutdown()
+
+#delete annotated videos nobody has downloaded for a while so outputs/ does not grow forever
+async def sweep_outputs():
+    while True:
+        await asyncio.to_thread(evict_outputs)
+        await asyncio.sleep(SWEEP_SECONDS)
+
+@app.on_event("startup")
+async def start_output_sweeper():
+    global output_sweeper
+    output_sweeper = asyncio.create_task(sweep_outputs())
+
+@app.on_event("shutdown")
+async def stop_output_sweeper():
+    if output_sweeper is not None:
+        output_sweeper.cancel()
+
+#load and warm up times of the models in this worker, calls shows how many predictions reused them
+@app.get("/models")
+def get_models():
+    return {"models": model_stats()}
 
 #for a user, get their past shot tracking history to plot in a line chart
+#returns the newest sessions in date order, pass next_cursor back as cursor to get the page before
 @app.get("/get_history")
-def get_history():
+def get_history(user_id: str = None, start: str = None, end: str = None, limit: int = 100, cursor: str = None):
     try:
-        with open(LOG_FILE, "r") as f:
-            data = json.load(f)
-        return {"sessions": data}
-    except:
-        return {"sessions": data}
+        page, next_cursor = sessions.history(user_id, start, end, limit, cursor)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "malformed cursor, pass back the next_cursor of the previous page"})
+    return {"sessions": page, "next_cursor": next_cursor}
+
+#FGM, FGA and FG% per day or per week for the stats chart
+@app.get("/get_stats")
+def get_stats(user_id: str = None, period: str = "day", start: str = None, end: str = None):
+    if period not in ("day", "week"):
+        return JSONResponse(status_code=400, content={"error": "period must be day or week"})
+    return {"period": period, "stats": sessions.stats(user_id, period, start, end)}
+
 
+#prometheus scrape endpoint, stage times and tracking counters summed over every processed video
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def home():
     return {"message": "Welcome to the Shot Tracker API"}
 
 #when user wants to download annotated video 
+#FileResponse answers Range requests with 206 partial content, so players can seek and resume instead of fetching the whole file
 @app.get("/download/{filename}")
 def download_file(filename:str):
-    #check if output filepath is true by extracting the filename protion in the url 
-    output_file = Path(__file__).parent / "outputs" / f"processed_{filename}"
-    if not output_file.exists():
-        return {"error": "content not found"}
-    def cleanup(path:Path):
-        time.sleep(20)  # wait 10 seconds
-        if os.path.exists(Path):
-            os.remove(Path)
-    background_tasks = BackgroundTasks()
-    background_tasks.add_task(cleanup, output_file)
+    output_file = output_path(filename)
+    if not output_file.is_file():
+        return JSONResponse(status_code=404, content={"error": "content not found"})
+    #the video is deleted by the output sweep once it has not been downloaded for OUTPUT_TTL
+    touch(output_file)
     return FileResponse(
         str(output_file),
         media_type="video/mp4",
-        filename=f"processed_{filename}"
+        filename=output_file.name,
     )
 
+async def queue_upload(chunks, filename, draw, size=None, user_id=None, profile=False):
+    """
+    Write an upload to a temp file chunk by chunk while its job is already running.
+    The worker decodes the file as it grows and deletes it when it is done, so nothing is left behind.
+    The chunks are hashed as they are written, the hash is what the detection cache keys the video by.
+    """
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
+    upload = jobs.new_upload(size)
+    try:
+        job_id = jobs.submit(tmp.name, output_path=str(output_path(filename)), draw=draw, filename=filename, upload=upload, user_id=user_id, profile=profile)
+    except BaseException as e:
+        #no job will read the file
+        tmp.close()
+        remove_file(tmp.name)
+        if isinstance(e, QueueFull):
+            return JSONResponse(status_code=503, content={"error": "server is busy, try again later"})
+        raise
+    digest = content_hash()
+    try:
+        async for chunk in chunks:
+            tmp.write(chunk)
+            #flush so the worker reading the file sees the chunk right away
+            tmp.flush()
+            digest.update(chunk)
+        #the hash has to be there before the worker sees the upload as complete
+        upload["hash"] = digest.hexdigest()
+        upload["state"] = COMPLETE
+    except BaseException:
+        #client went away mid upload, the worker stops and removes the file
+        upload["state"] = ABORTED
+        raise
+    finally:
+        tmp.close()
+    return JSONResponse(status_code=202, content={
+        "message": f"Queued {filename}",
+        "job_id": job_id,
+        "status_url": f"{SERVER_URL}/jobs/{job_id}",
+    })
+
+async def read_upload(file: UploadFile):
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+    await file.close()
+
 #for asynch videos want to post to count shot atttempts user uploads videos through upload request
 @app.post("/upload")
 #get filename from upload file 
-async def upload_video(file: UploadFile = File(...), draw: bool=False):
+async def upload_video(file: UploadFile = File(...), draw: bool=False, user_id: str = None, profile: bool=False):
     """
     Endpoint for user to upload a video such as basektball clip
-    The backend will process the video and return the labeled results.
+    The video is queued for processing and a job id is returned right away,
+    poll /jobs/{job_id} for progress and the labeled results.
+    With profile=true the job is sampled by the profiler, the stacks are at /jobs/{job_id}/profile once it is done.
     """
+    return await queue_upload(read_upload(file), file.filename, draw, file.size, user_id, profile)
 
-    #save upload to temp file 
-    #because cannot directly pass the upload stream to opencv downlaod as mp4 file to read 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp:
-        shutil.copyfileobj(file.file, tmp)
-        tmp_path = tmp.name
-    file.file.close() 
-    #run tracking logic 
-    output_path = f"outputs/processed_{file.filename}"
-    #get results from processing 
-    results = process_video(tmp_path, output_path=output_path, return_video=draw)
-    #return the contents from the video analysis and provide the download irl 
-    log_session(results["FGM"], results["FGA"])
-    return JSONResponse(content={
-        "message":f"Processed {file.filename}",
-        "download_url": f"http://192.168.1.218:8000/download/{file.filename}",
-        "FGM": results['FGM'],
-        "FGA": results['FGA'],
-        "FG_percent": round(results["FGM"] / results["FGA"], 2) * 100 if results["FGA"] > 0 else 0.0
+#same as /upload but the request body is the raw video instead of a form
+#processing starts while the video is still uploading instead of after the last byte arrives
+@app.post("/upload/stream")
+async def upload_video_stream(request: Request, filename: str, draw: bool=False, user_id: str = None, profile: bool=False):
+    #content length is the size of the video, missing when the client sends the body in chunked encoding
+    size = request.headers.get("content-length")
+    return await queue_upload(request.stream(), Path(filename).name, draw, int(size) if size else None, user_id, profile)
 
-    })
+#status of an upload, progress while it runs and the shot results once it is done
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    status = jobs.status(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": "job not found"})
+    results = status.pop("results")
+    if status["status"] == DONE:
+        status.update({
+            "message": f"Processed {status['filename']}",
+            "download_url": f"{SERVER_URL}/download/{status['filename']}",
+            "FGM": results["FGM"],
+            "FGA": results["FGA"],
+            "FG_percent": round(results["FGM"] / results["FGA"], 2) * 100 if results["FGA"] > 0 else 0.0,
+        })
+        if "profile" in results:
+            status["profile"] = results["profile"]
+            status["profile_url"] = f"{SERVER_URL}/jobs/{job_id}/profile"
+    return status
+
+#collapsed stacks of a job uploaded with profile=true, open in speedscope.app or feed to flamegraph.pl
+@app.get("/jobs/{job_id}/profile")
+def get_job_profile(job_id: str):
+    path = profile_path(Path(job_id).name)
+    if not path.is_file():
+        return JSONResponse(status_code=404, content={"error": "no profile for this job"})
+    return FileResponse(str(path), media_type="text/plain", filename=path.name)
 
 @app.get("/live")
 def live_video():
@@ -87,7 +229,8 @@ def live_video():
     """
     #live videos no annotation 
     #get live session updates of shot counts 
-    results = process_video()
+    results = process_video(timer=StageTimer() if METRICS else None)
+    metrics.observe_run(results, source="live")
     return JSONResponse(content={
         "message": "Live Video Tracking has Ended",
         "FGM": results.get("FGM", 0),
@@ -96,20 +239,81 @@ def live_video():
     })
 
 
-def log_session(fgm, fga):
+@app.websocket("/ws/live")
+async def live_socket(websocket: WebSocket, source: str = None, fps: float = 30.0):
+    """
+    Live shot tracking over a websocket.
+    The phone sends frames as binary messages (jpeg/png), or with ?source= the server reads one of its LIVE_SOURCES by name.
+    The server sends a json message for every attempt, make and miss as it happens with the running FGM/FGA,
+    and a summary with frame to event latency when the client sends {"type": "stop"} or the source ends.
+    Frames that arrive while the tracker is busy replace each other so the tracker never falls behind.
+    """
+    await websocket.accept()
+    #only the cameras and streams the server was configured with, anything else is refused
+    if source is not None and source not in LIVE_SOURCES:
+        await websocket.close(code=1008, reason="unknown live source")
+        return
+    loop = asyncio.get_running_loop()
+    outbox = asyncio.Queue()
+    #events come from the tracker thread, hand them to the event loop to send
+    session = LiveSession(lambda event: loop.call_soon_threadsafe(outbox.put_nowait, event), fps)
+    if source is not None:
+        LocalCameraFeed(LIVE_SOURCES[source], session.frames)
+    timer = StageTimer() if METRICS else None
+    tracker = loop.run_in_executor(None, lambda: process_video(session.frames, on_event=session.on_event, timer=timer))
+
+    async def send_events():
+        while True:
+            event = await outbox.get()
+            #None marks the end of the events
+            if event is None:
+                return
+            await websocket.send_json(event)
+    sender = asyncio.create_task(send_events())
+
+    connected = True
     try:
-        with open(LOG_FILE, "r") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                data = [data]
-    except FileNotFoundError:
-        data = []
-    data.append({
-        "date": datetime.now().isoformat(),
-        "FGM": fgm,
-        "FGA": fga,
-        "FG_percent": round(fgm / fga, 2) if fga > 0 else 0.0
-                 })
-    with open(LOG_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+        while True:
+            receive = asyncio.ensure_future(websocket.receive())
+            await asyncio.wait({receive, tracker}, return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done():
+                #the local source ran out
+                receive.cancel()
+                break
+            message = receive.result()
+            if message["type"] == "websocket.disconnect":
+                connected = False
+                break
+            if message.get("bytes") is not None:
+                session.frames.push(message["bytes"])
+            elif message.get("text") is not None and json.loads(message["text"]).get("type") == "stop":
+                break
+    except WebSocketDisconnect:
+        connected = False
+    finally:
+        session.frames.close()
+        results = await tracker
+        metrics.observe_run(results, source="live")
+    if not connected:
+        sender.cancel()
+        return
+    #let the last events go out before the summary, the tracker handed every event to the loop before it finished
+    #so the end marker is queued behind them
+    outbox.put_nowait(None)
+    try:
+        await asyncio.wait_for(sender, LIVE_DRAIN_SECONDS)
+    except WebSocketDisconnect:
+        connected = False
+    except Exception as e:
+        #the sender failed or the client stopped reading, the summary still goes out without the events left
+        print(f"[LIVE] events not sent: {e!r}")
+    if connected:
+        await websocket.send_json(session.summary(results))
+        await websocket.close()
+
+
+def log_session(fgm, fga, job=None):
+    #one row per session, the job id makes logging the same job twice a no-op
+    job = job or {}
+    sessions.add_session(fgm, fga, user_id=job.get("user_id"), filename=job.get("filename"), job_id=job.get("job_id"))
 
@@ -0,0 +1,205 @@
+"""
+Inference backends for the YOLO weights.
+The .pt weights run in eager PyTorch, on CPU only workers they can instead be exported once to ONNX (run by
+onnxruntime) or OpenVINO, optionally quantised to INT8, at a chosen input size. ultralytics loads every format
+behind the same predict call, so the rest of the pipeline does not change, the registry only loads another file.
+
+config (env): INFERENCE_BACKEND torch | onnx | openvino, INFERENCE_IMGSZ (default 640), INFERENCE_INT8 0 | 1,
+INT8_CALIBRATION dataset yaml used to calibrate OpenVINO INT8 (should be frames from our own courts)
+
+usage (from backend/):
+    python -m scripts.backends export --backend openvino --int8 --imgsz 480
+    python -m scripts.backends compare clip.mp4 --backends torch onnx openvino --int8 --imgsz 640 480
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+BACKENDS = ("torch", "onnx", "openvino")
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+#detector input size on full frames, smaller is faster but small balls far from the camera get missed
+INFERENCE_IMGSZ = int(os.environ.get("INFERENCE_IMGSZ", 640))
+INFERENCE_INT8 = os.environ.get("INFERENCE_INT8", "0") == "1"
+INT8_CALIBRATION = os.environ.get("INT8_CALIBRATION")
+#exported models are kept here, one file or folder per model, backend, input size and precision
+EXPORT_DIR = Path(os.environ.get("EXPORT_DIR", "model/exported"))
+#two boxes of the same class overlapping at least this much are the same detection when comparing backends
+MATCH_IOU = 0.5
+
+_export_lock = threading.Lock()
+
+
+def exported_path(weights, backend, imgsz, int8):
+    stem = f"{Path(weights).stem}_{imgsz}{'_int8' if int8 else ''}"
+    if backend == "onnx":
+        return EXPORT_DIR / f"{stem}.onnx"
+    return EXPORT_DIR / f"{stem}_openvino_model"
+
+
+def export_model(weights, backend, imgsz=INFERENCE_IMGSZ, int8=False, calibration=INT8_CALIBRATION):
+    """
+    Export .pt weights to the backend format and return the path to load, torch returns the weights as they are.
+    Exports are done once and reused, run the export command at deploy so no worker pays for it on startup.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown inference backend {backend}, expected one of {BACKENDS}")
+    if backend == "torch":
+        return weights
+    target = exported_path(weights, backend, imgsz, int8)
+    with _export_lock:
+        if target.exists():
+            return str(target)
+        from ultralytics import YOLO
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        #dynamic input shape so batches of any size and the smaller rim crops run on the same export
+        if backend == "onnx":
+            exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            if int8:
+                #ONNX INT8 is dynamic quantisation of the weights, no calibration data needed
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                quantize_dynamic(exported, str(target), weight_type=QuantType.QUInt8)
+                os.remove(exported)
+            else:
+                shutil.move(exported, target)
+        else:
+            if int8 and calibration is None:
+                raise ValueError("OpenVINO INT8 needs calibration images, set INT8_CALIBRATION to a dataset yaml")
+            kwargs = {"int8": True, "data": calibration} if int8 else {}
+            exported = YOLO(weights).export(format="openvino", imgsz=imgsz, dynamic=True, **kwargs)
+            shutil.move(exported, target)
+        print(f"[MODEL] exported {weights} to {target} in {time.perf_counter() - start:.1f}s")
+    return str(target)
+
+
+def resolve_weights(weights, backend=INFERENCE_BACKEND, imgsz=INFERENCE_IMGSZ, int8=INFERENCE_INT8):
+    #path the registry loads for these weights under the configured backend
+    return export_model(weights, backend, imgsz, int8)
+
+
+def _iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def agreement(base_frames, frames):
+    """
+    How closely detections match the baseline, greedy matching by class and IoU per frame.
+    recall: share of baseline boxes found, precision: share of boxes that are in the baseline, iou: mean IoU of the matches
+    """
+    matched, ious, n_base, n_other = 0, [], 0, 0
+    for base, other in zip(base_frames, frames):
+        n_base += len(base)
+        n_other += len(other)
+        used = set()
+        for label, _, box in base:
+            best, best_j = MATCH_IOU, None
+            for j, (olabel, _, obox) in enumerate(other):
+                if j in used or olabel != label:
+                    continue
+                iou = _iou(box, obox)
+                if iou >= best:
+                    best, best_j = iou, j
+            if best_j is not None:
+                used.add(best_j)
+                matched += 1
+                ious.append(best)
+    return {
+        "recall": round(matched / n_base, 4) if n_base else 1.0,
+        "precision": round(matched / n_other, 4) if n_other else 1.0,
+        "mean_iou": round(sum(ious) / len(ious), 4) if ious else 0.0,
+    }
+
+
+def compare_backends(video_path, configs, max_frames=300, batch_size=8):
+    """
+    Run each (backend, imgsz, int8) config over the same frames and compare against the first config.
+    Reports frames/sec of the detector alone, detection agreement and FGM/FGA of the tracker on those detections.
+    """
+    import cv2
+    from ultralytics import YOLO
+    from scripts.model_registry import MODEL_PATHS
+    from scripts.benchmark import replay
+    from scripts.shot_tracker import ShotTracker, parse_results
+
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    video = []
+    while len(video) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        video.append(frame)
+    cap.release()
+    meta = {"fps": fps, "height": video[0].shape[0] if video else 0}
+
+    rows, baseline = [], None
+    for backend, imgsz, int8 in configs:
+        model = YOLO(export_model(MODEL_PATHS["best"], backend, imgsz, int8))
+        #first call builds the session/graph, keep it out of the timing
+        model.predict(video[:1], imgsz=imgsz, conf=ShotTracker.CONF_THRESHOLD, device="cpu", verbose=False)
+        detections = []
+        start = time.perf_counter()
+        for i in range(0, len(video), batch_size):
+            results = model.predict(video[i:i + batch_size], imgsz=imgsz, conf=ShotTracker.CONF_THRESHOLD, device="cpu", verbose=False)
+            detections.extend(parse_results(r) for r in results)
+        elapsed = time.perf_counter() - start
+        counts = replay(detections, meta)
+        row = {"backend": backend, "imgsz": imgsz, "int8": int8, "frames": len(video),
+               "fps": round(len(video) / elapsed, 2) if elapsed > 0 else 0.0, "FGM": counts["FGM"], "FGA": counts["FGA"]}
+        if baseline is None:
+            baseline = (row, detections)
+        else:
+            row.update(agreement(baseline[1], detections))
+            row["speedup"] = round(row["fps"] / baseline[0]["fps"], 2) if baseline[0]["fps"] > 0 else 0.0
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export the detector to ONNX/OpenVINO and compare backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="export weights for a backend")
+    exp.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+    exp.add_argument("--imgsz", type=int, default=INFERENCE_IMGSZ)
+    exp.add_argument("--int8", action="store_true")
+    exp.add_argument("--models", nargs="+", default=["best"], help="names from model_registry.MODEL_PATHS")
+    exp.add_argument("--calibration", default=INT8_CALIBRATION, help="dataset yaml for OpenVINO INT8 calibration")
+
+    cmp = sub.add_parser("compare", help="throughput and detection agreement against pytorch")
+    cmp.add_argument("video")
+    cmp.add_argument("--backends", nargs="+", choices=BACKENDS, default=["torch", "onnx", "openvino"])
+    cmp.add_argument("--imgsz", type=int, nargs="+", default=[INFERENCE_IMGSZ])
+    cmp.add_argument("--int8", action="store_true", help="also run the INT8 export of every non torch backend")
+    cmp.add_argument("--frames", type=int, default=300)
+    cmp.add_argument("--out", default=None)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        from scripts.model_registry import MODEL_PATHS
+        for name in args.models:
+            print(export_model(MODEL_PATHS[name], args.backend, args.imgsz, args.int8, args.calibration))
+    else:
+        #the pytorch model at the first input size is the baseline everything else is compared to
+        configs = [("torch", args.imgsz[0], False)]
+        for backend in args.backends:
+            for imgsz in args.imgsz:
+                for int8 in ((False, True) if args.int8 and backend != "torch" else (False,)):
+                    if (backend, imgsz, int8) not in configs:
+                        configs.append((backend, imgsz, int8))
+        rows = compare_backends(args.video, configs, args.frames)
+        print(f"{'backend':<9} {'imgsz':>5} {'int8':>5} {'fps':>8} {'speedup':>8} {'recall':>7} {'precision':>9} {'iou':>6} {'FGM/FGA':>8}")
+        for r in rows:
+            print(f"{r['backend']:<9} {r['imgsz']:>5} {str(r['int8']):>5} {r['fps']:>8} {r.get('speedup', 1.0):>7}x "
+                  f"{r.get('recall', 1.0):>7} {r.get('precision', 1.0):>9} {r.get('mean_iou', 1.0):>6} {r['FGM']:>4}/{r['FGA']}")
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(rows, f, indent=4)
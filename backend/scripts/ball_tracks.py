@@ -0,0 +1,297 @@
+import math
+from collections import deque
+from itertools import chain
+import numpy as np
+from scripts.utils import detect_up, detect_down, score_prediction
+
+#ball states, stored as small ints in the state array
+INIT, ATTEMPTING, MADE, MISSED = 0, 1, 2, 3
+STATE_NAMES = ("init", "attempting", "made", "missed")
+
+#cooldown value for a ball that was never counted, far enough back that any frame is past its cooldown window
+NO_COOLDOWN = -10**9
+
+#a ball missing for at most this many frames can be merged with a new detection that reappears under the rim
+MERGE_WINDOW = 8
+#max distance between the last position of the old ball and the new detection for a merge
+MERGE_DISTANCE = 130
+#how many points of the trajectory are kept per ball
+TRAJ_LEN = 50
+#weight of the previous position when smoothing a new detection, same as utils.smooth_point
+SMOOTH_ALPHA = 0.7
+#frames with at least this many detection x ball pairs are matched through one numpy distance matrix,
+#below that a python loop over the balls is faster (numpy costs microseconds per call, see scripts.bench_tracks)
+MATRIX_MIN_PAIRS = 32 * 32
+
+
+class BallTracks:
+    """
+    Fixed capacity table of tracked balls.
+    Every ball lives in a slot, slot i of each column holds that ball's data, a slot with id -1 is free.
+    ids come from a counter that only goes up so an id is never reused within a session.
+
+    The columns are plain python lists and each trajectory is a deque that drops its oldest point by itself.
+    A court rarely has more than a couple of balls, and at that size reading or writing one element of a list
+    is several times cheaper than doing it on a numpy array. Frames crowded enough for numpy to pay off
+    are matched through a DistanceMatrix.
+    """
+
+    #arrays that make up a saved table, see state_dict/load_state_dict
+    FIELDS = ("ids", "pos", "vel", "missing", "state", "cooldown", "traj", "traj_n", "traj_head")
+    DTYPES = {"ids": np.int64, "pos": np.float64, "vel": np.float64, "missing": np.int32, "state": np.int8,
+              "cooldown": np.int64}
+
+    def __init__(self, capacity=32):
+        self.capacity = capacity
+        self.ids = [-1] * capacity
+        #last position (x, y) of each ball, always the same as the last point of its trajectory
+        self.pos = [(0.0, 0.0)] * capacity
+        #velocity (vx, vy) in pixels per frame
+        self.vel = [(0.0, 0.0)] * capacity
+        #how many frames in a row the ball was not detected
+        self.missing = [0] * capacity
+        self.state = [INIT] * capacity
+        #frame the ball was last counted as an attempt/make/miss
+        self.cooldown = [NO_COOLDOWN] * capacity
+        #traj[slot] holds the last TRAJ_LEN points (x, y) of one ball oldest first
+        self.traj = [deque(maxlen=TRAJ_LEN) for _ in range(capacity)]
+        #slots that hold a ball, oldest ball (lowest id) first
+        self.order = []
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    def active(self):
+        #slots that currently hold a ball, oldest ball first
+        return list(self.order)
+
+    def traj_len(self, slot):
+        return len(self.traj[slot])
+
+    def trajectory(self, slot):
+        #the ball's points oldest first, the tracker keeps adding to it so copy it to keep it
+        return self.traj[slot]
+
+    def shot_geometry(self, slots, rim_box):
+        """
+        detect_up, detect_down and score_prediction for the given balls in one pass.
+        Computed once per frame so the state machine never evaluates the same check twice for a ball.
+        Returns three lists of bools lined up with slots.
+
+        The score prediction is only made for balls below the rim that are still init or attempting, it is False for the rest.
+        The state machine only looks at it for those, and a made or missed ball only gets back to init or
+        attempting above the rim, so no ball that changes state this frame needs it.
+        """
+        up, down, scored = [], [], []
+        for slot in slots:
+            traj = self.traj[slot]
+            below = detect_down(traj, rim_box)
+            up.append(detect_up(traj, rim_box))
+            down.append(below)
+            scored.append(below and self.state[slot] in (ATTEMPTING, INIT) and score_prediction(traj, rim_box))
+        return up, down, scored
+
+    def add(self, point):
+        #put a new ball in a free slot, if the table is full the ball missing the longest is dropped
+        if len(self.order) < self.capacity:
+            slot = self.ids.index(-1)
+        else:
+            slot = max(self.order, key=self.missing.__getitem__)
+            self.order.remove(slot)
+        self.ids[slot] = self.next_id
+        self.next_id += 1
+        self.order.append(slot)
+        self.vel[slot] = (0.0, 0.0)
+        self.missing[slot] = 0
+        self.state[slot] = INIT
+        self.cooldown[slot] = NO_COOLDOWN
+        self.traj[slot].clear()
+        self.append(slot, point[0], point[1])
+        return slot
+
+    def remove(self, slot):
+        self.ids[slot] = -1
+        self.order.remove(slot)
+
+    def append(self, slot, x, y):
+        #add a point to the ball's trajectory, once TRAJ_LEN points are stored the oldest one falls off
+        self.pos[slot] = (x, y)
+        self.traj[slot].append((x, y))
+
+    def extend(self, slot, points):
+        for x, y in points:
+            self.append(slot, x, y)
+
+    def append_smoothed(self, slot, point, alpha=SMOOTH_ALPHA):
+        #average the new detection with the last position to smooth jumps when the ball jitters
+        px, py = self.pos[slot]
+        self.append(slot, alpha * px + (1 - alpha) * point[0], alpha * py + (1 - alpha) * point[1])
+
+    def extrapolate(self, slot):
+        #add the point the ball would be at if it kept its last per frame motion
+        traj = self.traj[slot]
+        (x1, y1), (x2, y2) = traj[-2], traj[-1]
+        self.append(slot, 2 * x2 - x1, 2 * y2 - y1)
+
+    def update_velocity(self, slots):
+        #velocity is the step between the last two points of each ball, balls with a single point keep theirs
+        for slot in slots:
+            traj = self.traj[slot]
+            if len(traj) >= 2:
+                (x1, y1), (x2, y2) = traj[-2], traj[-1]
+                self.vel[slot] = (x2 - x1, y2 - y1)
+
+    def nearest(self, point, max_distance):
+        """
+        Slot of the tracked ball whose last position is closest to point, None if no ball is within max_distance.
+        Ties go to the older ball (lower id). Balls matched or created earlier in the same frame count as well,
+        so like the per ball loop this replaced several detections can land on one ball.
+        """
+        x, y = point
+        pos, hypot = self.pos, math.hypot
+        best, best_dist = None, max_distance
+        for slot in self.order:
+            px, py = pos[slot]
+            dist = hypot(px - x, py - y)
+            if dist < best_dist:
+                best, best_dist = slot, dist
+        return best
+
+    def matcher(self, points, max_distance):
+        #nearest ball for each detection of a frame in turn, through a distance matrix once there are enough pairs for numpy to pay off
+        if len(points) * len(self.order) >= MATRIX_MIN_PAIRS:
+            return DistanceMatrix(self, points, max_distance)
+        return NearestLoop(self, points, max_distance)
+
+    def find_merge(self, point, rim_box):
+        """
+        Look for a ball that dropped out for a few frames near the rim and reappeared as this new detection under it.
+        The tracker loses the ball going through the net, so without this every make would also start a new ball.
+        Returns the slot of the oldest ball (lowest id) that qualifies or None.
+        """
+        if not rim_box:
+            return None
+        rx1, ry1, rx2, ry2 = rim_box
+        cx, cy = point
+        rim_center_y = (ry1 + ry2) / 2
+        #new detection has to be below the rim center and inside the region near the hoop
+        if not (cy >= rim_center_y and rx1 - 150 < cx < rx2 + 150 and ry1 - 180 < cy < ry2 + 180):
+            return None
+        pos, missing = self.pos, self.missing
+        for slot in self.order:
+            ox, oy = pos[slot]
+            #old ball was between 10 pixels above and 40 pixels below the rim when it vanished
+            if (0 < missing[slot] <= MERGE_WINDOW and ry1 - 10 <= oy <= ry2 + 40
+                    and math.hypot(ox - cx, oy - cy) < MERGE_DISTANCE):
+                return slot
+        return None
+
+    def merge(self, slot, point):
+        #the old ball continues with the new detection under a new id, its velocity, state and cooldown carry over
+        self.ids[slot] = self.next_id
+        self.next_id += 1
+        #with the newest id the ball is now the youngest one
+        self.order.remove(slot)
+        self.order.append(slot)
+        self.append(slot, point[0], point[1])
+        self.missing[slot] = 0
+        return slot
+
+    def state_dict(self):
+        """
+        The whole table as plain arrays, enough to rebuild it with load_state_dict.
+        Trajectories are saved as a (capacity, 2 * TRAJ_LEN, 2) ring like the checkpoints of the numpy table,
+        with traj_n points each ending at traj_head + TRAJ_LEN.
+        """
+        state = {name: np.array(getattr(self, name), dtype=dtype) for name, dtype in self.DTYPES.items()}
+        state["pos"] = state["pos"].reshape(-1, 2)
+        state["vel"] = state["vel"].reshape(-1, 2)
+        traj = np.zeros((self.capacity, 2 * TRAJ_LEN, 2), dtype=np.float64)
+        traj_n = np.array([len(points) for points in self.traj], dtype=np.int32)
+        for slot, points in enumerate(self.traj):
+            if points:
+                traj[slot, TRAJ_LEN - len(points):TRAJ_LEN] = points
+        traj[:, TRAJ_LEN:] = traj[:, :TRAJ_LEN]
+        state.update({"traj": traj, "traj_n": traj_n, "traj_head": np.zeros(self.capacity, dtype=np.int32),
+                      "next_id": self.next_id})
+        return state
+
+    def load_state_dict(self, state):
+        for name, dtype in self.DTYPES.items():
+            value = np.array(state[name], dtype=dtype).tolist()
+            setattr(self, name, [tuple(p) for p in value] if name in ("pos", "vel") else value)
+        self.capacity = len(self.ids)
+        self.traj = []
+        for ring, n, head in zip(np.asarray(state["traj"], dtype=np.float64), state["traj_n"], state["traj_head"]):
+            end = int(head) + TRAJ_LEN
+            self.traj.append(deque(map(tuple, ring[end - int(n):end].tolist()), maxlen=TRAJ_LEN))
+        self.next_id = int(state["next_id"])
+        self.order = sorted((slot for slot in range(self.capacity) if self.ids[slot] >= 0), key=self.ids.__getitem__)
+
+
+class NearestLoop:
+    """
+    BallTracks.nearest for each detection of a frame, the matcher for frames with few balls and detections.
+    It reads the current positions every time, so a ball that moved or was created for an earlier detection needs no update.
+    """
+
+    def __init__(self, tracks, points, max_distance):
+        self.tracks = tracks
+        self.points = points
+        self.max_distance = max_distance
+
+    def nearest(self, i):
+        return self.tracks.nearest(self.points[i], self.max_distance)
+
+    def moved(self, i, slot):
+        pass
+
+
+class DistanceMatrix:
+    """
+    The matcher for frames with many balls and detections, gives the same matches as NearestLoop.
+    The distances of every detection to every ball come from one numpy call at the start of the frame.
+    Detections are matched in order, and a ball that was matched, merged or created for detection i has moved,
+    so moved() recomputes only its column for the detections after i. Columns are the balls oldest first,
+    a ball that gets a new id in this frame gets a new column at the end, which keeps ties going to the older ball.
+    """
+
+    def __init__(self, tracks, points, max_distance):
+        self.tracks = tracks
+        #points as complex numbers so a column of distances is a single abs() of a difference
+        self.points = as_complex(points)
+        self.max_distance = max_distance
+        self.slots = list(tracks.order)
+        self.ids = [tracks.ids[slot] for slot in self.slots]
+        self.column = {slot: j for j, slot in enumerate(self.slots)}
+        #every detection adds at most one column, columns not in use stay at inf
+        self.dist = np.full((len(self.points), len(self.slots) + len(self.points)), np.inf)
+        pos = as_complex([tracks.pos[slot] for slot in self.slots])
+        np.abs(self.points[:, None] - pos, out=self.dist[:, :len(self.slots)])
+
+    def nearest(self, i):
+        row = self.dist[i]
+        #argmin takes the first of equal distances, the older ball
+        j = row.argmin()
+        return self.slots[j] if row[j] < self.max_distance else None
+
+    def moved(self, i, slot):
+        #the ball in slot was matched to detection i, or merged or created for it
+        j = self.column.get(slot)
+        if j is not None and self.ids[j] != self.tracks.ids[slot]:
+            #the slot holds a ball with a new id now, the old column is stale
+            self.dist[:, j] = np.inf
+            j = None
+        if j is None:
+            j = len(self.slots)
+            self.slots.append(slot)
+            self.ids.append(self.tracks.ids[slot])
+            self.column[slot] = j
+        if i + 1 < len(self.points):
+            np.abs(self.points[i + 1:] - complex(*self.tracks.pos[slot]), out=self.dist[i + 1:, j])
+
+
+def as_complex(points):
+    #(x, y) points as one complex128 array x + yj
+    return np.fromiter(chain.from_iterable(points), np.float64, 2 * len(points)).view(np.complex128)
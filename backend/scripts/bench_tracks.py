@@ -0,0 +1,74 @@
+"""
+Microbenchmark for ball to track association, per frame cost as the number of balls in the frame grows.
+Compares the old nested loop (every detection against every ball with math.hypot) with the BallTracks matcher the tracker uses,
+a python loop over the balls for small frames and one numpy distance matrix from MATRIX_MIN_PAIRS detection x ball pairs on.
+
+usage (from backend/): python -m scripts.bench_tracks --balls 1 2 4 8 16 32
+"""
+import argparse
+import math
+import time
+import numpy as np
+from scripts.ball_tracks import BallTracks
+
+MAX_DISTANCE = 100
+
+
+def loop_associate(balls, detections):
+    #the association step as it was written in process_video before the ball table
+    matches = []
+    for cx, cy in detections:
+        matched_id, min_dist = None, float("inf")
+        for bid, traj in balls.items():
+            px, py = traj[-1]
+            dist = math.hypot(px - cx, py - cy)
+            if dist < MAX_DISTANCE and dist < min_dist:
+                matched_id, min_dist = bid, dist
+        matches.append(matched_id)
+    return matches
+
+
+def make_frames(n_balls, n_frames, rng):
+    #balls spread over a 1080p frame moving a few pixels each frame, like a gym with several players shooting
+    start = rng.uniform((0, 0), (1920, 1080), size=(n_balls, 2))
+    step = rng.uniform(-8, 8, size=(n_balls, 2))
+    return [start + step * k + rng.normal(0, 1, size=(n_balls, 2)) for k in range(n_frames)]
+
+
+def bench(n_balls, n_frames=500, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = make_frames(n_balls, n_frames, rng)
+    points = [[(float(x), float(y)) for x, y in f] for f in frames]
+
+    balls = {i: [p] for i, p in enumerate(points[0])}
+    start = time.perf_counter()
+    for dets in points[1:]:
+        for bid, match in enumerate(loop_associate(balls, dets)):
+            if match is not None:
+                balls[match].append(dets[bid])
+    loop_us = (time.perf_counter() - start) / (n_frames - 1) * 1e6
+
+    tracks = BallTracks(capacity=max(32, n_balls))
+    for p in points[0]:
+        tracks.add(p)
+    start = time.perf_counter()
+    for dets in points[1:]:
+        match = tracks.matcher(dets, MAX_DISTANCE)
+        for i, p in enumerate(dets):
+            slot = match.nearest(i)
+            if slot is not None:
+                tracks.append(slot, *p)
+                match.moved(i, slot)
+    table_us = (time.perf_counter() - start) / (n_frames - 1) * 1e6
+    return loop_us, table_us
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="per frame association cost vs number of balls")
+    parser.add_argument("--balls", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+    print(f"{'balls':>6} {'loop us/frame':>14} {'table us/frame':>15} {'speedup':>8}")
+    for n in args.balls:
+        loop_us, table_us = bench(n, args.frames)
+        print(f"{n:>6} {loop_us:>14.1f} {table_us:>15.1f} {loop_us / table_us:>7.2f}x")
@@ -0,0 +1,384 @@
+"""
+Speed and accuracy benchmark for the shot pipeline.
+
+Runs process_video over labelled clips, or replays recorded detections through the tracker (no decoding, no model),
+and writes a json report with per stage timings, frames/sec, peak memory of the run and FGM/FGA against the true counts.
+Reports from two commits can be compared to catch a change that makes the pipeline slower or counts differently.
+
+Ground truth for videos comes from a labels.json next to them: {"clip.mp4": {"FGM": 3, "FGA": 5}, ...},
+replay files carry their own.
+
+usage (from backend/):
+    python -m scripts.benchmark run clips/ --out report.json
+    python -m scripts.benchmark run clip.npz --repeat 5
+    python -m scripts.benchmark record clip.mp4 --fgm 3 --fga 5
+    python -m scripts.benchmark synth synthetic.npz --shots 40
+    python -m scripts.benchmark compare base.json report.json
+    python -m scripts.benchmark overhead clip.mp4 --repeat 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from scripts.detections import save_detections, load_detections
+from scripts.metrics import StageTimer, peak_rss_mb
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+REPLAY_EXTENSION = ".npz"
+#compare fails when a clip got slower than this fraction
+MAX_SLOWDOWN = 0.10
+
+
+def find_inputs(paths):
+    #every video or replay file in the given files and directories, with its true counts when they are known
+    inputs = []
+    for path in map(Path, paths):
+        files = sorted(path.iterdir()) if path.is_dir() else [path]
+        labels_file = (path if path.is_dir() else path.parent) / "labels.json"
+        labels = json.loads(labels_file.read_text()) if labels_file.exists() else {}
+        for f in files:
+            if f.suffix.lower() in VIDEO_EXTENSIONS + (REPLAY_EXTENSION,):
+                inputs.append((f, labels.get(f.name)))
+    return inputs
+
+
+def replay(frames, meta, timer=None):
+    #run the tracker alone over recorded detections, this is the association and state machine cost per frame
+    from scripts.shot_tracker import ShotTracker
+    tracker = ShotTracker(meta["fps"], meta["height"])
+    tracker.timer = timer
+    start = time.perf_counter()
+    for frame_idx, boxes in enumerate(frames, 1):
+        tracker.update(boxes, frame_idx)
+    elapsed = time.perf_counter() - start
+    return {"FGM": tracker.fgm, "FGA": tracker.fga, "rims": tracker.per_rim(), "frames": len(frames),
+            "fps": round(len(frames) / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+def bench_one(path, truth, options):
+    timer = StageTimer()
+    start = time.perf_counter()
+    if path.suffix.lower() == REPLAY_EXTENSION:
+        frames, meta = load_detections(path)
+        truth = truth or ({"FGM": meta["FGM"], "FGA": meta["FGA"]} if "FGA" in meta else None)
+        results = replay(frames, meta, timer)
+        mode = "replay"
+    else:
+        from scripts.shot_tracker import process_video
+        output_path = os.path.join("outputs", f"bench_{path.stem}.mp4") if options["draw"] else None
+        results = process_video(str(path), output_path=output_path, return_video=options["draw"],
+                                batch_size=options["batch_size"], skip_stride=options["skip_stride"],
+                                rim_lock=options["rim_lock"], timer=timer)
+        mode = "video"
+    wall = time.perf_counter() - start
+    row = {
+        "clip": path.name,
+        "mode": mode,
+        "frames": results["frames"],
+        "wall_s": round(wall, 4),
+        "fps": round(results["frames"] / wall, 2) if wall > 0 else 0.0,
+        "stages": timer.summary(),
+        "FGM": results["FGM"],
+        "FGA": results["FGA"],
+    }
+    if truth is not None:
+        row["true_FGM"], row["true_FGA"] = truth["FGM"], truth["FGA"]
+        row["FGM_error"], row["FGA_error"] = results["FGM"] - truth["FGM"], results["FGA"] - truth["FGA"]
+    return row
+
+
+def measure_overhead(path, options, repeat=3):
+    """
+    Time a clip with metrics off, with the stage timers and with the timers plus the sampling profiler.
+    The modes take turns so a slow patch of the machine hits all of them, the fastest run of each is kept.
+    """
+    from scripts.profiler import SamplingProfiler
+    if path.suffix.lower() == REPLAY_EXTENSION:
+        frames, meta = load_detections(path)
+        run = lambda timer: replay(frames, meta, timer)
+    else:
+        from scripts.shot_tracker import process_video
+        run = lambda timer: process_video(str(path), batch_size=options["batch_size"], skip_stride=options["skip_stride"],
+                                          rim_lock=options["rim_lock"], timer=timer)
+    modes = {"off": (False, False), "timers": (True, False), "timers+profiler": (True, True)}
+    walls = {name: float("inf") for name in modes}
+    for _ in range(repeat):
+        for name, (timed, profiled) in modes.items():
+            timer = StageTimer() if timed else None
+            start = time.perf_counter()
+            if profiled:
+                with SamplingProfiler():
+                    run(timer)
+            else:
+                run(timer)
+            walls[name] = min(walls[name], time.perf_counter() - start)
+    return {
+        "clip": path.name,
+        "wall_s": {name: round(wall, 4) for name, wall in walls.items()},
+        "overhead_percent": {name: round((walls[name] / walls["off"] - 1) * 100, 2) for name in modes if name != "off"},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(paths, options, repeat=1):
+    rows = []
+    for path, truth in find_inputs(paths):
+        #keep the fastest of the repeats, the counts are the same every time
+        runs = [bench_one(path, truth, options) for _ in range(repeat)]
+        rows.append(min(runs, key=lambda r: r["wall_s"]))
+    labelled = [r for r in rows if "true_FGA" in r]
+    frames = sum(r["frames"] for r in rows)
+    wall = sum(r["wall_s"] for r in rows)
+    #the clips run one after the other in this process, so the peak memory is of the whole run and not of any one clip
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "options": options,
+        "clips": rows,
+        "totals": {
+            "clips": len(rows),
+            "frames": frames,
+            "wall_s": round(wall, 4),
+            "fps": round(frames / wall, 2) if wall > 0 else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "labelled_clips": len(labelled),
+            "exact_clips": sum(1 for r in labelled if r["FGM_error"] == 0 and r["FGA_error"] == 0),
+            "FGM_abs_error": sum(abs(r["FGM_error"]) for r in labelled),
+            "FGA_abs_error": sum(abs(r["FGA_error"]) for r in labelled),
+        },
+    }
+
+
+def compare(base, new, max_slowdown=MAX_SLOWDOWN):
+    """print clip by clip changes between two reports, returns False when a clip got slower or counts got worse"""
+    ok = True
+    old_rows = {r["clip"]: r for r in base["clips"]}
+    print(f"base {base.get('commit')} -> new {new.get('commit')}")
+    print(f"{'clip':<30} {'fps':>9} {'new fps':>9} {'change':>8} {'FGM/FGA':>9} {'new':>9} {'abs err':>8}")
+    for row in new["clips"]:
+        old = old_rows.get(row["clip"])
+        if old is None:
+            continue
+        change = row["fps"] / old["fps"] - 1 if old["fps"] > 0 else 0.0
+        old_err = abs(old.get("FGM_error", 0)) + abs(old.get("FGA_error", 0))
+        new_err = abs(row.get("FGM_error", 0)) + abs(row.get("FGA_error", 0))
+        flag = ""
+        if change < -max_slowdown:
+            flag, ok = " SLOWER", False
+        if new_err > old_err:
+            flag, ok = flag + " LESS ACCURATE", False
+        print(f"{row['clip']:<30} {old['fps']:>9.1f} {row['fps']:>9.1f} {change:>+7.1%} "
+              f"{old['FGM']:>4}/{old['FGA']:<4} {row['FGM']:>4}/{row['FGA']:<4} {old_err:>3}->{new_err:<3}{flag}")
+    for name in ("fps", "peak_rss_mb", "FGM_abs_error", "FGA_abs_error"):
+        print(f"total {name}: {base['totals'][name]} -> {new['totals'][name]}")
+    return ok
+
+
+def record(video_path, out_path, fgm=None, fga=None, batch_size=None):
+    #run the model over every full frame once and save the detections as a replay file
+    from scripts.model_registry import get_model
+    from scripts.pipeline import read_batches
+    from scripts.shot_tracker import ShotTracker, detect_frames, BATCH_SIZE
+    model = get_model("best")
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frames = []
+    for batch in read_batches(cap, batch_size or BATCH_SIZE):
+        frames.extend(detect_frames(model, batch, ShotTracker.CONF_THRESHOLD))
+    cap.release()
+    save_detections(out_path, frames, fps, w, h, fgm, fga)
+    print(f"[BENCH] recorded {len(frames)} frames of detections to {out_path}")
+
+
+def _flight(sx, sy, tx, ty, apex, g, floor, made):
+    """
+    Ball centers frame by frame of a throw from (sx, sy) that peaks at height apex and comes down through (tx, ty),
+    g is the gravity in pixels per frame squared. A make drops straight through the net, a miss goes on along its arc,
+    both until they reach the floor. Returns the points and how many of them are on the way up.
+    """
+    up = np.sqrt(2 * (sy - apex) / g)
+    total = up + np.sqrt(2 * (ty - apex) / g)
+    vx = (tx - sx) / total
+    points, t = [], 0
+    while True:
+        x = tx if made and t > total else sx + vx * t
+        y = apex + 0.5 * g * (t - up) ** 2
+        points.append((x, min(y, floor)))
+        if t > up and y >= floor:
+            return points, int(np.ceil(up))
+        t += 1
+
+
+def _dribble(x0, x1, floor, frames, rng):
+    #a ball bounced from x0 to x1 along the floor
+    return [(x0 + (x1 - x0) * k / frames + rng.uniform(-3, 3), floor - 60 * abs(np.sin(np.pi * k / 12)))
+            for k in range(frames)]
+
+
+def _unseen_shots(frames, spans, rim):
+    """
+    Shots of a synthetic clip whose label cannot be read back from its detections. A shot has to be detected in the
+    attempt zone on the way up, and on the way down level with the rim, inside it for a make and only beside it for a miss.
+    """
+    from scripts.utils import detect_up_batch
+    rx1, ry1, rx2, ry2 = rim
+    unseen = []
+    for shot, (start, rising, length, made) in enumerate(spans):
+        centers = []
+        for boxes in frames[start:start + length]:
+            ball = next((box for label, _, box in boxes if label == "ball"), None)
+            centers.append(None if ball is None else ((ball[0] + ball[2]) / 2, (ball[1] + ball[3]) / 2))
+        up = [c for c in centers[:rising] if c is not None]
+        at_rim = [x for c in centers[rising:] if c is not None and ry1 <= c[1] <= ry2 + 60 for x in c[:1]]
+        inside = [x for x in at_rim if rx1 < x < rx2]
+        attempted = len(up) > 0 and np.count_nonzero(detect_up_batch(np.array(up), rim)) > 0
+        labelled = len(inside) > 0 if made else len(at_rim) > len(inside) == 0
+        if not (attempted and labelled):
+            unseen.append(shot)
+    return unseen
+
+
+def synthesize(out_path, shots=40, make_rate=0.5, seed=0, fps=30.0, width=1280, height=720, noise=2.0, dropout=0.05, verify=True):
+    """
+    Replay file of made and missed jump shots at one rim with known counts, no video or model needed.
+    Every shot is released a few hundred pixels from the rim, rises through the zone in front of the rim where
+    the tracker counts an attempt, peaks inside the frame and comes down through the middle of the rim (make)
+    or beside it (miss) to the floor. Between shots the ball leaves the frame or is dribbled to the next spot.
+    Positions get pixel noise and a few detections are dropped like a real detector.
+    With verify every shot has to be visible in the detections the way it is labelled (_unseen_shots), checked
+    with the geometry the shot was generated from and not with the tracker the file is meant to benchmark,
+    otherwise nothing is written and ValueError is raised.
+    """
+    from scripts.utils import detect_up_batch
+    rng = np.random.default_rng(seed)
+    rim = (600, 200, 660, 215)
+    cx, cy = (rim[0] + rim[2]) / 2, (rim[1] + rim[3]) / 2
+    floor = height - 100
+    points, made_count = [], 0
+    #first frame, frames on the way up, frame count and label of every shot
+    spans = []
+    #where the ball landed after the last shot, None when it left the frame
+    landed = None
+    for shot in range(shots):
+        made = rng.random() < make_rate
+        made_count += made
+        #misses come down a ball width or two beside the rim
+        tx = cx + rng.uniform(-6, 6) if made else cx + rng.choice([-1, 1]) * rng.uniform(55, 80)
+        while True:
+            sx = cx + rng.choice([-1, 1]) * rng.uniform(100, 260)
+            apex = rim[1] - rng.uniform(60, 140)
+            flight, rising = _flight(sx, floor - 60, tx, cy, apex, rng.uniform(0.45, 0.6), floor, made)
+            #the ball has to pass the attempt zone going up on at least two frames, like a real shot seen at 30fps
+            if np.count_nonzero(detect_up_batch(np.array(flight[:rising]), rim)) >= 2:
+                break
+        if landed is not None:
+            #rebound, the same ball is dribbled to the next spot
+            points += _dribble(landed, sx, floor, int(rng.integers(30, 60)), rng)
+        elif shot > 0:
+            #the ball rolled out of the frame and comes back at the next spot
+            points += [None] * int(rng.integers(15, 40))
+        #dribbling before the shot, the last bounce ends at the top where the shot starts
+        points += _dribble(sx, sx, floor, 12 * int(rng.integers(2, 5)) + 7, rng)
+        spans.append((len(points), rising, len(flight), made))
+        points += flight
+        landed = flight[-1][0] if rng.random() < 0.5 else None
+    frames = []
+    for p in points:
+        boxes = [("rim", 0.9, rim)]
+        if p is not None and rng.random() > dropout:
+            x, y = p[0] + rng.normal(0, noise), p[1] + rng.normal(0, noise)
+            if 12 <= x < width - 12 and 12 <= y < height - 12:
+                boxes.append(("ball", float(rng.uniform(0.5, 0.95)), (int(x) - 12, int(y) - 12, int(x) + 12, int(y) + 12)))
+        frames.append(boxes)
+    if verify:
+        unseen = _unseen_shots(frames, spans, rim)
+        if unseen:
+            raise ValueError(f"shots {unseen} of seed {seed} do not show their label in the detections, try another seed")
+    save_detections(out_path, frames, fps, width, height, made_count, shots)
+    print(f"[BENCH] wrote {len(frames)} frames, {made_count}/{shots} shots to {out_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="shot pipeline speed and accuracy benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="benchmark clips, directories of clips or replay files")
+    run.add_argument("paths", nargs="+")
+    run.add_argument("--out", default="benchmark.json")
+    run.add_argument("--repeat", type=int, default=1)
+    run.add_argument("--batch-size", type=int, default=None)
+    run.add_argument("--skip-stride", type=int, default=None)
+    run.add_argument("--rim-lock", action="store_true", help="run the detector on crops around the locked rim")
+    run.add_argument("--draw", action="store_true", help="also annotate and encode the output video")
+
+    rec = sub.add_parser("record", help="save the detections of a video as a replay file")
+    rec.add_argument("video")
+    rec.add_argument("--out", default=None)
+    rec.add_argument("--fgm", type=int, default=None)
+    rec.add_argument("--fga", type=int, default=None)
+
+    syn = sub.add_parser("synth", help="write a synthetic replay file with known counts")
+    syn.add_argument("out")
+    syn.add_argument("--shots", type=int, default=40)
+    syn.add_argument("--make-rate", type=float, default=0.5)
+    syn.add_argument("--seed", type=int, default=0)
+    syn.add_argument("--no-verify", action="store_true", help="write the file even if the tracker does not count the truth")
+
+    cmp = sub.add_parser("compare", help="compare two reports, exits 1 on a slowdown or an accuracy drop")
+    cmp.add_argument("base")
+    cmp.add_argument("new")
+    cmp.add_argument("--max-slowdown", type=float, default=MAX_SLOWDOWN)
+
+    ovh = sub.add_parser("overhead", help="how much the stage timers and the sampling profiler slow a clip down")
+    ovh.add_argument("paths", nargs="+")
+    ovh.add_argument("--repeat", type=int, default=3)
+    ovh.add_argument("--batch-size", type=int, default=None)
+    ovh.add_argument("--skip-stride", type=int, default=None)
+    ovh.add_argument("--rim-lock", action="store_true", help="run the detector on crops around the locked rim")
+
+    args = parser.parse_args(argv)
+    #every run has to go through the detector, a cache hit would only time the replay.
+    #set before anything imports the cache settings, and only here so importing replay from the server leaves the cache on
+    os.environ.setdefault("DETECTION_CACHE", "0")
+    if args.command == "overhead":
+        options = {"batch_size": args.batch_size, "skip_stride": args.skip_stride, "rim_lock": True if args.rim_lock else None}
+        print(f"{'clip':<30} {'off s':>8} {'timers':>8} {'+profiler':>10}")
+        for path, _ in find_inputs(args.paths):
+            row = measure_overhead(path, options, args.repeat)
+            ovh_pct = row["overhead_percent"]
+            print(f"{row['clip']:<30} {row['wall_s']['off']:>8} {ovh_pct['timers']:>7}% {ovh_pct['timers+profiler']:>9}%")
+    elif args.command == "run":
+        options = {"batch_size": args.batch_size, "skip_stride": args.skip_stride,
+                   "rim_lock": True if args.rim_lock else None, "draw": args.draw}
+        report = run_benchmark(args.paths, options, args.repeat)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+        print(json.dumps(report["totals"], indent=4))
+        print(f"[BENCH] report written to {args.out}")
+    elif args.command == "record":
+        record(args.video, args.out or str(Path(args.video).with_suffix(REPLAY_EXTENSION)), args.fgm, args.fga)
+    elif args.command == "synth":
+        synthesize(args.out, args.shots, args.make_rate, args.seed, verify=not args.no_verify)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        sys.exit(0 if compare(base, new, args.max_slowdown) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Split and merge processing of long videos.
+The video is cut into segments that start on keyframes and each segment runs through process_video in its own
+process with its own tracker, so a long recording uses every core instead of one.
+
+Every segment owns a range of frames and only the events inside it count. It also starts decoding WARMUP_SECONDS
+before its range, so by the first frame it owns the tracker already follows the balls in the air and the rim,
+the same state a single pass over the video would have there. Events are merged in frame order, and a shot that
+was attempted at the end of one segment and finished in the next is counted once:
+the next segment's make or miss (or its own copy of the attempt) is matched to the open attempt before the cut.
+
+usage (from backend/):
+    python -m scripts.chunked practice.mp4 --workers 4
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+from scripts.detection_cache import DETECTION_CACHE, file_hash
+from scripts.jobs import MAX_JOBS
+
+#processes that work on the segments of one video, by default the cores are shared between the upload workers
+CHUNK_WORKERS = int(os.environ.get("CHUNK_WORKERS", max(1, (os.cpu_count() or 1) // MAX_JOBS)))
+#videos shorter than this are processed in a single pass, splitting them would cost more than it saves
+CHUNK_MIN_SECONDS = float(os.environ.get("CHUNK_MIN_SECONDS", 300))
+#uploads smaller than this keep decoding while they arrive instead of waiting for the whole file to be split
+CHUNK_MIN_MB = float(os.environ.get("CHUNK_MIN_MB", 100))
+#longest segment, a video is cut into at least one segment per worker
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", 120))
+#seconds every segment tracks before the frames it owns, longer than a shot and the rim forget time
+WARMUP_SECONDS = float(os.environ.get("SEGMENT_WARMUP_SECONDS", 6))
+
+#segment pools of this process, key: number of workers
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+class SegmentCapture:
+    """
+    capture that reads frames [read_start, own_end) of a video file, looks like a whole video to process_video.
+    With the hash of the file its detections are cached per segment, the file is only opened once a frame is needed,
+    so a segment replayed from the cache is never decoded.
+    """
+
+    def __init__(self, path, read_start, own_start, own_end, video_hash=None):
+        self.path = path
+        self.start = read_start
+        self.remaining = own_end - read_start
+        self.length = own_end - read_start
+        #what detection_cache.source_key keys this segment by, None to not cache it
+        self.segment = (video_hash, read_start, own_start, own_end) if video_hash is not None else None
+        self._cap = None
+
+    @property
+    def cap(self):
+        if self._cap is None:
+            self._cap = cv2.VideoCapture(str(self.path))
+            if self.start > 0:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+        return self._cap
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.length
+        return self.cap.get(prop)
+
+    def read(self):
+        if self.remaining <= 0:
+            return False, None
+        self.remaining -= 1
+        return self.cap.read()
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+
+
+def keyframes(path, fps):
+    #frame numbers of the keyframes, only keyframes are decoded, None when there is no ffmpeg to list them
+    from scripts.pipeline import find_ffmpeg
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None or not fps:
+        return None
+    try:
+        out = subprocess.run([ffmpeg, "-hide_banner", "-skip_frame", "nokey", "-i", str(path), "-an", "-vf", "showinfo", "-f", "null", "-"],
+                             capture_output=True, text=True, timeout=600).stderr
+    except (OSError, subprocess.SubprocessError):
+        return None
+    frames = sorted({round(float(t) * fps) for t in re.findall(r"pts_time:\s*([0-9.]+)", out)})
+    return frames or None
+
+
+def plan_segments(total_frames, fps, workers, keys=None, segment_seconds=SEGMENT_SECONDS, warmup_seconds=WARMUP_SECONDS):
+    """
+    Cut a video into segments, each (read_start, own_start, own_end), 0 based frame numbers, end exclusive.
+    Owned ranges cover every frame exactly once, with keyframes each cut is moved to the keyframe nearest to it
+    and decoding starts on the keyframe at or before the warm up.
+    """
+    if total_frames <= 0:
+        return []
+    count = max(workers, math.ceil(total_frames / max(1, segment_seconds * fps)))
+    length = total_frames / count
+    cuts = [round(i * length) for i in range(count)]
+    if keys:
+        cuts = [0] + sorted({min(keys, key=lambda k: abs(k - c)) for c in cuts[1:]} - {0})
+    warmup = round(warmup_seconds * fps)
+    segments = []
+    for i, own_start in enumerate(cuts):
+        own_end = cuts[i + 1] if i + 1 < len(cuts) else total_frames
+        read_start = max(0, own_start - warmup)
+        if keys and read_start > 0:
+            read_start = max([k for k in keys if k <= read_start], default=0)
+        segments.append((read_start, own_start, own_end))
+    return segments
+
+
+def _init_segment_worker(threads):
+    #split the cores between the segment processes instead of every process using all of them
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from scripts.model_registry import get_model
+    get_model("best", warmup=True)
+
+
+def segment_pool(workers):
+    """
+    Pool of segment processes (one per worker), started by the first long video and kept for the next ones
+    so every segment process loads and warms up the model once instead of once per video.
+    """
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            ctx = multiprocessing.get_context("spawn")
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_segment_worker, initargs=(threads,))
+            _pools[workers] = pool
+        return pool
+
+
+def _drop_pool(workers):
+    #a segment process died, the pool cannot take work anymore, the next video starts a new one
+    with _pool_lock:
+        pool = _pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_segment(path, read_start, own_start, own_end, options, video_hash=None, timed=False, profile=False):
+    #runs in a segment worker, returns its events with frame numbers of the whole video (counting from 1)
+    from scripts.shot_tracker import process_video
+    from scripts.metrics import StageTimer
+    from scripts.profiler import SamplingProfiler
+    events = []
+    cap = SegmentCapture(path, read_start, own_start, own_end, video_hash)
+    #stage times come back in the results, the job adds up the stages of every segment
+    timer = StageTimer() if timed else None
+    profiler = None
+    if profile:
+        with SamplingProfiler() as profiler:
+            results = process_video(cap, on_event=events.append, timer=timer, **options)
+    else:
+        results = process_video(cap, on_event=events.append, timer=timer, **options)
+    for event in events:
+        event["frame"] += read_start
+    return {"read_start": read_start, "own_start": own_start + 1, "own_end": own_end + 1,
+            "events": events, "results": results, "profile": profiler.state() if profiler is not None else None}
+
+
+def _event_deltas(events):
+    #how much each event added to FGM and FGA, events carry the running totals of their segment
+    fgm, fga, deltas = 0, 0, []
+    for event in events:
+        deltas.append((event["FGM"] - fgm, event["FGA"] - fga))
+        fgm, fga = event["FGM"], event["FGA"]
+    return deltas
+
+
+def _rim_key(event):
+    box = event.get("rim_box")
+    return None if box is None else ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+
+
+def stitch(segments, fps, cooldown_seconds=0.6, warmup_seconds=WARMUP_SECONDS):
+    """
+    Merge the owned events of every segment (in video order) into one stream with running FGM/FGA.
+    Returns (events, per rim counts).
+    """
+    from scripts.shot_tracker import ShotTracker
+    cooldown = cooldown_seconds * fps
+    window = warmup_seconds * fps
+    merged, fgm, fga = [], 0, 0
+    #attempts of the previous segment with no make or miss after them yet, [frame, rim id]
+    open_attempts = []
+    #rims of the whole video, [center, id], segments number their rims on their own
+    rims = []
+    rim_counts = {}
+
+    def global_rim(event):
+        center = _rim_key(event)
+        if center is None:
+            return event["rim"]
+        for known in rims:
+            if math.hypot(known[0][0] - center[0], known[0][1] - center[1]) < ShotTracker.RIM_MATCH_DISTANCE:
+                known[0] = center
+                return known[1]
+        rims.append([center, len(rims)])
+        return len(rims) - 1
+
+    for seg in segments:
+        own_start, own_end = seg["own_start"], seg["own_end"]
+        carried = [a for a in open_attempts if a[0] >= own_start - window]
+        pending = {}
+        #balls this segment saw attempted during its warm up
+        warm = set()
+        for event, (dfgm, dfga) in zip(seg["events"], _event_deltas(seg["events"])):
+            frame = event["frame"]
+            if frame < own_start:
+                if event["type"] == "attempt":
+                    warm.add(event["ball_id"])
+                else:
+                    warm.discard(event["ball_id"])
+                continue
+            if frame >= own_end:
+                continue
+            rim = global_rim(event)
+            #a shot that crossed the cut, the previous segment already counted the attempt
+            if carried and frame < own_start + window:
+                match = next((a for a in carried if a[1] == rim), None)
+                if match is not None and (event["type"] != "attempt" or frame - match[0] <= cooldown):
+                    carried.remove(match)
+                    warm.discard(event["ball_id"])
+                    dfga = 0
+                    if event["type"] == "attempt":
+                        #the same attempt seen again, only its make or miss is still to come
+                        pending[event["ball_id"]] = [frame, rim]
+                        continue
+            if event["type"] != "attempt" and event["ball_id"] in warm:
+                #attempted before the cut but the previous segment never counted it
+                warm.discard(event["ball_id"])
+                dfga = 1
+            fgm += dfgm
+            fga += dfga
+            counts = rim_counts.setdefault(rim, [0, 0])
+            counts[0] += dfgm
+            counts[1] += dfga
+            merged.append(dict(event, rim=rim, FGM=fgm, FGA=fga))
+            if event["type"] == "attempt":
+                pending[event["ball_id"]] = [frame, rim]
+            else:
+                pending.pop(event["ball_id"], None)
+        open_attempts = list(pending.values())
+    per_rim = [{"rim": rim_id, "FGM": m, "FGA": a} for rim_id, (m, a) in sorted(rim_counts.items())]
+    return merged, per_rim
+
+
+def _cache_result(segments):
+    #hit when every segment replayed from the cache, off when none was cached
+    states = {seg["results"]["cache"] for seg in segments}
+    if states == {"hit"}:
+        return "hit"
+    return "off" if states == {"off"} else "miss"
+
+
+def process_video_chunked(video_path, workers=CHUNK_WORKERS, progress=None, on_event=None, batch_size=None, skip_stride=None, rim_lock=None,
+                          timer=None, profiler=None):
+    """
+    process_video for a finished video file spread over workers processes, without an annotated output.
+    Videos shorter than CHUNK_MIN_SECONDS or a single worker fall back to process_video.
+    timer (metrics.StageTimer) gets the stage times of every segment, profiler (profiler.SamplingProfiler, not started)
+    the samples taken inside every segment process.
+    Returns the same keys as process_video plus "segments".
+    """
+    from scripts.shot_tracker import process_video, ShotTracker
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+    options = {"batch_size": batch_size, "skip_stride": skip_stride, "rim_lock": rim_lock}
+    if workers < 2 or total_frames == 0 or total_frames < CHUNK_MIN_SECONDS * fps:
+        if profiler is None:
+            return process_video(str(video_path), progress=progress, on_event=on_event, timer=timer, **options)
+        with profiler:
+            return process_video(str(video_path), progress=progress, on_event=on_event, timer=timer, **options)
+
+    start_time = time.perf_counter()
+    plan = plan_segments(total_frames, fps, workers, keyframes(video_path, fps))
+    #hashed once here instead of in every segment, each segment caches its detections under it
+    video_hash = file_hash(video_path) if DETECTION_CACHE else None
+    pool = segment_pool(workers)
+    segments, done = [None] * len(plan), 0
+    futures = {pool.submit(_run_segment, str(video_path), *seg, options, video_hash, timer is not None, profiler is not None): i
+               for i, seg in enumerate(plan)}
+    try:
+        for future in as_completed(futures):
+            i = futures[future]
+            segments[i] = future.result()
+            done += plan[i][2] - plan[i][1]
+            if progress is not None:
+                progress(done, total_frames)
+    except BrokenProcessPool:
+        _drop_pool(workers)
+        raise
+    finally:
+        #the pool outlives this video, a failed segment must not leave the others queued in it
+        for future in futures:
+            future.cancel()
+
+    events, per_rim = stitch(segments, fps, ShotTracker.COOLDOWN_SECONDS)
+    if on_event is not None:
+        for event in events:
+            on_event(event)
+    for i, seg in enumerate(segments):
+        if timer is not None:
+            for stage, s in seg["results"].get("stages", {}).items():
+                timer.add(stage, s["total_s"], s["calls"])
+        if profiler is not None:
+            profiler.merge(seg["profile"], prefix=f"segment {i}")
+    elapsed = time.perf_counter() - start_time
+    fgm = events[-1]["FGM"] if events else 0
+    fga = events[-1]["FGA"] if events else 0
+    frames = sum(seg["results"]["frames"] for seg in segments)
+    print(f"[CHUNKED] {total_frames} frames in {len(segments)} segments on {workers} workers, {elapsed:.2f}s, "
+          f"{total_frames / elapsed:.1f} frames/sec ({frames - total_frames} warm up frames), FGM={fgm}, FGA={fga}")
+    results = {"FGM": fgm, "FGA": fga, "rims": per_rim, "frames": total_frames,
+               "fps": round(total_frames / elapsed, 2) if elapsed > 0 else 0.0,
+               "skipped_frames": sum(seg["results"]["skipped_frames"] for seg in segments),
+               "cropped_frames": sum(seg["results"]["cropped_frames"] for seg in segments),
+               "cache": _cache_result(segments), "tracks": {k: sum(seg["results"]["tracks"][k] for seg in segments) for k in segments[0]["results"]["tracks"]},
+               "segments": [{"frames": [seg["own_start"], seg["own_end"]], "FGM": seg["results"]["FGM"], "FGA": seg["results"]["FGA"]}
+                            for seg in segments]}
+    if timer is not None:
+        results["stages"] = timer.summary()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="process a long video in parallel segments")
+    parser.add_argument("video")
+    parser.add_argument("--workers", type=int, default=max(2, CHUNK_WORKERS))
+    parser.add_argument("--compare", action="store_true", help="also run a single pass and compare the counts")
+    args = parser.parse_args()
+    results = process_video_chunked(args.video, args.workers)
+    print({k: results[k] for k in ("FGM", "FGA", "rims", "fps", "segments")})
+    if args.compare:
+        from scripts.shot_tracker import process_video
+        start = time.perf_counter()
+        single = process_video(args.video)
+        print(f"single pass FGM={single['FGM']} FGA={single['FGA']} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,146 @@
+"""
+Disk cache of raw per frame detections.
+Keyed by the hash of the video content, the hash of the model weights and the detector settings, so re-running a clip
+after changing tracking thresholds, or the same clip uploaded again, replays the tracker from the cache instead of
+running the model on every frame. Boxes are kept down to CACHE_MIN_CONF and filtered at the confidence threshold in use
+when they are replayed, so changing the threshold does not need the detector either. Entries are replay files (scripts.detections) and can also be fed to the benchmark.
+The cache is bounded in size, the least recently used entries are deleted first.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+from scripts.detections import save_detections, load_detections
+from scripts.ingest import COMPLETE
+
+#set to 0 to always run the detector
+DETECTION_CACHE = os.environ.get("DETECTION_CACHE", "1") == "1"
+CACHE_DIR = os.environ.get("DETECTION_CACHE_DIR", "cache/detections")
+#total size of the cache in megabytes before old entries are evicted
+CACHE_MAX_MB = float(os.environ.get("DETECTION_CACHE_MB", 1024))
+#lowest confidence of the boxes stored in the cache, a threshold under it runs the detector
+CACHE_MIN_CONF = float(os.environ.get("DETECTION_CACHE_MIN_CONF", 0.1))
+HASH_CHUNK = 1024 * 1024
+
+_weights_hashes = {}
+_lock = threading.Lock()
+
+
+def content_hash():
+    #hasher for video content, an upload hashed chunk by chunk as it arrives gets the same digest as file_hash of the file
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_hash(path):
+    h = content_hash()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def weights_hash(path):
+    #weights only change on deploy, hash each file once per process
+    if path not in _weights_hashes:
+        if os.path.isdir(path):
+            #exported OpenVINO models are a folder, hash every file in it
+            h = hashlib.blake2b(digest_size=16)
+            for f in sorted(Path(path).rglob("*")):
+                if f.is_file():
+                    h.update(file_hash(f).encode())
+            _weights_hashes[path] = h.hexdigest()
+        elif os.path.exists(path):
+            _weights_hashes[path] = file_hash(path)
+        else:
+            _weights_hashes[path] = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+    return _weights_hashes[path]
+
+
+def source_path(source):
+    #path of a video file that is fully there, None for cameras, live sources and uploads still arriving
+    if isinstance(source, (str, os.PathLike)):
+        return source if os.path.isfile(source) else None
+    state = getattr(source, "state", None)
+    if state is not None and state() == COMPLETE:
+        return source.name
+    return None
+
+
+def source_key(source):
+    """
+    Content key of a video source, None when it cannot be cached (cameras, live sources, uploads still arriving).
+    A segment of a long video (chunked.SegmentCapture) is the hash of the whole file plus the frames it covers.
+    """
+    segment = getattr(source, "segment", None)
+    if segment is not None:
+        video_hash, read_start, own_start, own_end = segment
+        return f"{video_hash}_f{read_start}-{own_start}-{own_end}"
+    path = source_path(source)
+    if path is None:
+        return None
+    #an upload was hashed by the request writing it, no need to read it back
+    digest = getattr(source, "digest", None)
+    return (digest() if digest is not None else None) or file_hash(path)
+
+
+def cache_key(video_key, model_path, rim_lock, imgsz=640):
+    #rim lock changes what the detector sees (crops at a smaller size), so runs with and without it are cached apart
+    return f"{video_key}_{weights_hash(model_path)[:16]}_m{CACHE_MIN_CONF:g}_s{imgsz}_r{int(bool(rim_lock))}"
+
+
+class DetectionCache:
+    def __init__(self, directory=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        self.dir = Path(directory)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def path(self, key):
+        return self.dir / f"{key}.npz"
+
+    def get(self, key):
+        """(frames, meta) for a cached video or None"""
+        path = self.path(key)
+        try:
+            frames, meta = load_detections(path)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        #touch the entry so eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return frames, meta
+
+    def put(self, key, frames, fps, width, height, locked_rims=None):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        #write to a temp file and rename so a reader never sees half an entry
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            save_detections(f, frames, fps, width, height, locked_rims=locked_rims)
+        os.replace(tmp, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        #delete least recently used entries until the cache fits in max_bytes
+        with _lock:
+            entries = []
+            for p in self.dir.glob("*.npz"):
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in entries)
+            for _, size, p in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        sizes = [p.stat().st_size for p in self.dir.glob("*.npz")] if self.dir.exists() else []
+        return {"entries": len(sizes), "size_mb": round(sum(sizes) / (1024 * 1024), 2), "max_mb": round(self.max_bytes / (1024 * 1024), 2)}
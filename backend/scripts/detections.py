@@ -0,0 +1,56 @@
+"""
+Per frame detections stored as one columnar .npz file.
+A replay file holds everything the tracker needs to run a video again without decoding it or running the model:
+the boxes of every frame plus the frame rate and size, and optionally the true FGM/FGA of the clip.
+
+columns (one row per box): frame (which frame it belongs to), label (index into labels), conf, box (x1, y1, x2, y2)
+optional locked_rim (one row per frame): the rim box the rim lock held when the tracker saw that frame, -1s when unlocked
+"""
+import numpy as np
+
+
+def to_columns(frames):
+    #frames is a list with the parsed boxes of every frame, [(label, conf, (x1, y1, x2, y2)), ...] per frame
+    labels = sorted({label for boxes in frames for label, _, _ in boxes})
+    index = {label: i for i, label in enumerate(labels)}
+    rows = [(f, index[label], conf, box) for f, boxes in enumerate(frames) for label, conf, box in boxes]
+    return {
+        "frame": np.array([r[0] for r in rows], dtype=np.int32),
+        "label": np.array([r[1] for r in rows], dtype=np.int16),
+        "conf": np.array([r[2] for r in rows], dtype=np.float32),
+        "box": np.array([r[3] for r in rows], dtype=np.int32).reshape(-1, 4),
+        "labels": np.array(labels, dtype=str),
+        "n_frames": len(frames),
+    }
+
+
+def from_columns(columns):
+    n_frames = int(columns["n_frames"])
+    labels = [str(label) for label in columns["labels"]]
+    frames = [[] for _ in range(n_frames)]
+    for f, label, conf, box in zip(columns["frame"].tolist(), columns["label"].tolist(),
+                                   columns["conf"].tolist(), columns["box"].tolist()):
+        frames[f].append((labels[label], conf, tuple(box)))
+    return frames
+
+
+def save_detections(path, frames, fps, width, height, fgm=None, fga=None, locked_rims=None):
+    meta = {"fps": fps, "width": width, "height": height}
+    #ground truth is optional, -1 means the clip is not labelled
+    meta["true_fgm"] = -1 if fgm is None else fgm
+    meta["true_fga"] = -1 if fga is None else fga
+    if locked_rims is not None:
+        meta["locked_rim"] = np.array([(-1, -1, -1, -1) if box is None else box for box in locked_rims], dtype=np.int32).reshape(-1, 4)
+    np.savez_compressed(path, **to_columns(frames), **meta)
+
+
+def load_detections(path):
+    """returns (frames, meta), meta has fps, width, height, FGM/FGA when the file is labelled and locked_rims when it has them"""
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files}
+    meta = {"fps": float(columns["fps"]), "width": int(columns["width"]), "height": int(columns["height"])}
+    if int(columns["true_fga"]) >= 0:
+        meta["FGM"], meta["FGA"] = int(columns["true_fgm"]), int(columns["true_fga"])
+    if "locked_rim" in columns:
+        meta["locked_rims"] = [None if box[0] < 0 else tuple(box) for box in columns["locked_rim"].tolist()]
+    return from_columns(columns), meta
@@ -0,0 +1,108 @@
+import io
+import os
+import time
+
+#upload states shared between the request writing the file and the worker decoding it
+UPLOADING, COMPLETE, ABORTED = "uploading", "complete", "aborted"
+#how long the reader waits between checks for new data
+POLL_INTERVAL = 0.02
+#give up on an upload that has not grown for this many seconds
+STALL_TIMEOUT = float(os.environ.get("UPLOAD_STALL_TIMEOUT", 60))
+
+
+class UploadAborted(Exception):
+    pass
+
+
+class GrowingFile(io.BufferedIOBase):
+    """
+    Read side of a file that is still being uploaded.
+    Reads block until the bytes they need have been written or the upload is over, so the decoder can start
+    as soon as the start of the video has arrived instead of waiting for the last byte.
+    upload is a shared dict with a "state" key, set to complete or aborted by the writer,
+    a "size" key with the final size of the file when the client sent it,
+    and a "hash" key the writer sets to the content hash of the file (detection_cache.content_hash) once it is complete.
+
+    Videos with the index (moov atom) at the front start decoding right away, videos with the index at the end
+    make the decoder seek there first, which waits until that part of the upload has arrived.
+    """
+
+    def __init__(self, path, upload):
+        super().__init__()
+        self.name = path
+        self.upload = upload
+        self.f = open(path, "rb")
+
+    def state(self):
+        return self.upload.get("state", UPLOADING)
+
+    def digest(self):
+        #content hash of the upload, None while it is still arriving
+        return self.upload.get("hash") if self.state() == COMPLETE else None
+
+    def _size(self):
+        return os.fstat(self.f.fileno()).st_size
+
+    def _wait_for(self, end):
+        #block until the file reaches end bytes or the upload is over
+        last_size, last_growth = -1, time.monotonic()
+        while True:
+            size = self._size()
+            if size >= end:
+                return
+            state = self.state()
+            if state == COMPLETE:
+                return
+            if state == ABORTED:
+                raise UploadAborted(self.name)
+            if size != last_size:
+                last_size, last_growth = size, time.monotonic()
+            elif time.monotonic() - last_growth > STALL_TIMEOUT:
+                raise UploadAborted(f"{self.name} stalled for {STALL_TIMEOUT}s")
+            time.sleep(POLL_INTERVAL)
+
+    def wait_complete(self):
+        self._wait_for(float("inf"))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        pos = self.f.tell()
+        if size is None or size < 0:
+            self.wait_complete()
+        else:
+            #return as soon as some of the requested bytes are there, the decoder asks again for the rest
+            self._wait_for(pos + 1)
+        return self.f.read(size)
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END and self.state() != COMPLETE:
+            #use the size the client announced, the decoder needs it to know the video data ends at the end of the file
+            #without it, -1 tells the decoder the input is a stream of unknown length
+            size = self.upload.get("size")
+            if size is None:
+                return -1
+            return self.f.seek(size + offset)
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def remove_file(path):
+    #delete a temp file, fine if it is already gone
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
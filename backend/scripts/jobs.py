@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+#how many videos are processed at the same time, one worker process each
+MAX_JOBS = int(os.environ.get("MAX_JOBS", 2))
+#uploads waiting for a free worker before new ones are turned away
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 16))
+#finished jobs kept around so their status can still be polled
+MAX_FINISHED_JOBS = 1000
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _init_worker():
+    #load the tracking model once when the worker process starts, every job in this worker reuses it
+    from scripts.model_registry import get_model
+    get_model("best", warmup=True)
+
+
+def _run_job(job_id, video_path, output_path, draw, progress, upload=None, profile=False):
+    #runs inside a worker process
+    from scripts.shot_tracker import process_video
+    from scripts.ingest import GrowingFile, UploadAborted, remove_file, ABORTED
+    from scripts.metrics import METRICS, StageTimer
+    from scripts.outputs import profile_path
+    from scripts.profiler import SamplingProfiler
+    from scripts.chunked import CHUNK_WORKERS, CHUNK_MIN_MB, process_video_chunked
+
+    def report(done, total):
+        progress[job_id] = (done, total)
+
+    progress[job_id] = (0, 0)
+    #with an upload the file is still being written, decode it as it arrives and delete it once done
+    source = GrowingFile(video_path, upload) if upload is not None else video_path
+    #stage times go back with the results and are added to the server's /metrics when the job finishes
+    timer = StageTimer() if METRICS else None
+    profiler = SamplingProfiler() if profile else None
+    try:
+        #long videos without an annotated output are split into segments that run on several cores,
+        #a big upload is waited for since the segments need the whole file, process_video_chunked decides if it is long enough
+        if not draw and CHUNK_WORKERS > 1 and (upload is None or (upload.get("size") or 0) >= CHUNK_MIN_MB * 1024 * 1024):
+            if upload is not None:
+                source.wait_complete()
+            #this process only waits for the segments, they are timed and sampled inside the segment processes
+            results = process_video_chunked(video_path, progress=report, timer=timer, profiler=profiler)
+        elif profiler is not None:
+            with profiler:
+                results = process_video(source, output_path=output_path, return_video=draw, progress=report, timer=timer)
+        else:
+            results = process_video(source, output_path=output_path, return_video=draw, progress=report, timer=timer)
+        if profiler is not None:
+            path = profile_path(job_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump(path)
+            results["profile"] = profiler.summary()
+        if upload is not None and upload.get("state") == ABORTED:
+            raise UploadAborted(video_path)
+        return results
+    finally:
+        if upload is not None:
+            source.close()
+            remove_file(video_path)
+
+
+class JobQueue:
+    """
+    Runs process_video in a pool of worker processes so long videos never block the event loop.
+    Job records live in this process, progress is written by the workers into a shared dict.
+    """
+
+    def __init__(self, max_workers=MAX_JOBS, max_queued=MAX_QUEUED_JOBS, on_done=None, on_failed=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        #called with (job, results) in this process when a job finishes
+        self.on_done = on_done
+        #called with the job when it fails
+        self.on_failed = on_failed
+        #spawn instead of fork, forking a process that already loaded torch can deadlock
+        ctx = multiprocessing.get_context("spawn")
+        self.manager = ctx.Manager()
+        self.progress = self.manager.dict()
+        self.pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx, initializer=_init_worker)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def pending(self):
+        #called from the /metrics and upload request threads while worker callbacks add and evict jobs
+        with self.lock:
+            return self._pending()
+
+    def _pending(self):
+        #self.lock must be held
+        return sum(1 for job in self.jobs.values() if job["status"] in (QUEUED, RUNNING))
+
+    def new_upload(self, size=None):
+        #shared upload state for a file that is still being written when its job is submitted
+        from scripts.ingest import UPLOADING
+        return self.manager.dict(state=UPLOADING, size=size)
+
+    def submit(self, video_path, output_path=None, draw=False, filename=None, upload=None, user_id=None, profile=False):
+        with self.lock:
+            pending = self._pending()
+            if pending >= self.max_workers + self.max_queued:
+                raise QueueFull(f"{pending} jobs already waiting")
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id,
+                "filename": filename,
+                "user_id": user_id,
+                "draw": draw,
+                "profile": profile,
+                "status": QUEUED,
+                "created": time.time(),
+                "finished": None,
+                "results": None,
+                "error": None,
+            }
+            self.jobs[job_id] = job
+        try:
+            future = self.pool.submit(_run_job, job_id, video_path, output_path, draw, self.progress, upload, profile)
+        except Exception:
+            #the pool is broken or shut down, the job never existed
+            with self.lock:
+                self.jobs.pop(job_id, None)
+            raise
+        #an upload is deleted by the worker, a job that never ran in one (broken pool, cancelled at shutdown) is cleaned up here
+        cleanup = video_path if upload is not None else None
+        future.add_done_callback(lambda f: self._finish(job_id, f, cleanup))
+        return job_id
+
+    def _finish(self, job_id, future, cleanup=None):
+        from scripts.ingest import remove_file
+        job = self.jobs[job_id]
+        try:
+            job["results"] = future.result()
+            job["status"] = DONE
+        except (Exception, CancelledError) as e:
+            job["error"] = repr(e)
+            job["status"] = FAILED
+        job["finished"] = time.time()
+        if cleanup is not None:
+            remove_file(cleanup)
+        try:
+            if job["status"] == DONE and self.on_done is not None:
+                self.on_done(job, job["results"])
+            elif job["status"] == FAILED and self.on_failed is not None:
+                self.on_failed(job)
+        except Exception as e:
+            print(f"[JOBS] callback failed for {job_id}: {e!r}")
+        self._evict()
+
+    def _evict(self):
+        #forget the oldest finished jobs once there are too many
+        with self.lock:
+            finished = [j for j in self.jobs.values() if j["status"] in (DONE, FAILED)]
+            for job in sorted(finished, key=lambda j: j["finished"])[:-MAX_FINISHED_JOBS]:
+                self.jobs.pop(job["job_id"], None)
+                self.progress.pop(job["job_id"], None)
+
+    def status(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        done, total = self.progress.get(job_id, (0, 0))
+        status = job["status"]
+        #the worker writes progress as soon as it picks the job up
+        if status == QUEUED and job_id in self.progress:
+            status = RUNNING
+        return {
+            "job_id": job_id,
+            "filename": job["filename"],
+            "status": status,
+            "frames_processed": done,
+            "total_frames": total,
+            "progress": round(done / total, 3) if total > 0 else 0.0,
+            "results": job["results"],
+            "error": job["error"],
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
@@ -0,0 +1,206 @@
+import collections
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+#how many recent latencies are kept for the percentiles
+LATENCY_WINDOW = 1000
+
+
+def parse_sources(text):
+    #"name=source,name=source" into {name: source}, entries without a name or a source are ignored
+    sources = {}
+    for item in text.split(","):
+        name, _, source = item.partition("=")
+        if name.strip() and source.strip():
+            sources[name.strip()] = source.strip()
+    return sources
+
+
+#cameras and streams on the server a live socket can track, "name=source" pairs like "court=0,gym=rtsp://10.0.0.5/stream"
+#clients only ever pick one by name, they never get to open a url or file of their choosing on the server
+LIVE_SOURCES = parse_sources(os.environ.get("LIVE_SOURCES", ""))
+
+
+class LatencyStats:
+    """rolling window of latencies in seconds with p50/p99 in milliseconds"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.values = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.values.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if not self.values:
+            return {"count": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+        arr = np.fromiter(self.values, dtype=np.float64) * 1000
+        return {
+            "count": self.count,
+            "p50_ms": round(float(np.percentile(arr, 50)), 1),
+            "p99_ms": round(float(np.percentile(arr, 99)), 1),
+            "max_ms": round(float(arr.max()), 1),
+        }
+
+
+class LatestFrameSource:
+    """
+    Capture like source for live tracking that only ever holds the newest frame.
+    Frames are pushed in (encoded bytes from the phone or arrays from a local camera), a push that arrives
+    before the tracker took the previous frame replaces it, so when inference falls behind old frames are
+    dropped instead of queueing up and the tracker always works on the most recent picture.
+    """
+
+    live = True
+
+    def __init__(self, fps=30.0):
+        self.fps = fps
+        self.cond = threading.Condition()
+        self.pending = None
+        self.closed = False
+        self.shape = None
+        #first frame, read early to learn the frame size and kept for the first read
+        self._first = None
+        #arrival time of each frame handed to the tracker, key: frame number starting at 1 like process_video
+        self.arrivals = {}
+        self.delivered = 0
+        self.received = 0
+        self.dropped = 0
+
+    def push(self, data):
+        #data is an encoded image (jpeg/png bytes) or a decoded BGR frame
+        with self.cond:
+            if self.closed:
+                return
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (data, time.perf_counter())
+            self.received += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def _next(self):
+        #wait for a frame, frames that fail to decode are dropped
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return None, None
+                data, arrived = self.pending
+                self.pending = None
+            #only the frames that are actually processed get decoded
+            frame = data if isinstance(data, np.ndarray) else cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                return frame, arrived
+            self.dropped += 1
+
+    def read(self):
+        if self._first is not None:
+            frame, arrived = self._first
+            self._first = None
+        else:
+            frame, arrived = self._next()
+        if frame is None:
+            return False, None
+        self.delivered += 1
+        self.arrivals[self.delivered] = arrived
+        #forget arrival times of frames well in the past
+        self.arrivals.pop(self.delivered - 10 * LATENCY_WINDOW, None)
+        return True, frame
+
+    def _peek_shape(self):
+        #the frame size is only known once the first frame has arrived
+        if self.shape is None:
+            self._first = self._next()
+            frame = self._first[0]
+            self.shape = frame.shape if frame is not None else (0, 0, 3)
+        return self.shape
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self._peek_shape()[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self._peek_shape()[0]
+        return 0
+
+    def isOpened(self):
+        return not self.closed
+
+    def release(self):
+        self.close()
+
+    def stats(self):
+        return {"received": self.received, "processed": self.delivered, "dropped": self.dropped}
+
+
+class LocalCameraFeed(threading.Thread):
+    """
+    reads a camera or stream on the server as fast as it produces frames and pushes them into a LatestFrameSource,
+    a video file is played back at its own frame rate so it behaves like a camera
+    """
+
+    def __init__(self, source, frames):
+        super().__init__(daemon=True)
+        self.cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        self.frames = frames
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if fps > 0:
+            frames.fps = fps
+        self.interval = 1.0 / frames.fps if os.path.isfile(str(source)) else 0.0
+        self.start()
+
+    def run(self):
+        try:
+            next_time = time.perf_counter()
+            while not self.frames.closed:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                if self.interval:
+                    next_time += self.interval
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+                self.frames.push(frame)
+        finally:
+            self.cap.release()
+            self.frames.close()
+
+
+class LiveSession:
+    """
+    Glue between a live frame source and the tracker.
+    Keeps frame to event latency for every attempt/make/miss and hands events to send as they happen.
+    """
+
+    def __init__(self, send, fps=30.0):
+        self.frames = LatestFrameSource(fps)
+        self.send = send
+        self.latency = LatencyStats()
+
+    def on_event(self, event):
+        arrived = self.frames.arrivals.get(event["frame"])
+        if arrived is not None:
+            latency = time.perf_counter() - arrived
+            self.latency.add(latency)
+            event["latency_ms"] = round(latency * 1000, 1)
+        self.send(event)
+
+    def summary(self, results):
+        return {
+            "type": "summary",
+            "FGM": results["FGM"],
+            "FGA": results["FGA"],
+            "FG_percent": round(results["FGM"] / results["FGA"], 2) * 100 if results["FGA"] > 0 else 0.0,
+            "frames": self.frames.stats(),
+            "event_latency": self.latency.summary(),
+        }
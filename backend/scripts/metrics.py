@@ -0,0 +1,126 @@
+import collections
+import contextlib
+import os
+import resource
+import sys
+import threading
+import time
+
+#set to 0 to run the pipeline without stage timers, /metrics then only has the counters
+METRICS = os.environ.get("METRICS", "1") == "1"
+PREFIX = "shot_tracker"
+
+#pipeline stages in the order a frame goes through them
+STAGES = ("decode", "inference", "association", "merge", "state_machine", "annotate", "encode")
+
+
+class StageTimer:
+    """
+    Wall time spent in each pipeline stage.
+    Stages run on different threads (decode and encode have their own), each stage is only ever added to from one thread.
+    """
+
+    def __init__(self):
+        self.totals = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+
+    def add(self, stage, seconds, calls=1):
+        self.totals[stage] += seconds
+        self.calls[stage] += calls
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self):
+        #seconds per stage and mean milliseconds per call, known stages first
+        names = [s for s in STAGES if s in self.totals] + sorted(s for s in self.totals if s not in STAGES)
+        return {name: {"total_s": round(self.totals[name], 4), "calls": self.calls[name],
+                       "mean_ms": round(self.totals[name] / self.calls[name] * 1000, 3) if self.calls[name] else 0.0}
+                for name in names}
+
+
+def peak_rss_mb():
+    #highest resident memory of this process so far, ru_maxrss is kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Metrics:
+    """
+    Counters and gauges of this server in the Prometheus text format, for /metrics.
+    Jobs run in worker processes, each returns its stage times and counters with its results and the server adds them
+    here when the job finishes, so a scrape never has to reach into the workers.
+    """
+
+    #name: (type, help)
+    METRICS = {
+        "stage_seconds_total": ("counter", "Wall time spent in each pipeline stage"),
+        "stage_calls_total": ("counter", "Times each pipeline stage ran"),
+        "frames_total": ("counter", "Frames processed"),
+        "frames_skipped_total": ("counter", "Frames the adaptive stride did not send to the detector"),
+        "frames_cropped_total": ("counter", "Frames the detector only saw the locked rim crop of"),
+        "tracks_created_total": ("counter", "Ball tracks started"),
+        "track_merges_total": ("counter", "New ball detections merged into a ball lost near the rim"),
+        "tracks_dropped_total": ("counter", "Ball tracks removed after going missing or leaving the frame"),
+        "track_frames_total": ("counter", "Active ball tracks summed over every frame, divide by frames_total for tracks per frame"),
+        "shots_total": ("counter", "Shots counted, by result"),
+        "detection_cache_total": ("counter", "Videos that replayed the detector from the cache, by result"),
+        "runs_total": ("counter", "Videos processed, by source and status"),
+        "jobs_pending": ("gauge", "Upload jobs queued or running"),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)
+        #gauges are read when scraped, name: function returning the value
+        self.gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] += value
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def observe_run(self, results, source="job", status="done"):
+        """add the results of one process_video run, results is None for a run that failed"""
+        self.inc("runs_total", source=source, status=status)
+        if not results:
+            return
+        for stage, s in results.get("stages", {}).items():
+            self.inc("stage_seconds_total", s["total_s"], stage=stage)
+            self.inc("stage_calls_total", s["calls"], stage=stage)
+        self.inc("frames_total", results.get("frames", 0))
+        self.inc("frames_skipped_total", results.get("skipped_frames", 0))
+        self.inc("frames_cropped_total", results.get("cropped_frames", 0))
+        tracks = results.get("tracks", {})
+        self.inc("tracks_created_total", tracks.get("tracks_created", 0))
+        self.inc("track_merges_total", tracks.get("merges", 0))
+        self.inc("tracks_dropped_total", tracks.get("tracks_dropped", 0))
+        self.inc("track_frames_total", tracks.get("track_frames", 0))
+        self.inc("shots_total", results.get("FGM", 0), result="made")
+        self.inc("shots_total", results.get("FGA", 0) - results.get("FGM", 0), result="missed")
+        if results.get("cache", "off") != "off":
+            self.inc("detection_cache_total", result=results["cache"])
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        for name, read in self.gauges.items():
+            values[(name, ())] = read()
+        lines = []
+        for name, (kind, text) in self.METRICS.items():
+            series = sorted((labels, v) for (n, labels), v in values.items() if n == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {PREFIX}_{name} {text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, v in series:
+                label_text = ",".join(f'{k}="{v_}"' for k, v_ in labels)
+                lines.append(f"{PREFIX}_{name}{{{label_text}}} {round(v, 6)}" if label_text else f"{PREFIX}_{name} {round(v, 6)}")
+        return "\n".join(lines) + "\n"
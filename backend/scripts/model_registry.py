@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+import numpy as np
+from scripts.utils import get_device
+from scripts.backends import INFERENCE_BACKEND, INFERENCE_IMGSZ, resolve_weights
+
+#all of the weights the backend uses, key: short name used in the code, value: path to the weights file
+MODEL_PATHS = {
+    "best": "model/best.pt",
+    "ball": "model/best_ball.pt",
+    "arc": "model/best_arc2.pt",
+    "pose": "yolov8n-pose.pt",
+}
+
+#models loaded and warmed up when the server starts, comma separated list of names from MODEL_PATHS
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", ",".join(MODEL_PATHS)).split(",")
+
+#size of the blank frame used to warm up a model so the first real frame does not pay for it
+WARMUP_SHAPE = (640, 640, 3)
+
+
+class ModelHandle:
+    """
+    Shared handle to one loaded YOLO model.
+    YOLO predictors keep internal state between calls so only one thread can run predict at a time,
+    the lock makes it safe to hand the same handle to every request in the worker.
+    """
+
+    def __init__(self, name, path, model, device, backend="torch", imgsz=INFERENCE_IMGSZ):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.device = device
+        self.backend = backend
+        #input size used unless a call asks for another one (the rim crops do)
+        self.imgsz = imgsz
+        self.lock = threading.Lock()
+        #seconds spent reading the weights from disk and building the model
+        self.load_time = 0.0
+        #seconds spent on the warm up prediction, 0 if never warmed up
+        self.warmup_time = 0.0
+        #how many predict calls went through this handle
+        self.calls = 0
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def predict(self, source, **kwargs):
+        kwargs.setdefault("imgsz", self.imgsz)
+        with self.lock:
+            self.calls += 1
+            return self.model.predict(source, device=self.device, verbose=False, **kwargs)
+
+    def warmup(self):
+        #run one prediction on a blank frame, first prediction allocates buffers and fuses layers
+        start = time.perf_counter()
+        self.predict(np.zeros(WARMUP_SHAPE, dtype=np.uint8))
+        self.warmup_time = time.perf_counter() - start
+        return self.warmup_time
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "backend": self.backend,
+            "imgsz": self.imgsz,
+            "device": self.device,
+            "load_time_s": round(self.load_time, 4),
+            "warmup_time_s": round(self.warmup_time, 4),
+            "calls": self.calls,
+        }
+
+
+#models loaded in this worker process, key: model name value: ModelHandle
+_models = {}
+_registry_lock = threading.Lock()
+
+
+def get_model(name="best", warmup=False):
+    """
+    Return the shared handle for a model, loading it the first time it is asked for.
+    Every later call in the same worker gets the same handle back without touching the disk.
+    """
+    handle = _models.get(name)
+    if handle is not None:
+        return handle
+    if name not in MODEL_PATHS:
+        raise KeyError(f"unknown model {name}")
+    with _registry_lock:
+        #another thread may have loaded it while this one waited on the lock
+        handle = _models.get(name)
+        if handle is None:
+            #the .pt weights, or their ONNX/OpenVINO export when another backend is configured
+            path = resolve_weights(MODEL_PATHS[name])
+            start = time.perf_counter()
+            #imported here so the tracker and the tools that replay detections do not need ultralytics
+            from ultralytics import YOLO
+            model = YOLO(path)
+            #exported models run on the cpu, that is the point of exporting them
+            device = get_device() if INFERENCE_BACKEND == "torch" else "cpu"
+            handle = ModelHandle(name, path, model, device, INFERENCE_BACKEND)
+            handle.load_time = time.perf_counter() - start
+            print(f"[MODEL] loaded {name} from {path} ({INFERENCE_BACKEND}) in {handle.load_time:.3f}s")
+            if warmup:
+                handle.warmup()
+                print(f"[MODEL] warmed up {name} in {handle.warmup_time:.3f}s")
+            _models[name] = handle
+    return handle
+
+
+def load_models(names=None):
+    """load and warm up models up front, used at server startup"""
+    names = PRELOAD_MODELS if names is None else names
+    return {name: get_model(name, warmup=True) for name in names if name}
+
+
+def model_stats():
+    """load and warm up timings for every model loaded in this worker"""
+    return {name: handle.stats() for name, handle in _models.items()}
@@ -0,0 +1,117 @@
+"""
+Track shots on several video sources (courts, cameras) at once with one detector.
+Every source gets its own decoder thread and its own ShotTracker, the frames of all sources are batched
+together into one predict call, so K courts cost one model in memory and batches stay full even when
+a single camera could not fill them.
+
+usage (from backend/): python -m scripts.multi_stream court1.mp4 court2.mp4 --batch 8
+"""
+import argparse
+import collections
+import json
+import time
+import cv2
+from scripts.model_registry import get_model
+from scripts.pipeline import FrameReader, open_capture
+from scripts.shot_tracker import ShotTracker, detect_frames, BATCH_SIZE
+
+
+class Stream:
+    """one source in the scheduler, its capture, decoder thread, tracker and frame counter"""
+
+    def __init__(self, index, source):
+        self.index = index
+        self.source = source
+        self.cap = open_capture(source)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.tracker = ShotTracker(fps, h)
+        #frames are handed out one at a time, the scheduler builds the batches across streams
+        self.reader = FrameReader(self.cap, 1)
+        self.frames = iter(self.reader)
+        self.frame_idx = 0
+
+    def next_frame(self):
+        #None once the source ran out
+        batch = next(self.frames, None)
+        return batch[0] if batch is not None else None
+
+    def close(self):
+        self.reader.close()
+        self.cap.release()
+
+    def results(self):
+        return {"stream": self.index, "source": str(self.source), "FGM": self.tracker.fgm, "FGA": self.tracker.fga,
+                "rims": self.tracker.per_rim(), "frames": self.frame_idx}
+
+
+class MultiStreamScheduler:
+    """
+    Round robin over the streams that still have frames, taking one frame from each in turn until the batch is full,
+    running the detector once on the whole batch and handing every result to the tracker of the stream it came from.
+    Each tracker still sees its own frames in order. A stream that runs out simply leaves the rotation.
+    A live camera that stalls holds up the other streams while the scheduler waits on it.
+    """
+
+    def __init__(self, sources, batch_size=None, on_event=None):
+        self.sources = list(sources)
+        self.batch_size = batch_size or max(BATCH_SIZE, len(self.sources))
+        #on_event gets every attempt/make/miss with a "stream" key added
+        self.on_event = on_event
+        self.batches = 0
+
+    def _fill(self, active):
+        batch = []
+        while len(batch) < self.batch_size and active:
+            stream = active[0]
+            active.rotate(-1)
+            frame = stream.next_frame()
+            if frame is None:
+                active.remove(stream)
+                continue
+            batch.append((stream, frame))
+        return batch
+
+    def run(self):
+        model = get_model("best")
+        streams = [Stream(i, source) for i, source in enumerate(self.sources)]
+        active = collections.deque(streams)
+        start_time = time.perf_counter()
+        try:
+            while True:
+                batch = self._fill(active)
+                if not batch:
+                    break
+                results = detect_frames(model, [frame for _, frame in batch], ShotTracker.CONF_THRESHOLD)
+                self.batches += 1
+                for (stream, _), boxes in zip(batch, results):
+                    stream.frame_idx += 1
+                    for event in stream.tracker.update(boxes, stream.frame_idx):
+                        if self.on_event is not None:
+                            event["stream"] = stream.index
+                            self.on_event(event)
+        finally:
+            for stream in streams:
+                stream.close()
+        elapsed = time.perf_counter() - start_time
+        frames = sum(stream.frame_idx for stream in streams)
+        proc_fps = frames / elapsed if elapsed > 0 else 0.0
+        print(f"[PERF] {len(streams)} streams, {frames} frames in {elapsed:.2f}s, {proc_fps:.1f} frames/sec (batch size {self.batch_size})")
+        return {"streams": [stream.results() for stream in streams], "frames": frames, "batches": self.batches,
+                "batch_size": self.batch_size, "elapsed": round(elapsed, 3), "fps": round(proc_fps, 2)}
+
+
+def process_streams(sources, batch_size=None, on_event=None):
+    return MultiStreamScheduler(sources, batch_size, on_event).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="track shots on several videos or cameras with one shared detector")
+    parser.add_argument("sources", nargs="+", help="video files, stream urls or camera indexes")
+    parser.add_argument("--batch", type=int, nargs="+", default=[None],
+                        help="frames per detector call across all streams, several values compare throughput")
+    args = parser.parse_args()
+    sources = [int(s) if s.isdigit() else s for s in args.sources]
+    for batch_size in args.batch:
+        results = process_streams(sources, batch_size)
+        print(json.dumps(results, indent=4))
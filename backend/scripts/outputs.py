@@ -0,0 +1,65 @@
+"""
+Annotated videos (and job profiles) in outputs/.
+A video is kept for OUTPUT_TTL seconds after it was last written or downloaded, then deleted by a periodic sweep.
+If the folder still grows past OUTPUT_MAX_MB the least recently used videos go first.
+"""
+import os
+import time
+from pathlib import Path
+
+OUTPUT_DIR = Path(os.environ.get("OUTPUT_DIR", "outputs"))
+#seconds a video is kept after it was last written or downloaded
+OUTPUT_TTL = float(os.environ.get("OUTPUT_TTL", 6 * 3600))
+#total size of outputs/ in megabytes before videos are deleted early
+OUTPUT_MAX_MB = float(os.environ.get("OUTPUT_MAX_MB", 5120))
+#seconds between sweeps
+SWEEP_SECONDS = float(os.environ.get("OUTPUT_SWEEP_SECONDS", 300))
+#a video written to in the last minute is still being encoded, the size limit never deletes it
+IN_PROGRESS_SECONDS = 60
+
+
+def output_path(filename):
+    #where the annotated video of an upload is written, only the name part of filename is used
+    return OUTPUT_DIR / f"processed_{Path(filename).name}"
+
+
+def profile_path(job_id):
+    #sampling profile of a job, kept and expired like the videos
+    return OUTPUT_DIR / f"profile_{job_id}.folded"
+
+
+def touch(path):
+    #a download counts as use, the video is kept for another OUTPUT_TTL
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_outputs(directory=OUTPUT_DIR, ttl=OUTPUT_TTL, max_mb=OUTPUT_MAX_MB, now=None):
+    """delete expired videos, then the least recently used ones while the folder is over max_mb, returns how many were deleted"""
+    now = time.time() if now is None else now
+    entries = []
+    for p in Path(directory).glob("*"):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        if p.is_file():
+            entries.append((st.st_mtime, st.st_size, p))
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    max_bytes = int(max_mb * 1024 * 1024)
+    for mtime, size, p in sorted(entries, key=lambda e: e[0]):
+        expired = now - mtime > ttl
+        if not expired and (total <= max_bytes or now - mtime < IN_PROGRESS_SECONDS):
+            continue
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        print(f"[OUTPUTS] deleted {removed} videos, {total / (1024 * 1024):.1f}MB left")
+    return removed
@@ -0,0 +1,270 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+import cv2
+import numpy as np
+
+#how many items each stage can hold before the stage feeding it has to wait, keeps memory flat on long videos
+QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 4))
+
+#annotated videos are encoded to H.264 by ffmpeg, FFMPEG_PATH picks the binary, set it to 0 to always use OpenCV's encoder
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH")
+#x264 quality (lower is better and bigger) and speed preset
+VIDEO_CRF = int(os.environ.get("VIDEO_CRF", 26))
+VIDEO_PRESET = os.environ.get("VIDEO_PRESET", "veryfast")
+#seconds between keyframes, every keyframe starts a new fragment a player can start from
+KEYFRAME_SECONDS = 2
+
+#marks the end of a stream between stages
+_DONE = object()
+
+
+def open_capture(source):
+    """
+    Open a video source, a camera index, a file path, a capture like object or a readable file object.
+    File objects are decoded as a stream (OpenCV 4.10+), older OpenCV builds wait for the whole file and open it by path.
+    """
+    if source is None:
+        return cv2.VideoCapture(0)
+    #already something that reads like a capture, such as a live frame source
+    if hasattr(source, "isOpened"):
+        return source
+    if isinstance(source, (int, str, os.PathLike)):
+        return cv2.VideoCapture(source)
+    try:
+        return cv2.VideoCapture(source, cv2.CAP_FFMPEG, [])
+    except (TypeError, cv2.error):
+        source.wait_complete()
+        return cv2.VideoCapture(source.name)
+
+
+def read_batches(cap, batch_size, timer=None):
+    #decode up to batch_size frames at a time, the last batch can be smaller when the video runs out
+    batch = []
+    while True:
+        if timer is not None:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            timer.add("decode", time.perf_counter() - start)
+        else:
+            ret, frame = cap.read()
+        if not ret:
+            break
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def draw_overlay(frame, overlay):
+    """
+    Draw the annotations the tracker collected for a frame.
+    overlay keys: rims [(x1, y1, x2, y2)], balls [(x, y)], tracks [(ball id, int32 (n, 2) trajectory)], score (fgm, fga) or None
+    """
+    for (x1, y1, x2, y2) in overlay["rims"]:
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 2)
+    for center in overlay["balls"]:
+        cv2.circle(frame, center, 4, (0,0,255), -1)
+    #all trajectories, the path that connects the ball positions, in one call
+    cv2.polylines(frame, [traj for _, traj in overlay["tracks"]], False, (0,0,255), 2)
+    for bid, traj in overlay["tracks"]:
+        #label the ball id on the video
+        cx, cy = traj[-1]
+        cv2.putText(frame, f"ID {bid}", (int(cx)+10, int(cy)-10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,0), 1)
+    if overlay["score"] is not None:
+        fgm, fga = overlay["score"]
+        cv2.putText(frame, f"FGM/FGA: {fgm}/{fga}", (40, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,255), 2)
+    return frame
+
+
+def new_overlay():
+    return {"rims": [], "balls": [], "tracks": [], "score": None}
+
+
+@lru_cache(maxsize=1)
+def find_ffmpeg():
+    #ffmpeg binary that can encode H.264, from FFMPEG_PATH, the PATH or the imageio-ffmpeg package, None when there is none
+    if FFMPEG_PATH == "0":
+        return None
+    path = FFMPEG_PATH or shutil.which("ffmpeg")
+    if path is None:
+        try:
+            import imageio_ffmpeg
+            path = imageio_ffmpeg.get_ffmpeg_exe()
+        except (ImportError, RuntimeError):
+            return None
+    try:
+        encoders = subprocess.run([path, "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return path if "libx264" in encoders else None
+
+
+class FFmpegWriter:
+    """
+    Drop in for cv2.VideoWriter that pipes raw frames into ffmpeg and encodes H.264 as fragmented MP4.
+    The header is written first and every keyframe starts a new fragment, so a player can start on the file
+    before it is complete instead of waiting for the index mp4v writes at the very end.
+    """
+
+    def __init__(self, path, fps, size, ffmpeg, crf=VIDEO_CRF, preset=VIDEO_PRESET):
+        w, h = size
+        fps = fps if fps and fps > 0 else 30.0
+        cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", f"{fps:g}", "-i", "-",
+               #yuv420p is what phones can play and it needs an even width and height
+               "-vf", "crop=trunc(iw/2)*2:trunc(ih/2)*2", "-pix_fmt", "yuv420p",
+               "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-g", str(max(1, round(fps * KEYFRAME_SECONDS))),
+               "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", str(path)]
+        self.path = path
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.release()
+
+    def release(self):
+        if self.proc.stdin.closed:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        err = self.proc.stderr.read().decode(errors="replace").strip()
+        self.proc.stderr.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.path}: {err}")
+
+
+def open_writer(path, fps, size):
+    """
+    Video writer for the annotated output, H.264 through ffmpeg when it is available,
+    otherwise OpenCV's H.264 (avc1) encoder and mp4v as the last resort
+    """
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is not None:
+        return FFmpegWriter(path, fps, size, ffmpeg)
+    for codec in ("avc1", "mp4v"):
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            return writer
+    raise RuntimeError(f"could not open a video writer for {path}")
+
+
+class _Stage(threading.Thread):
+    """
+    Base for a pipeline thread connected to the rest of the pipeline by one bounded queue.
+    Errors raised inside the thread are kept and re-raised in the thread that owns the stage.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def _put(self, item):
+        #block while the queue is full (backpressure) but give up once the stage is being stopped
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+
+class FrameReader(_Stage):
+    """decoder thread, reads batches of frames from the capture ahead of the inference stage"""
+
+    def __init__(self, cap, batch_size, maxsize=QUEUE_SIZE, timer=None):
+        super().__init__(maxsize)
+        self.cap = cap
+        self.batch_size = batch_size
+        self.timer = timer
+        self.start()
+
+    def run(self):
+        try:
+            for batch in read_batches(self.cap, self.batch_size, self.timer):
+                if not self._put(batch):
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(_DONE)
+
+    def __iter__(self):
+        while True:
+            batch = self.queue.get()
+            if batch is _DONE:
+                self._raise_error()
+                return
+            yield batch
+
+    def close(self):
+        #stop decoding and empty the queue so the thread is not stuck waiting on a full queue
+        self.stop_event.set()
+        while self.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.join()
+
+
+class VideoEncoder(_Stage):
+    """annotation and encoder thread, draws the overlay on each frame and writes it to the video writer"""
+
+    def __init__(self, writer, maxsize=QUEUE_SIZE, timer=None):
+        super().__init__(maxsize)
+        self.writer = writer
+        self.timer = timer
+        self.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            #keep draining after an error so the tracker never blocks on a full queue
+            if self.error is not None:
+                continue
+            frame, overlay = item
+            try:
+                if self.timer is not None:
+                    with self.timer.stage("annotate"):
+                        frame = draw_overlay(frame, overlay)
+                    with self.timer.stage("encode"):
+                        self.writer.write(frame)
+                else:
+                    self.writer.write(draw_overlay(frame, overlay))
+            except Exception as e:
+                self.error = e
+
+    def write(self, frame, overlay):
+        self._raise_error()
+        self._put((frame, overlay))
+
+    def close(self):
+        self.queue.put(_DONE)
+        self.join()
+        self.writer.release()
+        self._raise_error()
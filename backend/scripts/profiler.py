@@ -0,0 +1,80 @@
+"""
+Sampling profiler for a single job, standard library only.
+A background thread looks at the stack of every other thread in the process every interval seconds and counts
+how often each stack was seen. The dump is in the collapsed stack format ("thread;outer;...;inner count" per line)
+that flamegraph.pl and speedscope.app read. A worker process runs one job at a time, so every sample belongs to the
+job, its decoder and encoder threads included. A long video split into segments is sampled inside every segment
+process, their state() is merged into the profiler of the job.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+#seconds between samples
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.01))
+#deepest stack kept, deeper frames are cut off at the outer end
+MAX_DEPTH = 64
+
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True, name="profiler")
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        #time spent taking samples, the work the profiler adds on top of the job
+        self.overhead = 0.0
+        self.elapsed = 0.0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            start = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            self.overhead += time.perf_counter() - start
+
+    def __enter__(self):
+        self.elapsed = time.perf_counter()
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.join()
+        self.elapsed = time.perf_counter() - self.elapsed
+
+    def summary(self):
+        return {"samples": self.samples, "interval_ms": self.interval * 1000, "overhead_s": round(self.overhead, 4),
+                "overhead_percent": round(self.overhead / self.elapsed * 100, 2) if self.elapsed > 0 else 0.0}
+
+    def state(self):
+        #plain data a profiler in another process sends back to be merged into the profiler of the job
+        return {"stacks": dict(self.stacks), "samples": self.samples, "overhead": self.overhead, "elapsed": self.elapsed}
+
+    def merge(self, state, prefix=None):
+        #add the samples of another profiler, prefix becomes the outermost frame of its stacks to tell them apart
+        for stack, count in state["stacks"].items():
+            self.stacks[f"{prefix};{stack}" if prefix else stack] += count
+        self.samples += state["samples"]
+        self.overhead += state["overhead"]
+        self.elapsed += state["elapsed"]
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
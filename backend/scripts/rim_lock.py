@@ -0,0 +1,158 @@
+import math
+import os
+import cv2
+import numpy as np
+from scripts.utils import rim_zone
+from scripts.backends import INFERENCE_IMGSZ
+
+#lock the rim after it was detected this many full frames in a row without moving
+STABLE_FRAMES = int(os.environ.get("RIM_STABLE_FRAMES", 10))
+#how far in pixels the rim box corners can move between detections and still count as the same rim
+STABLE_TOLERANCE = 6
+#run a full frame detection every this many frames even when the drift check is quiet
+RECHECK_EVERY = int(os.environ.get("RIM_RECHECK_EVERY", 90))
+#unlock after this many full frame rechecks in a row could not find the rim
+MAX_MISSED_CHECKS = 3
+#extra pixels around the rim zone that are kept in the crop so balls are picked up before they reach the zone
+ROI_PAD = int(os.environ.get("RIM_ROI_PAD", 200))
+#mean absolute difference of the rim patch (0-255) that counts as the camera or hoop moving
+DRIFT_THRESHOLD = 25.0
+#size the rim patch is shrunk to for the drift check, keeps the check to a few hundred pixels
+PATCH_SIZE = (32, 16)
+#rim boxes further apart than this in pixels are two different rims, not two detections of one
+SEPARATE_RIMS = 100
+#detector input size used on full frames, crops are scaled to keep the same pixels per object
+FULL_IMGSZ = INFERENCE_IMGSZ
+
+
+def _box_shift(a, b):
+    return max(abs(p - q) for p, q in zip(a, b))
+
+
+class RimLock:
+    """
+    Rim localisation cache for fixed camera sessions.
+    Once the rim has been detected in the same place for STABLE_FRAMES full frames the box is locked,
+    after that the detector only sees a crop around the rim until a recheck is due or the drift check fires.
+    """
+
+    def __init__(self, frame_shape):
+        self.frame_h, self.frame_w = frame_shape[:2]
+        self.rim_box = None
+        self.locked = False
+        #how many full frames in a row saw the rim in the same place
+        self.stable = 0
+        self.missed_checks = 0
+        self.since_check = 0
+        self.drifted = False
+        self.reference = None
+        #frames that went through the detector as a crop instead of the full frame
+        self.cropped = 0
+
+    def _patch(self, frame):
+        rx1, ry1, rx2, ry2 = self.rim_box
+        patch = frame[max(0, ry1):max(0, ry2), max(0, rx1):max(0, rx2)]
+        if patch.size == 0:
+            return None
+        gray = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY) if patch.ndim == 3 else patch
+        return cv2.resize(gray, PATCH_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def check_drift(self, frame):
+        #cheap check that the pixels under the locked rim still look like the rim did when it was locked
+        if not self.locked or self.reference is None:
+            return False
+        patch = self._patch(frame)
+        if patch is None or float(np.mean(np.abs(patch - self.reference))) > DRIFT_THRESHOLD:
+            self.drifted = True
+        return self.drifted
+
+    def needs_full_frame(self, frame):
+        #decides per frame if the detector gets the whole frame or only the crop around the rim
+        if not self.locked:
+            return True
+        self.since_check += 1
+        if self.since_check >= RECHECK_EVERY or self.check_drift(frame):
+            #the full frame is planned here, a batch decides all of its frames before observe sees the result,
+            #so start counting again right away and the frames after it in the batch can still be crops
+            self.since_check = 0
+            self.drifted = False
+            return True
+        return False
+
+    def roi(self):
+        #crop box (x1, y1, x2, y2) around the locked rim, the rim zone used by detect_up and the merge logic plus padding
+        zx1, zy1, zx2, zy2 = rim_zone(self.rim_box)
+        x1 = max(0, int(zx1) - ROI_PAD)
+        y1 = max(0, int(zy1) - ROI_PAD)
+        x2 = min(self.frame_w, int(zx2) + ROI_PAD)
+        y2 = min(self.frame_h, int(zy2) + ROI_PAD)
+        return x1, y1, x2, y2
+
+    def roi_imgsz(self):
+        #shrink the detector input along with the crop so objects keep the same size in pixels as on a full frame
+        x1, y1, x2, y2 = self.roi()
+        scale = FULL_IMGSZ / max(self.frame_w, self.frame_h)
+        size = max(x2 - x1, y2 - y1) * scale
+        return min(FULL_IMGSZ, max(160, int(math.ceil(size / 32)) * 32))
+
+    def observe(self, frame, rim_boxes):
+        """update the lock from the rim boxes found on a full frame"""
+        self.since_check = 0
+        self.drifted = False
+        if not rim_boxes:
+            if self.locked:
+                self.missed_checks += 1
+                if self.missed_checks >= MAX_MISSED_CHECKS:
+                    self.unlock()
+            else:
+                self.stable = 0
+            return
+        self.missed_checks = 0
+        #the crop only covers one rim, with several rims in view every frame has to be a full frame
+        if any(_box_shift(b, rim_boxes[0]) > SEPARATE_RIMS for b in rim_boxes[1:]):
+            self.unlock()
+            return
+        #keep the rim closest to the current one
+        box = rim_boxes[-1] if self.rim_box is None else min(rim_boxes, key=lambda b: _box_shift(b, self.rim_box))
+        if self.rim_box is not None and _box_shift(box, self.rim_box) <= STABLE_TOLERANCE:
+            self.stable += 1
+            if self.locked:
+                return
+        else:
+            #rim moved, start counting again from the new position
+            self.unlock()
+            self.stable = 1
+        self.rim_box = box
+        if self.stable >= STABLE_FRAMES:
+            self.locked = True
+            self.reference = self._patch(frame)
+            print(f"[RIM] locked at {self.rim_box}")
+
+    def unlock(self):
+        if self.locked:
+            print(f"[RIM] unlocked from {self.rim_box}")
+        self.locked = False
+        self.stable = 0
+        self.reference = None
+
+
+class ReplayedRimLock:
+    """
+    Stands in for RimLock when the detections come from the cache.
+    The tracker overrides the rim with the locked box, so a replay has to lock and unlock on the same frames as the run
+    that was recorded. boxes has the locked rim box of every frame of that run, None where it was not locked.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.rim_box = None
+        self.locked = False
+        #nothing goes through the detector in a replay
+        self.cropped = 0
+
+    def seek(self, frame_idx):
+        #frame_idx counts from 1 like the tracker's
+        box = self.boxes[frame_idx - 1] if frame_idx <= len(self.boxes) else None
+        self.locked = box is not None
+        if box is not None:
+            self.rim_box = box
@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+#sqlite file with every logged session
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.db")
+#user for sessions logged without one, the app does not have accounts yet
+DEFAULT_USER = "default"
+#most sessions a single history page returns
+MAX_PAGE_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created TEXT NOT NULL,
+    day TEXT NOT NULL,
+    fgm INTEGER NOT NULL,
+    fga INTEGER NOT NULL,
+    filename TEXT,
+    job_id TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS sessions_by_user_time ON sessions (user_id, created, id);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    fgm INTEGER NOT NULL,
+    fga INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    imported TEXT NOT NULL
+);
+"""
+
+
+def fg_percent(fgm, fga):
+    #fraction of shots made, same rounding the old shot log used
+    return round(fgm / fga, 2) if fga > 0 else 0.0
+
+
+class SessionStore:
+    """
+    Shot history in sqlite.
+    Every insert also updates the per user per day totals in the same transaction, so the stats chart reads a
+    handful of precomputed rows instead of scanning every session. Each thread gets its own connection,
+    WAL mode lets reads run while a write is in progress.
+    History pages use a cursor (created time and id of the last row) so reading page n does not scan the n - 1 before it.
+    """
+
+    def __init__(self, path=SESSION_DB):
+        self.path = path
+        self.local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def add_session(self, fgm, fga, user_id=None, filename=None, job_id=None, created=None):
+        """log one session, returns its id, logging the same job twice keeps the first one"""
+        conn = self._conn()
+        with conn:
+            return self._insert(conn, fgm, fga, user_id, filename, job_id, created)
+
+    def _insert(self, conn, fgm, fga, user_id=None, filename=None, job_id=None, created=None):
+        #the caller holds the transaction
+        user_id = user_id or DEFAULT_USER
+        created = created or datetime.now().isoformat()
+        day = created[:10]
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO sessions (user_id, created, day, fgm, fga, filename, job_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, created, day, fgm, fga, filename, job_id))
+        if cur.rowcount == 0:
+            return None
+        conn.execute(
+            "INSERT INTO daily_stats (user_id, day, sessions, fgm, fga) VALUES (?, ?, 1, ?, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET sessions = sessions + 1, fgm = fgm + excluded.fgm, fga = fga + excluded.fga",
+            (user_id, day, fgm, fga))
+        return cur.lastrowid
+
+    def history(self, user_id=None, start=None, end=None, limit=100, cursor=None):
+        """
+        Sessions of a user, optionally between start and end (iso dates or times, end is exclusive).
+        Returns the newest limit sessions in date order and a cursor for the page of older sessions, None on the last page.
+        A cursor that history did not hand out raises ValueError.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = "SELECT id, created, fgm, fga, filename FROM sessions WHERE user_id = ?"
+        args = [user_id or DEFAULT_USER]
+        if start:
+            query += " AND created >= ?"
+            args.append(start)
+        if end:
+            query += " AND created < ?"
+            args.append(end)
+        if cursor:
+            created, sep, last_id = cursor.rpartition("|")
+            if not sep or not created or not last_id.isdigit():
+                raise ValueError(f"malformed cursor {cursor!r}")
+            query += " AND (created, id) < (?, ?)"
+            args += [created, int(last_id)]
+        query += " ORDER BY created DESC, id DESC LIMIT ?"
+        args.append(limit + 1)
+        rows = self._conn().execute(query, args).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        sessions = [{"id": r["id"], "date": r["created"], "FGM": r["fgm"], "FGA": r["fga"],
+                     "FG_percent": fg_percent(r["fgm"], r["fga"]), "filename": r["filename"]} for r in reversed(rows)]
+        next_cursor = f"{rows[-1]['created']}|{rows[-1]['id']}" if more else None
+        return sessions, next_cursor
+
+    def stats(self, user_id=None, period="day", start=None, end=None):
+        """FGM, FGA and FG% per day or per week (weeks start on monday) from the precomputed daily totals"""
+        if period == "week":
+            #monday of the week the day falls in
+            bucket = "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')"
+        elif period == "day":
+            bucket = "day"
+        else:
+            raise ValueError(f"unknown period {period}")
+        query = f"SELECT {bucket} AS period, SUM(sessions) AS sessions, SUM(fgm) AS fgm, SUM(fga) AS fga FROM daily_stats WHERE user_id = ?"
+        args = [user_id or DEFAULT_USER]
+        if start:
+            query += " AND day >= ?"
+            args.append(start[:10])
+        if end:
+            query += " AND day < ?"
+            args.append(end[:10])
+        query += " GROUP BY period ORDER BY period"
+        return [{"period": r["period"], "sessions": r["sessions"], "FGM": r["fgm"], "FGA": r["fga"],
+                 "FG_percent": fg_percent(r["fgm"], r["fga"])} for r in self._conn().execute(query, args)]
+
+    def count(self, user_id=None):
+        row = self._conn().execute("SELECT COALESCE(SUM(sessions), 0) FROM daily_stats WHERE user_id = ?", (user_id or DEFAULT_USER,)).fetchone()
+        return row[0]
+
+    def import_json(self, path):
+        """
+        Move sessions from the old shot_log.json into the store, once.
+        Every uvicorn worker runs this on startup. The import takes the write lock up front and leaves a marker row
+        in the same transaction, so only the first worker imports and the others see the marker and skip it.
+        The file is renamed afterwards so the next start does not read it again.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        #process_video used to overwrite the log with a bare {"FGM", "FGA"} that has no date
+        records = [r for r in (data if isinstance(data, list) else [data]) if isinstance(r, dict) and "date" in r]
+        source = os.path.abspath(path)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM imports WHERE source = ?", (source,)).fetchone() is not None:
+                conn.rollback()
+                imported = 0
+            else:
+                for r in records:
+                    self._insert(conn, int(r.get("FGM", 0)), int(r.get("FGA", 0)), created=r["date"])
+                conn.execute("INSERT INTO imports (source, sessions, imported) VALUES (?, ?, ?)",
+                             (source, len(records), datetime.now().isoformat()))
+                conn.commit()
+                imported = len(records)
+        except BaseException:
+            conn.rollback()
+            raise
+        try:
+            os.replace(path, path + ".imported")
+        except FileNotFoundError:
+            #another worker renamed it first
+            pass
+        if imported:
+            print(f"[SESSIONS] imported {imported} sessions from {path}")
+        return imported
@@ -1,332 +1,644 @@
 import cv2
 import math
-import json
+import os
+import time
 import numpy as np
-import torch
-from ultralytics import YOLO
-from scripts.utils import get_device, smooth_point, detect_up, detect_down, score_prediction
+from scripts.utils import smooth_point, in_rim_zone, interpolate_points
+from scripts.model_registry import get_model
+from scripts.pipeline import FrameReader, VideoEncoder, new_overlay, open_capture, open_writer, read_batches
+from scripts.rim_lock import RimLock, ReplayedRimLock
+from scripts.ball_tracks import BallTracks, INIT, ATTEMPTING, MADE, MISSED
+from scripts.detection_cache import DetectionCache, DETECTION_CACHE, CACHE_MIN_CONF, cache_key, source_key
 from pathlib import Path
 
-def process_video(video_path=None, output_path=None, return_video=False):
-    #process video
-    #load the device 
-    device = get_device()
-    #load trained ball and rim tracking model 
-    model = YOLO("model/best.pt")
-    out = None
-    #load video to be processed 
-    if not video_path:
-        cap = cv2.VideoCapture(0)
-    elif video_path:
-        cap = cv2.VideoCapture(video_path)
-
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    w, h = int(cap.get(3)), int(cap.get(4))
-
-    #location to write labeled video to 
-    if return_video:
-        Path("outputs").mkdir(exist_ok=True)
-        out = cv2.VideoWriter(output_path,
-                            cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
-
-
-    #keep track of ball ids
-    #missing frames keeps track of how long a ball disappears for and handles cases where ball is reassigned a new id
-    #last_state keeps track of state of ball being attempted, made, missed
-    #balls dictionary key:ball id, values: [(x,y)]
-    #missing_frames keeps track of how many frames a ball disappeared key:ball_id value: counter for how many times for each frame the ball id is not present in a row before being detected again
-    #last_state keeps track of key:ball ID, value: the ball state as in init, attempted, made, missed
-    balls, missing_frames, last_state = {}, {}, {}
-
-    #velocity keeps track of the speed of the ball being shot
-    #cooldowns prevents balls from being count as a double make or miss
-    #velcity key: ball id and values (vx, vy) the velcoity spped for each ball 
-    #cooldowns prevents the ball from being counted by a double shot in the cooldown window, key:ball id value: frame the ball was last counted as make/miss attempt
-    velocity, cooldowns = {}, {}
-
-    #at each frame make sure the rim is in frame by calculating the rim_box and rim_center if not the bypass current frame because you 
-    #cannot check if a shot is made or missed if the rim is out of frame
-    rim_box, rim_center = None, None
-
-    #counters for shot attemps and made through whole duration
-    fgm, fga = 0, 0
-    #count for how many frames have passed by 
-    frame_idx = 0
-
-    #cooldown for ball between shot attempts
-    COOLDOWN_FRAMES = int(fps * 0.6)
+#how many frames are decoded ahead and sent through the detector as one batch
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 8))
+#run inference on every k-th frame while no ball is near the rim, 1 runs every frame
+SKIP_STRIDE = int(os.environ.get("SKIP_STRIDE", 1))
+#lock the rim once it stops moving and only run the detector on a crop around it, off by default like frame skipping
+#because the crop changes what the detector sees, set to 1 to turn it on
+RIM_LOCK = os.environ.get("RIM_LOCK", "0") == "1"
+#how often in frames the progress callback is called
+PROGRESS_EVERY = 30
+
+
+class AdaptiveStride:
+    """
+    Decides which frames go through the detector.
+    Until a rim is found, or while any ball is in the zone around the rim, every frame is inferred.
+    Otherwise only every k-th frame is, nothing that counts as a shot can happen away from the rim.
+    """
+
+    def __init__(self, max_stride):
+        self.max_stride = max(1, max_stride)
+        self.stride = 1
+        self.rim_boxes = []
+        #how many frames were never sent through the detector
+        self.skipped = 0
+
+    def update(self, rim_boxes, points):
+        #called by the tracker after each inferred frame with every known rim and the last position of every tracked ball
+        self.rim_boxes = list(rim_boxes)
+        if not rim_boxes or any(in_rim_zone(p, box) for box in rim_boxes for p in points):
+            self.stride = 1
+        else:
+            self.stride = self.max_stride
+
+    def ball_near_rim(self, results):
+        #cheap check on raw detections so a ball entering the rim zone mid batch switches back to every frame right away
+        for boxes in results:
+            rim_boxes = list(self.rim_boxes)
+            balls = []
+            for label, conf, (x1, y1, x2, y2) in boxes:
+                if "rim" in label:
+                    rim_boxes.append((x1, y1, x2, y2))
+                elif "ball" in label:
+                    balls.append(((x1 + x2)//2, (y1 + y2)//2))
+            if not rim_boxes or any(in_rim_zone(p, box) for box in rim_boxes for p in balls):
+                return True
+        return False
+
+
+def parse_results(r, offset=(0, 0)):
+    #turn one yolo result into a list of (label, conf, (x1, y1, x2, y2)), offset moves boxes from a crop back to full frame coords
+    ox, oy = offset
+    boxes = []
+    for box in r.boxes:
+        label = r.names[int(box.cls[0])].lower()
+        x1, y1, x2, y2 = map(int, box.xyxy[0])
+        boxes.append((label, float(box.conf[0]), (x1 + ox, y1 + oy, x2 + ox, y2 + oy)))
+    return boxes
+
+
+def confident(boxes, conf):
+    #the boxes the detector would have returned with conf as its threshold
+    return [box for box in boxes if box[1] > conf]
+
+
+def detect_frames(model, frames, conf, rim_lock=None, floor=None):
+    """
+    Run the detector on a list of frames and return the parsed boxes for each one.
+    With a locked rim most frames only send the crop around the rim, at a smaller input size.
+    With a floor under conf the boxes down to the floor are returned, for the detection cache, confident() filters them.
+    """
+    if not frames:
+        return []
+    keep = conf if floor is None else min(conf, floor)
+    if rim_lock is None:
+        return [parse_results(r) for r in model.predict(frames, conf=keep)]
+    boxes = [None] * len(frames)
+    full = [i for i, frame in enumerate(frames) if rim_lock.needs_full_frame(frame)]
+    crop = [i for i in range(len(frames)) if i not in full]
+    if crop:
+        x1, y1, x2, y2 = rim_lock.roi()
+        results = model.predict([frames[i][y1:y2, x1:x2] for i in crop], conf=keep, imgsz=rim_lock.roi_imgsz())
+        for i, r in zip(crop, results):
+            boxes[i] = parse_results(r, (x1, y1))
+        rim_lock.cropped += len(crop)
+    if full:
+        for i, r in zip(full, model.predict([frames[i] for i in full], conf=keep)):
+            boxes[i] = parse_results(r)
+            rim_lock.observe(frames[i], [b for label, c, b in boxes[i] if "rim" in label and c > conf])
+    return boxes
+
+
+def infer_frames(model, reader, conf, stride=None, rim_lock=None, timer=None, record=None):
+    """
+    Run the detector on batches of frames but hand back (frame, boxes) one frame at a time in frame order,
+    so the tracking logic sees exactly what it would have seen running one frame per predict call.
+    With an AdaptiveStride only some frames are inferred, skipped frames come back with boxes None.
+    record is an optional list that gets the boxes of every frame down to CACHE_MIN_CONF for the detection cache,
+    frames are only appended in order without a stride.
+    """
+    floor = CACHE_MIN_CONF if record is not None else None
+
+    def detect(frames):
+        if timer is None:
+            boxes = detect_frames(model, frames, conf, rim_lock, floor)
+        else:
+            with timer.stage("inference"):
+                boxes = detect_frames(model, frames, conf, rim_lock, floor)
+        if record is None:
+            return boxes
+        record.extend(boxes)
+        return [confident(b, conf) for b in boxes]
+
+    frame_no = 0
+    for batch in reader:
+        step = stride.stride if stride is not None else 1
+        picked = [i for i in range(len(batch)) if (frame_no + i) % step == 0]
+        batch_results = dict(zip(picked, detect([batch[i] for i in picked])))
+        #a ball showed up near the rim in this batch, run the frames that were going to be skipped as well
+        if step > 1 and stride.ball_near_rim(batch_results.values()):
+            rest = [i for i in range(len(batch)) if i not in batch_results]
+            batch_results.update(zip(rest, detect([batch[i] for i in rest])))
+        if stride is not None:
+            stride.skipped += len(batch) - len(batch_results)
+        for i, frame in enumerate(batch):
+            yield frame, batch_results.get(i)
+        frame_no += len(batch)
+
+
+class ShotTracker:
+    """
+    Shot counting state for one camera/video, fed one frame of detections at a time.
+    Holds no model and no video, so many of them can run side by side in one process, and
+    process_video, the live socket and the batch jobs all count shots with the same code.
+
+    update(detections, frame_idx) takes the parsed boxes of a frame and returns the attempt/make/miss events
+    that happened on it. Frames that were skipped are simply not passed in, the gap is filled in by
+    interpolating from the frame numbers. state_dict/load_state_dict (and save/load) checkpoint a session.
+
+    A camera can see more than one rim. Every rim detection updates the known rim closest to it or adds a new one,
+    and each ball is judged against the rim nearest to it, so shots are counted per rim as well as in total.
+    """
+
+    #cooldown for ball between shot attempts, in seconds
+    COOLDOWN_SECONDS = 0.6
     #use this to match the ball when tracker loses ball in between frames
     MAX_DISTANCE = 100
-    #if ball is missing for this many frames, remove it from all data structures
-    MAX_MISSING_FRAMES = 15
     #yolo detection threshold
     CONF_THRESHOLD = 0.35
-
-    #begin analyzing frame by frame
-    #later on skip frames to increase speed of inference 
-    while True:
-        #read single frame from the video
-        ret, frame = cap.read()
-        #break out of loop is no more frames
-        if not ret:
-            break
-        #increment frame count 
-        frame_idx += 1
-
-        #run yolo model on the current frame 
-        #convert to streaming later on to make the logic much more effiecient as it does not store frame by frame
-        #streaming does not store frame by frame but produces outputs as it is being read/ran
-        results = model.predict(frame, verbose=False, device=device, conf=CONF_THRESHOLD)
+    #a rim detection within this many pixels (center to center) of a known rim is the same rim
+    RIM_MATCH_DISTANCE = 100
+    #a rim that has not been detected for this many seconds is forgotten, unless it is the only one
+    RIM_FORGET_SECONDS = 5.0
+    #judge a made or missed ball again when it goes back above the rim after its cooldown
+    REJUDGE_ABOVE_RIM = True
+
+    def __init__(self, fps=30.0, frame_height=None, rim_lock=None):
+        self.fps = fps
+        #cooldown for ball between shot attempts
+        self.cooldown_frames = int(fps * self.COOLDOWN_SECONDS)
+        #balls that drop to the bottom edge of the frame are dropped, None keeps them until they go missing
+        self.frame_height = frame_height
+        #with a locked rim the rim box comes from the lock instead of the latest detection
+        self.rim_lock = rim_lock
+        #keep track of ball ids
+        #every tracked ball has a slot in the table with its trajectory, velocity, missing frame count, state (init, attempting, made, missed)
+        #and the frame it was last counted as a shot so it is not counted twice in the cooldown window
+        self.tracks = BallTracks()
+        #at each frame make sure the rim is in frame, you cannot check if a shot is made or missed if the rim is out of frame
+        #known rims, each [rim id, (x1, y1, x2, y2), last frame it was detected]
+        self.rims = []
+        self.next_rim_id = 0
+        #counters for shot attemps and made through whole duration
+        self.fgm, self.fga = 0, 0
+        #the same counters per rim id, [fgm, fga]
+        self.rim_counts = {}
+        #last frame that went through the tracker, frames in between were skipped
+        self.last_frame = 0
+        #optional metrics.StageTimer, gets the time spent on association, the merge pass and the shot state machine
+        self.timer = None
+        #tracking counters for the metrics, track_frames is the number of active balls summed over every frame
+        self.counters = {"tracks_created": 0, "merges": 0, "tracks_dropped": 0, "track_frames": 0}
+
+    def _event(self, kind, slot, frame_idx, rim_id):
+        rim_box = next((tuple(int(v) for v in box) for rid, box, _ in self.rims if rid == rim_id), None)
+        return {"type": kind, "frame": frame_idx, "ball_id": int(self.tracks.ids[slot]), "rim": rim_id, "rim_box": rim_box,
+                "FGM": self.fgm, "FGA": self.fga}
+
+    def _count(self, rim_id, made, attempted):
+        counts = self.rim_counts.setdefault(rim_id, [0, 0])
+        self.fgm += made
+        self.fga += attempted
+        counts[0] += made
+        counts[1] += attempted
+
+    @property
+    def rim_box(self):
+        #the rim seen most recently, None until a rim was found
+        if not self.rims:
+            return None
+        return max(self.rims, key=lambda rim: rim[2])[1]
+
+    def rim_boxes(self):
+        return [box for _, box, _ in self.rims]
+
+    def ball_positions(self):
+        return [self.tracks.pos[slot] for slot in self.tracks.order]
+
+    def per_rim(self):
+        #shot counts for every rim that had at least one attempt
+        return [{"rim": rim_id, "FGM": fgm, "FGA": fga} for rim_id, (fgm, fga) in sorted(self.rim_counts.items())]
+
+    def _observe_rims(self, boxes, frame_idx):
+        #match this frame's rim detections to the known rims, a detection far from every known rim is a new rim
+        for box in boxes:
+            cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+            nearest, best = None, self.RIM_MATCH_DISTANCE
+            for rim in self.rims:
+                (x1, y1, x2, y2) = rim[1]
+                dist = math.hypot((x1 + x2) / 2 - cx, (y1 + y2) / 2 - cy)
+                if dist < best:
+                    nearest, best = rim, dist
+            if nearest is not None:
+                nearest[1], nearest[2] = box, frame_idx
+            else:
+                self.rims.append([self.next_rim_id, box, frame_idx])
+                self.next_rim_id += 1
+        #forget rims that went away (camera moved, false detection), the last rim is always kept
+        if len(self.rims) > 1:
+            forget = self.RIM_FORGET_SECONDS * self.fps
+            recent = [rim for rim in self.rims if frame_idx - rim[2] <= forget]
+            self.rims = recent or [max(self.rims, key=lambda rim: rim[2])]
+
+    def _nearest_rim(self, point, boxes):
+        #index into self.rims of the rim whose center is closest to the point, the first one on a tie
+        if len(boxes) == 1:
+            return 0
+        x, y = point
+        return min(range(len(boxes)), key=lambda r: math.hypot((boxes[r][0] + boxes[r][2]) / 2 - x, (boxes[r][1] + boxes[r][3]) / 2 - y))
+
+    def update(self, detections, frame_idx, overlay=None):
+        """
+        Track one frame.
+        detections: list of (label, conf, (x1, y1, x2, y2)) like parse_results returns
+        frame_idx: frame number of this frame, counting from 1
+        overlay: optional dict from new_overlay() that gets the rims, balls and trajectories to draw
+        Returns the list of events, each a dict with type (attempt, make, miss), frame, ball_id, rim, rim_box, FGM and FGA.
+        """
+        tracks = self.tracks
+        events = []
+        if self.timer is not None:
+            start = time.perf_counter()
+        #how many frames since the tracker last ran, 1 unless frames were skipped
+        gap = max(1, frame_idx - self.last_frame)
+        self.last_frame = frame_idx
 
         #stores the centers of the balls detected in the current frame
-        detections = []
-
-        #iterate through all of the objects detected in the current frame 
-        for r in results:
-            #iterate through each detected box 
-            for box in r.boxes:
-                cls = int(box.cls[0]) #get class id of the object 0 = ball 1 = rim
-                label = r.names[cls].lower() #get class name corr to the cls of the object detected
-                conf = float(box.conf[0]) #get the detected object confidnece score outputted by the model 
-                x1, y1, x2, y2 = map(int, box.xyxy[0]) #bounding box coords
-                center = ((x1 + x2)//2, (y1 + y2)//2) #center position of the box 
-
-                if "rim" in label:
-                    #create a rectangle around the rim to display that the rim is detected 
-                    
-                    rim_box, rim_center = (x1, y1, x2, y2), center
-                    if return_video:
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 2)
-                elif "ball" in label and conf > CONF_THRESHOLD:
-                    #mark center of ball with dot and add to detection array so the coords of the ball can be traced later
-                    detections.append(center)
-                    if return_video:
-                        cv2.circle(frame, center, 4, (0,0,255), -1)
-
-        #if no rim was detectd, this frame can be skipped 
-        #later on implement logic for two rims and whichever rim the ball is closest to assign to that rim for make/miss tracking for now it is ok 
-        if not rim_box:
-            if return_video:
-                out.write(frame)
-            continue
-        #get coords of the rim detected
-        rx1, ry1, rx2, ry2 = rim_box
-        assigned = set() #keeps track of the ball ids found in curr frame and used to compare all of the active ball ids. if the ball is gone for too long, then remove from the ball id tracker
-
-        #iter through all detected balls 
-        for center in detections:
-            #find the ball with the last nearest postion to the found center, i did this because often times the ball would become distored and out of frame, so it would lose track of the ball and reassing to new id 
-            cx, cy = center
-            matched_id, min_dist = None, float("inf")
-
-            #iter throgh all balls and find the one that was the closest to this current center position and if close enough then assign that center to previos balls
-            for bid, traj in balls.items():
-                #get last position of the ball
-                px, py = traj[-1]
-                #calc distance of the current center to the previous center of current ball
-                dist = math.hypot(px - cx, py - cy)
-                #if it is the min distance to ball out of all balls and is within the distance, assign ball to that id 
-                if dist < MAX_DISTANCE and dist < min_dist:
-                    matched_id, min_dist = bid, dist
-
-            #if this is a new ball or ball has been out of frame for too long, create new ball id 
-            if matched_id is None:
-                #assign new ball id 
-                new_id = max(balls.keys(), default=-1) + 1
-                balls[new_id] = [center] #assign to new ball id the corrds of ball center
-                missing_frames[new_id] = 0 #assign to the missing_frames dict for new ball id to 0 
-                last_state[new_id] = "init" #assign the ball_id state to inital state
-                velocity[new_id] = (0, 0) #since new ball assign to ball_id 0 velocity 
-                assigned.add(new_id) #add to assigned the ball in curr frame
-
+        centers = []
+        frame_rims = []
+
+        #iterate through all of the objects detected in the current frame
+        #label is the class name of the object, conf the confidence score and the box coords are in full frame pixels
+        for label, conf, (x1, y1, x2, y2) in detections:
+            center = ((x1 + x2)//2, (y1 + y2)//2) #center position of the box
+
+            if "rim" in label:
+                #create a rectangle around the rim to display that the rim is detected
+                frame_rims.append((x1, y1, x2, y2))
+                if overlay is not None:
+                    overlay["rims"].append((x1, y1, x2, y2))
+            elif "ball" in label and conf > self.CONF_THRESHOLD:
+                #mark center of ball with dot and add to detection array so the coords of the ball can be traced later
+                centers.append(center)
+                if overlay is not None:
+                    overlay["balls"].append(center)
+
+        #once the rim is locked it stays put, detections of it do not move it around anymore
+        #the lock only ever holds a single rim, the rim lock never locks while more than one is in view
+        if self.rim_lock is not None and self.rim_lock.locked and len(self.rims) <= 1:
+            frame_rims = [self.rim_lock.rim_box]
+        self._observe_rims(frame_rims, frame_idx)
+
+        #if no rim was detectd, this frame can be skipped
+        if not self.rims:
+            return events
+        #get coords of the rims, every ball is matched to the rim closest to it
+        rim_boxes = [rim[1] for rim in self.rims]
+        #keeps track of the ball slots found in curr frame, the rest of the tracked balls count a missing frame
+        assigned = set()
+
+        merge_time = 0.0
+        #the ball travels further when frames were skipped so the distance allowed grows with the gap
+        gate = self.MAX_DISTANCE * gap
+        match = tracks.matcher(centers, gate)
+        for i, center in enumerate(centers):
+            #find the ball with the last nearest postion to the found center, i did this because often times the ball would become distored and out of frame, so it would lose track of the ball and reassing to new id
+            slot = match.nearest(i)
+            if slot is not None:
+                #fill in the skipped frames so velocity and score prediction still see one point per frame
+                if gap > 1 and slot not in assigned:
+                    tracks.extend(slot, interpolate_points(tracks.pos[slot], smooth_point(tracks.pos[slot], center), gap))
+                #smoothing averages the current center with the last position in case the ball jitters
+                tracks.append_smoothed(slot, center)
+                #assign to ball that it is not missing frame by updating frames missed to 0
+                tracks.missing[slot] = 0
+            else:
+                if self.timer is not None:
+                    merge_start = time.perf_counter()
+                #if this is a new ball or ball has been out of frame for too long, create new ball id
                 #check once aggain if the ball reappeard or dropped out just in case it skipped the ball for a few frames
                 #important because it minimizes the number of attempts because if ball is lost mid air it will count as a shot attempt
-                to_merge = None #hold the id of the old ball that will be merged if found match 
-
-                #begin looping through each ball and see how many frames it has been missing for 
-                #if ball has been missing for short period only then there is a chance we can reassign this new ball to this old ball id 
-                for old_id, missed in list(missing_frames.items()):
-                    if old_id == new_id:
-                        continue
-                    #if the ball is only missing for a few frames then we can begin to check if this new ball is actually an old ball
-                    if 0 < missed <= 8:  #short dropout
-                        #if potential old ball, get the path/trajectory of the ball 
-                        old_traj = balls.get(old_id, [])
-                        #skip of no ball history to compare to 
-                        if not old_traj:
-                            continue
-
-                        #get coords of ball last known position 
-                        ox, oy = old_traj[-1]
-                        #coords to the new ball center in this frame
-                        cx, cy = center
-                        #calc the distance between the two 
-                        dist = math.hypot(cx - ox, cy - oy)
-
-                        """
-                        This logic here helps me detect if the ball just went through the net or not
-                        My tracker has trouble tracing the ball as it goes through the net, so this helps me determine if this ball just fell through
-                        the net and reappeared or not.
-                        """
-                        if rim_box:
-                            rim_center_y = (ry1 + ry2) / 2 #get rim center
-                            old_in_rim = (ry1 - 10) <= oy <= (ry2 + 40) #get position of the old balls last known position to check if the ball is near or around rim 
-                            #checks if ball is between 10 pixels above and 40 pixels below the rim before it vanished 
-                            new_below_rim = cy >= rim_center_y #if the ball is now below the rim we can now be certain the ball either missed or went through the net 
-                            #if oldball was in rim and new ball is below the rim we can be confident that the ball just went through the hoop 
-                            vertical_ok = old_in_rim and new_below_rim
-                            #checks if the ball is within the region near the hoop 
-                            near_rim_zone = (rx1 - 150 < cx < rx2 + 150 and
-                                            ry1 - 180 < cy < ry2 + 180)
-                        else:
-                            near_rim_zone = False
-                            vertical_ok = False
-                        
-                        #if ball is close enough to the rim, we can merge the ball ids to one 
-                        if dist < 130 and near_rim_zone and vertical_ok:
-                            #merges new and old ball trajectory 
-                            merged_traj = old_traj + [center]
-                            balls[new_id] = merged_traj[-50:]
-
-                            #copies old tracking info into new id 
-                            velocity[new_id] = velocity.get(old_id, (0, 0))
-                            last_state[new_id] = last_state.get(old_id, "init")
-                            cooldowns[new_id] = cooldowns.get(old_id, 0)
-                            #reset missing frame to 0 because ball was jsut found 
-                            missing_frames[new_id] = 0
-                            #add to ball found set 
-                            assigned.add(new_id)
-                            
-                            #stores the old ball id so we can delete it later because the old ball was found but assigned a new id 
-                            to_merge = old_id
-                            break
-                
-                #if the ball was found and merged remove the ball id from all data strucutres no longer need to keep track 
-                if to_merge is not None:
-                    for d in (balls, missing_frames, last_state, velocity, cooldowns):
-                        d.pop(to_merge, None)
-
-            else:
-                #if the ball in the frame already had a found id, dont need logic for merge detection 
-                #smoothed gets the ball id and current center in the case teh ball jitteres 
-                #produces average based on the last position to smooth jumps 
-                smoothed = smooth_point(balls[matched_id][-1], center)
-                balls[matched_id].append(smoothed)
-
-                #dont need too many points on ball to remove old postions of the ball if there is a new one 
-                if len(balls[matched_id]) > 50:
-                    balls[matched_id].pop(0)
-                #assign to ball that it is not missing frame by updating frames missed to 0 
-                missing_frames[matched_id] = 0
-                assigned.add(matched_id)
-
-        
-        #go through each ball that is currently being tracked 
-        for bid in list(balls.keys()):
-            #get ball trajectory/path 
-            traj = balls[bid]
-            
-            #if the ball is in the ball id tracker, but not in this current frame, increment its mising frame by 1 
-            if bid not in assigned:
-                missing_frames[bid] += 1
-
-                #check once again if the ball pos was near the rim area 
-                bx, by = traj[-1]
-                near_rim = (rx1 - 150 < bx < rx2 + 150 and
-                            ry1 - 150 < by < ry2 + 150)
-
-                # Predict forward a few frames to help reconnect, if the ball is missing, try to preduct wher the ball would be currently just in case the ball does reappear, we extrapolate another point for the ball 
-                if len(traj) >= 3 and missing_frames[bid] <= 5:
-                    (x1, y1), (x2, y2) = traj[-2], traj[-1]
-                    vx, vy = x2 - x1, y2 - y1
-                    predicted = (x2 + vx, y2 + vy)
-                    balls[bid].append(predicted)
-
-                #if ball is missing from memory for too long, remove from memory 
-                if missing_frames[bid] > (25 if near_rim else 10):
-                    for d in (balls, missing_frames, last_state, velocity, cooldowns):
-                        d.pop(bid, None)
-                    continue
-                
-            #if the ball is found, update the velocity of the ball and add to the velocity tracker 
-            if len(traj) >= 2:
-                vx, vy = traj[-1][0] - traj[-2][0], traj[-1][1] - traj[-2][1]
-                velocity[bid] = (vx, vy)
-
-            #if the ball has not been in the air for enough frames, dont need to predict shot make or miss yet
-            if len(traj) < 5:
+                #my tracker has trouble tracing the ball as it goes through the net, so this checks if the ball just fell through the net and reappeared
+                slot = tracks.find_merge(center, rim_boxes[self._nearest_rim(center, rim_boxes)])
+                if slot is not None:
+                    tracks.merge(slot, center)
+                    self.counters["merges"] += 1
+                else:
+                    slot = tracks.add(center)
+                    self.counters["tracks_created"] += 1
+                if self.timer is not None:
+                    merge_time += time.perf_counter() - merge_start
+            assigned.add(slot)
+            match.moved(i, slot)
+        if self.timer is not None:
+            self.timer.add("merge", merge_time)
+
+        #balls that are tracked but not in this current frame, increment their missing frames
+        for slot in tracks.active():
+            if slot in assigned:
                 continue
-            
+            tracks.missing[slot] += gap
+            #check once again if the ball pos was near the rim area
+            bx, by = tracks.pos[slot]
+            rx1, ry1, rx2, ry2 = rim_boxes[self._nearest_rim((bx, by), rim_boxes)]
+            near_rim = rx1 - 150 < bx < rx2 + 150 and ry1 - 150 < by < ry2 + 150
+            # Predict forward a few frames to help reconnect, if the ball is missing, try to preduct wher the ball would be currently just in case the ball does reappear, we extrapolate another point for the ball
+            if len(tracks.traj[slot]) >= 3 and tracks.missing[slot] <= 5:
+                for _ in range(gap):
+                    tracks.extrapolate(slot)
+            #if ball is missing from memory for too long, remove from memory
+            if tracks.missing[slot] > (25 if near_rim else 10):
+                tracks.remove(slot)
+                self.counters["tracks_dropped"] += 1
+
+        #update the velocity of every ball still tracked
+        active = tracks.active()
+        tracks.update_velocity(active)
+        self.counters["track_frames"] += len(active)
+        if self.timer is not None:
+            associated = time.perf_counter()
+            self.timer.add("association", associated - start - merge_time)
+
+        #if the ball has not been in the air for enough frames, dont need to predict shot make or miss yet
+        ready = [slot for slot in active if len(tracks.traj[slot]) >= 5]
+        #detect_up, detect_down and score_prediction for all of those balls in one go per rim, each is only computed once per ball per frame
+        if len(rim_boxes) == 1:
+            nearest = [0] * len(ready)
+            going_up, below_rim, scored = tracks.shot_geometry(ready, rim_boxes[0])
+        else:
+            nearest = [self._nearest_rim(tracks.pos[slot], rim_boxes) for slot in ready]
+            going_up, below_rim, scored = [False] * len(ready), [False] * len(ready), [False] * len(ready)
+            for r in set(nearest):
+                sel = [k for k, n in enumerate(nearest) if n == r]
+                for k, up, down, score in zip(sel, *tracks.shot_geometry([ready[k] for k in sel], rim_boxes[r])):
+                    going_up[k], below_rim[k], scored[k] = up, down, score
+
+        #go through each ball that is currently being tracked
+        for k, slot in enumerate(ready):
+            bid = tracks.ids[slot]
+            rim_id = self.rims[nearest[k]][0]
             #get ball coords
-            bx, by = traj[-1]
-            vy = velocity[bid][1] #ball vertical speed 
-            old_state = last_state.get(bid, "init") #get the current state of ball 
+            bx, by = tracks.pos[slot]
+            vy = tracks.vel[slot][1] #ball vertical speed
+            #the cooldown window prevents the ball from being count as two shots
+            cooled_down = frame_idx - tracks.cooldown[slot] > self.cooldown_frames
 
+            #a ball that was made or missed and comes back up above the rim after its cooldown is judged again as a new ball,
+            #without this a track that was kept across skipped frames would keep its stale state through the next shot
+            if self.REJUDGE_ABOVE_RIM and tracks.state[slot] in (MADE, MISSED) and cooled_down and vy < 0 and by < rim_boxes[nearest[k]][1]:
+                tracks.state[slot] = INIT
 
             #if the ball is going up/being attemtped
-            if detect_up(traj, rim_box) and vy < 0:
+            if going_up[k] and vy < 0:
                 #if the ball is being attemtped and not in the cooldown zone, increment the shot attempt by 1 as the ball goes up
-                #this prevents the ball from being count as two shots 
-                if bid not in cooldowns or frame_idx - cooldowns[bid] > COOLDOWN_FRAMES:
-                    fga += 1
+                if cooled_down:
+                    self._count(rim_id, 0, 1)
                     #update the frame the ball is being considered a shot as
-                    cooldowns[bid] = frame_idx
-                    #update the state of the ball 
-                    last_state[bid] = "attempting"
-            
-
-            #eval balls that are in a state of being shot 
-            if last_state.get(bid) in ["attempting", "init"]:
-                #check if the ball is falling below the rim and predict if the ball went in or not 
-                if detect_down(traj, rim_box) and score_prediction(traj, rim_box):
+                    tracks.cooldown[slot] = frame_idx
+                    cooled_down = False
+                    #update the state of the ball
+                    tracks.state[slot] = ATTEMPTING
+                    events.append(self._event("attempt", slot, frame_idx, rim_id))
+
+
+            #eval balls that are in a state of being shot
+            if tracks.state[slot] in (ATTEMPTING, INIT):
+                #check if the ball is falling below the rim and predict if the ball went in or not
+                if below_rim[k] and scored[k]:
                     #if both are true, we predict the shot as made
-                    if bid not in cooldowns or frame_idx - cooldowns[bid] > COOLDOWN_FRAMES:
+                    if cooled_down:
                         #increment the shot made
-                        if last_state.get(bid) != "attempting":
-                            fga += 1
-                        fgm += 1
-                        print(f"[DEBUG] fgm now {fgm}")
-                        #set cool down as current frame to ensure the ball is not double counted 
-                        cooldowns[bid] = frame_idx
-                        last_state[bid] = "made"
+                        self._count(rim_id, 1, int(tracks.state[slot] != ATTEMPTING))
+                        #set cool down as current frame to ensure the ball is not double counted
+                        tracks.cooldown[slot] = frame_idx
+                        tracks.state[slot] = MADE
+                        events.append(self._event("make", slot, frame_idx, rim_id))
                         continue
                 #checks if ball below rim and if predicts make or miss
-                elif detect_down(traj, rim_box) and not score_prediction(traj, rim_box):
-                    if bid not in cooldowns or frame_idx - cooldowns[bid] > COOLDOWN_FRAMES:
+                elif below_rim[k]:
+                    if cooled_down:
                         #set state as miss and set the cooldown frame to ensure ball has a little bit of time before being count as a shot again
-                        cooldowns[bid] = frame_idx
-                        last_state[bid] = "missed"
+                        #only a ball that was shot is reported as a miss, not one that just dropped below the rim
+                        attempted = tracks.state[slot] == ATTEMPTING
+                        tracks.cooldown[slot] = frame_idx
+                        tracks.state[slot] = MISSED
+                        if attempted:
+                            events.append(self._event("miss", slot, frame_idx, rim_id))
                         continue
-            #remove balls that are no longer in frame to keep memory clean 
-            if by > h - 40:
-                for d in (balls, missing_frames, last_state, velocity, cooldowns):
-                    d.pop(bid, None)
+            #remove balls that are no longer in frame to keep memory clean
+            if self.frame_height is not None and by > self.frame_height - 40:
+                tracks.remove(slot)
+                self.counters["tracks_dropped"] += 1
                 continue
-            #draw trajectory of the ball, path that connects teh ball postions to see the ball path 
+            #the trajectory is copied because the tracker keeps changing it while the encoder thread draws,
+            #the copy is already in the int32 points cv2.polylines takes
+            if overlay is not None:
+                overlay["tracks"].append((bid, np.array(tracks.trajectory(slot), dtype=np.int32)))
+        if self.timer is not None:
+            self.timer.add("state_machine", time.perf_counter() - associated)
+        return events
+
+    def state_dict(self):
+        #everything needed to pick the session up again, the ball table plus the counters as plain arrays and numbers
+        state = {"ball_" + name: value for name, value in self.tracks.state_dict().items()}
+        counts = sorted(self.rim_counts.items())
+        state.update({"fps": self.fps, "frame_height": -1 if self.frame_height is None else self.frame_height,
+                      "rims": np.array([[rim_id, *box, seen] for rim_id, box, seen in self.rims], dtype=np.int64).reshape(-1, 6),
+                      "next_rim_id": self.next_rim_id,
+                      "rim_counts": np.array([[rim_id, fgm, fga] for rim_id, (fgm, fga) in counts], dtype=np.int64).reshape(-1, 3),
+                      "fgm": self.fgm, "fga": self.fga, "last_frame": self.last_frame})
+        return state
+
+    def load_state_dict(self, state):
+        self.tracks.load_state_dict({name[5:]: value for name, value in state.items() if name.startswith("ball_")})
+        self.fps = float(state["fps"])
+        self.cooldown_frames = int(self.fps * self.COOLDOWN_SECONDS)
+        self.frame_height = None if int(state["frame_height"]) < 0 else int(state["frame_height"])
+        self.rims = [[int(row[0]), tuple(int(v) for v in row[1:5]), int(row[5])] for row in state["rims"]]
+        self.next_rim_id = int(state["next_rim_id"])
+        self.rim_counts = {int(rim_id): [int(fgm), int(fga)] for rim_id, fgm, fga in state["rim_counts"]}
+        self.fgm, self.fga = int(state["fgm"]), int(state["fga"])
+        self.last_frame = int(state["last_frame"])
+
+    def save(self, path):
+        #checkpoint to a compressed .npz file
+        np.savez_compressed(path, **self.state_dict())
+
+    @classmethod
+    def load(cls, path, rim_lock=None):
+        with np.load(path) as data:
+            state = {name: data[name] for name in data.files}
+        tracker = cls(rim_lock=rim_lock)
+        tracker.load_state_dict(state)
+        return tracker
+
+
+def replay_frames(reader, cached):
+    #decoded frames lined up with their cached detections, used when the output video still has to be drawn
+    boxes = iter(cached)
+    for batch in reader:
+        for frame in batch:
+            yield frame, next(boxes, [])
+
+
+def process_video(video_path=None, output_path=None, return_video=False, batch_size=None, skip_stride=None, rim_lock=None,
+                  progress=None, on_event=None, timer=None):
+    #process video
+    #get the shared trained ball and rim tracking model, only the first call in a worker loads it from disk
+    model = get_model("best")
+    out = None
+    if rim_lock is None:
+        rim_lock = RIM_LOCK
+
+    #a video that was analysed before with the same weights replays the detector output from the cache,
+    #filtered at the threshold in use, which can not be under the lowest confidence the cache keeps
+    use_cache = DETECTION_CACHE and ShotTracker.CONF_THRESHOLD >= CACHE_MIN_CONF
+    cache, key, cached = None, None, None
+    video_key = source_key(video_path) if use_cache else None
+    if video_key is not None:
+        cache = DetectionCache()
+        key = cache_key(video_key, model.path, rim_lock, model.imgsz)
+        cached = cache.get(key)
+        #a run with the rim lock is only replayed together with where the lock held the rim
+        if cached is not None and rim_lock and "locked_rims" not in cached[1]:
+            cached = None
+        if cached is not None:
+            cached = ([confident(boxes, ShotTracker.CONF_THRESHOLD) for boxes in cached[0]], cached[1])
+    #an upload still arriving has no key yet, it gets one from the hash of its chunks once it is complete
+    upload = use_cache and video_key is None and hasattr(video_path, "digest")
+
+    if cached is not None and not return_video:
+        #nothing to draw, the video does not even have to be decoded
+        cap = None
+        live = False
+        fps, w, h = cached[1]["fps"], cached[1]["width"], cached[1]["height"]
+        total_frames = len(cached[0])
+    else:
+        #load video to be processed, the camera when there is no video, video_path can also be a file object still being uploaded
+        cap = open_capture(video_path)
+        #a live camera is processed one frame at a time, waiting to fill a batch would only add latency
+        live = video_path is None or getattr(cap, "live", False)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        w, h = int(cap.get(3)), int(cap.get(4))
+        #total frames in the video, 0 for a live camera
+        total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    if live:
+        batch_size = 1
+    elif batch_size is None:
+        batch_size = BATCH_SIZE
+    if skip_stride is None:
+        skip_stride = SKIP_STRIDE
+    #replaying from the cache is cheap enough to track every frame
+    stride = AdaptiveStride(skip_stride) if skip_stride > 1 and cached is None else None
+    if not rim_lock:
+        rim_lock = None
+    elif cached is None:
+        rim_lock = RimLock((h, w))
+    else:
+        #a cached run replays the rim the lock held on every frame instead of running the lock
+        rim_lock = ReplayedRimLock(cached[1]["locked_rims"])
+    replayed_lock = rim_lock if isinstance(rim_lock, ReplayedRimLock) else None
+    #detections are only worth caching when every frame went through the detector
+    recorded = [] if (key is not None or upload) and cached is None and stride is None else None
+    #with the rim lock on, the rim it held for every frame is cached with the detections
+    locked_rims = [] if recorded is not None and rim_lock is not None else None
+
+    #location to write labeled video to 
+    if return_video:
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        #drawing and encoding run on their own thread so they overlap with inference
+        out = VideoEncoder(open_writer(output_path, fps, (w, h)), timer=timer)
+
+
+    #all the shot counting state lives in the tracker, this function only decodes, detects and draws
+    tracker = ShotTracker(fps, h, rim_lock)
+    #timer is an optional metrics.StageTimer that collects the time spent in every stage
+    tracker.timer = timer
+    #count for how many frames have passed by
+    frame_idx = 0
+
+    #begin analyzing frame by frame
+    #later on skip frames to increase speed of inference 
+    #frames are decoded and run through yolo in batches, then the results come back one frame at a time in order
+    start_time = time.perf_counter()
+    #decoder thread reads frames ahead while this thread runs inference and tracking
+    #live sources are read on this thread right before each predict, a frame read ahead would wait a whole inference
+    #in the queue and the tracker would always be one frame behind the camera
+    if cap is None:
+        reader = None
+    elif live:
+        reader = read_batches(cap, 1, timer)
+    else:
+        reader = FrameReader(cap, batch_size, timer=timer)
+    if cached is None:
+        frames = infer_frames(model, reader, ShotTracker.CONF_THRESHOLD, stride, rim_lock, timer, recorded)
+    elif reader is not None:
+        frames = replay_frames(reader, cached[0])
+    else:
+        frames = ((None, boxes) for boxes in cached[0])
+    try:
+        for frame, results in frames:
+            #increment frame count 
+            frame_idx += 1
+            #report how far along the video is, progress is called with (frames processed, total frames)
+            if progress is not None and frame_idx % PROGRESS_EVERY == 0:
+                progress(frame_idx, total_frames)
+            #annotations for this frame, drawn later by the encoder thread
+            overlay = new_overlay()
+
+            if replayed_lock is not None:
+                replayed_lock.seek(frame_idx)
+            elif locked_rims is not None:
+                locked_rims.append(rim_lock.rim_box if rim_lock.locked else None)
+            #skipped frames have no results, the tracker catches up on the next inferred frame by interpolating the gap
+            if results is not None:
+                for event in tracker.update(results, frame_idx, overlay if return_video else None):
+                    #on_event gets a dict for every attempt, make and miss as it happens with the running totals
+                    if on_event is not None:
+                        on_event(event)
+                #go back to every frame as soon as a tracked ball is near the rim
+                if stride is not None:
+                    stride.update(tracker.rim_boxes(), tracker.ball_positions())
+            #display the text on screen of field goal make/attempt count, frames before the rim is found have no score
             if return_video:
-                for k in range(1, len(traj)):
-                    pt1 = (int(traj[k-1][0]), int(traj[k-1][1]))
-                    pt2 = (int(traj[k][0]), int(traj[k][1]))
-                    cv2.line(frame, pt1, pt2, (0,0,255), 2)
-                #label the ball id on the video 
-                cx, cy = traj[-1]
-                cv2.putText(frame, f"ID {bid}", (int(cx)+10, int(cy)-10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,0), 1)
-        #display the text on screen of field goal make/attempt count 
-        if return_video:
-            cv2.putText(frame, f"FGM/FGA: {fgm}/{fga}", (40, 60),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255,255,255), 2)
-        if return_video:
-            out.write(frame)
-
-    cap.release()
+                if tracker.rims or results is None:
+                    overlay["score"] = (tracker.fgm, tracker.fga)
+                out.write(frame, overlay)
+    finally:
+        if reader is not None:
+            reader.close()
+        #flush the frames still waiting to be encoded
+        if out is not None:
+            out.close()
+
+    if cap is not None:
+        cap.release()
+    if recorded and key is None:
+        #the upload finished while it was being processed, an aborted one has no key and is not cached
+        video_key = source_key(video_path)
+        if video_key is not None:
+            cache = DetectionCache()
+            key = cache_key(video_key, model.path, rim_lock is not None, model.imgsz)
+    if recorded and key is not None:
+        cache.put(key, recorded, fps, w, h, locked_rims)
+    fgm, fga = tracker.fgm, tracker.fga
+    if progress is not None:
+        progress(frame_idx, total_frames)
+    elapsed = time.perf_counter() - start_time
+    proc_fps = frame_idx / elapsed if elapsed > 0 else 0.0
     print(f"[AFTER LOOP] FGM={fgm}, FGA={fga}")
-    if out is not None:
-        out.release()
-    if return_video:
-        cv2.destroyAllWindows()
+    skipped = stride.skipped if stride is not None else 0
+    cropped = rim_lock.cropped if rim_lock is not None else 0
+    print(f"[PERF] {frame_idx} frames in {elapsed:.2f}s, {proc_fps:.1f} frames/sec (batch size {batch_size}, {skipped} frames skipped, {cropped} frames cropped to the rim"
+          f"{', detections from cache' if cached is not None else ''})")
     print(f"Done. Logged {fgm} / {fga}")
-    with open("shot_log.json", "w") as f:
-        json.dump({"FGM": fgm, "FGA": fga}, f, indent=4)
     print(f"[RETURNING] FGM={fgm}, FGA={fga}")
-    return {"FGM": fgm, "FGA": fga}
\ No newline at end of file
+    results = {"FGM": fgm, "FGA": fga, "rims": tracker.per_rim(), "frames": frame_idx, "fps": round(proc_fps, 2), "batch_size": batch_size,
+               "skip_stride": skip_stride, "skipped_frames": skipped, "cropped_frames": cropped,
+               "cache": "off" if key is None else ("hit" if cached is not None else "miss"), "tracks": dict(tracker.counters)}
+    if timer is not None:
+        results["stages"] = timer.summary()
+    return results
\ No newline at end of file
@@ -0,0 +1,52 @@
+"""
+Accuracy vs speed report for adaptive frame skipping.
+Runs the same clip once on every frame and once per stride and compares FGM/FGA and speed.
+
+usage (from backend/): python -m scripts.skip_report clip.mp4 --strides 2 3 4
+"""
+import argparse
+import time
+from scripts.shot_tracker import process_video
+
+
+def run(video_path, skip_stride, batch_size=None):
+    start = time.perf_counter()
+    results = process_video(video_path, batch_size=batch_size, skip_stride=skip_stride)
+    results["wall_s"] = time.perf_counter() - start
+    return results
+
+
+def skip_report(video_path, strides=(2, 3, 4), batch_size=None):
+    #stride 1 is the baseline every other run is compared to
+    baseline = run(video_path, 1, batch_size)
+    rows = [(1, baseline)] + [(k, run(video_path, k, batch_size)) for k in strides if k > 1]
+    report = []
+    for k, r in rows:
+        report.append({
+            "stride": k,
+            "FGM": r["FGM"],
+            "FGA": r["FGA"],
+            "FGM_diff": r["FGM"] - baseline["FGM"],
+            "FGA_diff": r["FGA"] - baseline["FGA"],
+            "frames": r["frames"],
+            "skipped_frames": r["skipped_frames"],
+            "fps": r["fps"],
+            "speedup": round(baseline["wall_s"] / r["wall_s"], 2) if r["wall_s"] > 0 else 0.0,
+        })
+    return report
+
+
+def print_report(report):
+    print(f"{'stride':>6} {'FGM':>4} {'FGA':>4} {'dFGM':>5} {'dFGA':>5} {'skipped':>8} {'fps':>7} {'speedup':>8}")
+    for row in report:
+        print(f"{row['stride']:>6} {row['FGM']:>4} {row['FGA']:>4} {row['FGM_diff']:>5} {row['FGA_diff']:>5} "
+              f"{row['skipped_frames']:>8} {row['fps']:>7} {row['speedup']:>7}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare shot counts and speed with and without frame skipping")
+    parser.add_argument("video")
+    parser.add_argument("--strides", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+    print_report(skip_report(args.video, args.strides, args.batch_size))
@@ -1,11 +1,7 @@
-import cv2
-import math
-import json
 import numpy as np
-import torch
-from ultralytics import YOLO
 
 def get_device():
+    import torch
     if torch.cuda.is_available():
         return "cuda"
     elif torch.backends.mps.is_available():
@@ -19,8 +15,9 @@ def smooth_point(prev, new, alpha=0.7):
     nx, ny = new
     return (alpha * px + (1 - alpha) * nx, alpha * py + (1 - alpha) * ny)
 
+#trajectories can be lists of (x, y) tuples or (n, 2) numpy views, so emptiness is checked with len
 def detect_up(ball_traj, rim_box):
-    if not ball_traj or not rim_box:
+    if len(ball_traj) == 0 or not rim_box:
         return False
     (rx1, ry1, rx2, ry2) = rim_box
     x1, y1 = rx1 - (rx2 - rx1) * 2.5, ry1 - (ry2 - ry1) * 2.5
@@ -30,32 +27,89 @@ def detect_up(ball_traj, rim_box):
 
 
 def detect_down(ball_traj, rim_box):
-    if not ball_traj or not rim_box:
+    if len(ball_traj) == 0 or not rim_box:
         return False
     (rx1, ry1, rx2, ry2) = rim_box
     bx, by = ball_traj[-1]
     return by > ry2 + 0.6 * (ry2 - ry1)
 
+def _rim_crossing(x0, y0, x1, y1, rim_box):
+    #x where the line through (x0, y0) and (x1, y1) crosses the rim height, checked against the rim's x range
+    #y0 is above the rim center and y1 is not, so y1 > y0 and the division is safe
+    (rx1, ry1, rx2, ry2) = rim_box
+    rim_y = ry1 + 0.5 * (ry2 - ry1)
+    pred_x = x0 + (rim_y - y0) * (x1 - x0) / (y1 - y0)
+    return (rx1 < pred_x) & (pred_x < rx2)
+
 def score_prediction(ball_traj, rim_box):
+    #take the last point above the rim center and the point after it, predict where the ball crosses the rim height
     if len(ball_traj) < 3 or rim_box is None:
         return False
     (rx1, ry1, rx2, ry2) = rim_box
-    rim_y = ry1 + 0.5 * (ry2 - ry1) 
-    x, y = [], []
-    for i in reversed(range(len(ball_traj))):
-        bx, by = ball_traj[i]
-        if by < rim_y:
-            x.append(bx)
-            y.append(by)
-            if i + 1 < len(ball_traj):
-                bx2, by2 = ball_traj[i + 1]
-                x.append(bx2)
-                y.append(by2)
-            break
-    if len(x) > 1:
-        m, b = np.polyfit(x, y, 1)
-        pred_x = (rim_y - b) / m
-        rim_x1 = (rx1 + rx2) / 2 - 0.5 * (rx2 - rx1)
-        rim_x2 = (rx1 + rx2) / 2 + 0.5 * (rx2 - rx1)
-        return rim_x1 < pred_x < rim_x2
+    rim_y = ry1 + 0.5 * (ry2 - ry1)
+    after = None
+    #walk back from the last point to the last one above the rim center
+    for point in reversed(ball_traj):
+        if point[1] < rim_y:
+            #the last point is still above the rim so there is no second point to draw the line through
+            if after is None:
+                return False
+            (x0, y0), (x1, y1) = point, after
+            return bool(_rim_crossing(float(x0), float(y0), float(x1), float(y1), rim_box))
+        after = point
+    #never above the rim
     return False
+
+def detect_up_batch(points, rim_box):
+    #detect_up for the last positions of many balls at once, points is (n, 2)
+    (rx1, ry1, rx2, ry2) = rim_box
+    x1, y1 = rx1 - (rx2 - rx1) * 2.5, ry1 - (ry2 - ry1) * 2.5
+    x2, y2 = rx2 + (rx2 - rx1) * 2.5, ry1 - (ry2 - ry1) * 0.5
+    bx, by = points[:, 0], points[:, 1]
+    return (x1 < bx) & (bx < x2) & (y1 < by) & (by < y2)
+
+def detect_down_batch(points, rim_box):
+    (rx1, ry1, rx2, ry2) = rim_box
+    return points[:, 1] > ry2 + 0.6 * (ry2 - ry1)
+
+def score_prediction_batch(trajs, lengths, rim_box):
+    """
+    score_prediction for many balls at once.
+    trajs is (n, L, 2) with each ball's points oldest first and right aligned, lengths says how many of the last points are real.
+    """
+    n, L = trajs.shape[:2]
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    (rx1, ry1, rx2, ry2) = rim_box
+    rim_y = ry1 + 0.5 * (ry2 - ry1)
+    valid = np.arange(L) >= (L - lengths)[:, None]
+    above = valid & (trajs[:, :, 1] < rim_y)
+    #index of the last point above the rim center for each ball
+    last = L - 1 - np.argmax(above[:, ::-1], axis=1)
+    ok = above.any(axis=1) & (last < L - 1) & (lengths >= 3)
+    rows = np.arange(n)
+    nxt = np.minimum(last + 1, L - 1)
+    p0, p1 = trajs[rows, last].astype(np.float64), trajs[rows, nxt].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = _rim_crossing(p0[:, 0], p0[:, 1], p1[:, 0], p1[:, 1], rim_box)
+    return ok & crossing
+
+def rim_zone(rim_box):
+    #area around the rim where a ball can be going up for a shot, falling through the net or being merged after a dropout
+    #covers the detect_up zone plus the near rim margins used by the merge logic
+    (rx1, ry1, rx2, ry2) = rim_box
+    mx = max(150, (rx2 - rx1) * 3)
+    my = max(180, (ry2 - ry1) * 4)
+    return (rx1 - mx, ry1 - my, rx2 + mx, ry2 + 180)
+
+def in_rim_zone(point, rim_box):
+    if point is None or not rim_box:
+        return False
+    zx1, zy1, zx2, zy2 = rim_zone(rim_box)
+    bx, by = point
+    return (zx1 < bx < zx2 and zy1 < by < zy2)
+
+def interpolate_points(start, end, steps):
+    #points evenly spaced between start and end for the frames that were skipped, excludes both ends
+    (sx, sy), (ex, ey) = start, end
+    return [(sx + (ex - sx) * k / steps, sy + (ey - sy) * k / steps) for k in range(1, steps)]
@@ -0,0 +1,141 @@
+"""
+Shared helpers for the backend tests.
+The tests never load real weights or decode real videos: StubCapture hands out blank frames that remember their
+frame number and StubModel answers predict calls with detections recorded (or synthesized) for those frames,
+so process_video runs its real batching, frame skipping, rim lock and tracking code on known input.
+"""
+import sys
+from pathlib import Path
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+NAMES = {0: "ball", 1: "rim"}
+
+
+class StubFrame(np.ndarray):
+    #blank frame that knows its frame number, crops of it keep the number and the address of the full frame
+    def __array_finalize__(self, obj):
+        self.index = getattr(obj, "index", None)
+        self.origin = getattr(obj, "origin", None)
+
+
+def stub_frame(index, shape):
+    frame = np.zeros(shape, dtype=np.uint8).view(StubFrame)
+    frame.index = index
+    frame.origin = (frame.ctypes.data, frame.strides, shape)
+    return frame
+
+
+class StubCapture:
+    """capture over len(frames) blank frames, frames are 0 based like cap.read() order"""
+
+    def __init__(self, frames, fps=30.0, width=1280, height=720, start=0, end=None):
+        self.fps, self.width, self.height = fps, width, height
+        self.pos = start
+        self.end = len(frames) if end is None else end
+        self.start = start
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.end - self.start
+        return 0
+
+    def read(self):
+        if self.pos >= self.end:
+            return False, None
+        self.pos += 1
+        return True, stub_frame(self.pos - 1, (self.height, self.width, 3))
+
+    def release(self):
+        pass
+
+
+class _Box:
+    def __init__(self, cls, conf, xyxy):
+        self.cls = [cls]
+        self.conf = [conf]
+        self.xyxy = [np.array(xyxy, dtype=np.float32)]
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.names = NAMES
+
+
+class StubModel:
+    """
+    Answers predict with the detections of each frame, frames[i] is a list of (label, conf, (x1, y1, x2, y2)).
+    A crop only sees the boxes whose center is inside it, in crop coordinates, like a detector run on the crop.
+    """
+
+    def __init__(self, frames, path="model/best.pt", imgsz=640):
+        self.frames = frames
+        self.path = path
+        self.imgsz = imgsz
+        self.names = NAMES
+        #(frame number, was it a crop) of every image passed to predict, in call order
+        self.seen = []
+
+    def predict(self, source, conf=0.25, imgsz=None):
+        images = source if isinstance(source, list) else [source]
+        return [self._detect(image, conf) for image in images]
+
+    def _detect(self, image, conf):
+        #a frame decoded from a real video has no frame number, it shows an empty court
+        if getattr(image, "origin", None) is None:
+            self.seen.append((None, False))
+            return _Result([])
+        base, (row, col, _), shape = image.origin
+        offset = image.ctypes.data - base
+        oy, ox = offset // row, (offset % row) // col
+        h, w = image.shape[:2]
+        self.seen.append((image.index, image.shape != shape))
+        boxes = []
+        for label, score, (x1, y1, x2, y2) in self.frames[image.index]:
+            cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+            if score >= conf and ox <= cx < ox + w and oy <= cy < oy + h:
+                cls = next(k for k, name in NAMES.items() if name == label)
+                boxes.append(_Box(cls, score, (x1 - ox, y1 - oy, x2 - ox, y2 - oy)))
+        return _Result(boxes)
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    """install(frames) puts a StubModel for frames in place of the detector that process_video loads"""
+    import scripts.shot_tracker as shot_tracker
+
+    def install(frames):
+        model = StubModel(frames)
+        monkeypatch.setattr(shot_tracker, "get_model", lambda name, **kwargs: model)
+        return model
+    monkeypatch.setattr(shot_tracker, "DETECTION_CACHE", False)
+    return install
+
+
+@pytest.fixture(scope="session")
+def synthetic(tmp_path_factory):
+    """synthetic(shots, seed) is (frames, meta) of a synthetic replay file (benchmark.synthesize), written once per session"""
+    from scripts.benchmark import synthesize
+    from scripts.detections import load_detections
+    clips = {}
+
+    def clip(shots, seed):
+        if (shots, seed) not in clips:
+            path = tmp_path_factory.mktemp("synth") / f"synthetic_{shots}_{seed}.npz"
+            synthesize(path, shots=shots, seed=seed)
+            clips[shots, seed] = load_detections(path)
+        return clips[shots, seed]
+    return clip
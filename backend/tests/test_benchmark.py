@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import pytest
+from scripts.benchmark import synthesize, replay
+from scripts.detections import load_detections
+
+
+def test_synthetic_truth_is_reachable(tmp_path):
+    path = tmp_path / "synthetic.npz"
+    synthesize(path, shots=20, seed=1)
+    frames, meta = load_detections(path)
+    assert meta["FGA"] == 20
+    #every ball stays inside the frame, like the boxes of a real detector
+    for boxes in frames:
+        for label, conf, (x1, y1, x2, y2) in boxes:
+            assert 0 <= x1 < x2 <= meta["width"] and 0 <= y1 < y2 <= meta["height"]
+    results = replay(frames, meta)
+    assert (results["FGM"], results["FGA"]) == (meta["FGM"], meta["FGA"])
+
+
+def test_unreachable_truth_is_not_written(tmp_path):
+    #with most detections dropped the shots cannot be seen, the file would be a benchmark nothing can pass
+    path = tmp_path / "synthetic.npz"
+    with pytest.raises(ValueError):
+        synthesize(path, shots=10, dropout=0.7)
+    assert not path.exists()
+
+
+def test_truth_is_checked_without_the_tracker(tmp_path, monkeypatch):
+    #the files benchmark the tracker, checking them with it would only pass what it already counts
+    import scripts.shot_tracker as shot_tracker
+
+    def update(*args):
+        raise AssertionError("synthesize ran the tracker")
+    monkeypatch.setattr(shot_tracker.ShotTracker, "update", update)
+    synthesize(tmp_path / "synthetic.npz", shots=20, seed=1)
+    assert load_detections(tmp_path / "synthetic.npz")[1]["FGA"] == 20
+
+
+def test_importing_the_benchmark_leaves_the_detection_cache_alone():
+    #the server imports replay from here, only the command line turns the cache off
+    env = {k: v for k, v in os.environ.items() if k != "DETECTION_CACHE"}
+    code = "import os, scripts.benchmark, scripts.detection_cache as c; print(os.environ.get('DETECTION_CACHE'), c.DETECTION_CACHE)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, cwd=os.path.dirname(os.path.dirname(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["None", "True"]
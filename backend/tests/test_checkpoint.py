@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from scripts.shot_tracker import ShotTracker
+
+
+def feed(tracker, frames, start, end, stride):
+    #frames start..end of the clip (1 based), skipped frames are not passed in like process_video with a stride
+    events = []
+    for frame_idx in range(start, end + 1):
+        if (frame_idx - 1) % stride == 0:
+            events += tracker.update(frames[frame_idx - 1], frame_idx)
+    return events
+
+
+def assert_same_state(a, b):
+    sa, sb = a.state_dict(), b.state_dict()
+    assert sa.keys() == sb.keys()
+    for name in sa:
+        np.testing.assert_array_equal(sa[name], sb[name], err_msg=name)
+
+
+@pytest.mark.parametrize("stride", [1, 3])
+@pytest.mark.parametrize("split", [0.25, 0.5, 0.75])
+def test_resuming_from_a_checkpoint_matches_an_uninterrupted_run(synthetic, tmp_path, split, stride):
+    frames, meta = synthetic(12, 5)
+    fps, height = meta["fps"], meta["height"]
+    cut = int(len(frames) * split)
+
+    whole = ShotTracker(fps, height)
+    expected = feed(whole, frames, 1, len(frames), stride)
+    assert (whole.fgm, whole.fga) == (meta["FGM"], meta["FGA"])
+
+    first = ShotTracker(fps, height)
+    events = feed(first, frames, 1, cut, stride)
+    assert 0 < first.fga < whole.fga
+    first.save(tmp_path / "session.npz")
+    resumed = ShotTracker.load(tmp_path / "session.npz")
+    assert_same_state(first, resumed)
+    events += feed(resumed, frames, cut + 1, len(frames), stride)
+
+    assert events == expected
+    assert (resumed.fgm, resumed.fga) == (whole.fgm, whole.fga)
+    assert resumed.per_rim() == whole.per_rim()
+    assert_same_state(resumed, whole)
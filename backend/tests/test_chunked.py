@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pytest
+import scripts.chunked as chunked
+from scripts.profiler import SamplingProfiler
+from scripts.shot_tracker import process_video
+from scripts.metrics import StageTimer
+from conftest import StubCapture
+
+RIM = (600, 200, 660, 215)
+
+
+def event(kind, frame, ball, fgm, fga):
+    return {"type": kind, "frame": frame, "ball_id": ball, "rim": 0, "rim_box": RIM, "FGM": fgm, "FGA": fga}
+
+
+def segment(own_start, own_end, events):
+    return {"own_start": own_start, "own_end": own_end, "events": events}
+
+
+def totals(segments):
+    events, per_rim = chunked.stitch(segments, 30.0)
+    return [(e["type"], e["frame"], e["FGM"], e["FGA"]) for e in events], per_rim
+
+
+def test_make_after_the_cut_finishes_the_attempt_before_it():
+    first = segment(1, 101, [event("attempt", 95, 0, 0, 1)])
+    #the next segment saw the attempt in its warm up and the make after the cut
+    second = segment(101, 201, [event("attempt", 95, 4, 0, 1), event("made", 105, 4, 1, 1)])
+    events, per_rim = totals([first, second])
+    assert events == [("attempt", 95, 0, 1), ("made", 105, 1, 1)]
+    assert per_rim == [{"rim": 0, "FGM": 1, "FGA": 1}]
+
+
+def test_attempt_seen_again_after_the_cut_is_not_counted_twice():
+    first = segment(1, 101, [event("attempt", 99, 0, 0, 1)])
+    second = segment(101, 201, [event("attempt", 103, 2, 0, 1), event("missed", 112, 2, 0, 1)])
+    events, _ = totals([first, second])
+    assert events == [("attempt", 99, 0, 1), ("missed", 112, 0, 1)]
+
+
+def test_attempt_only_seen_in_the_warm_up_is_counted_with_its_make():
+    first = segment(1, 101, [])
+    second = segment(101, 201, [event("attempt", 98, 1, 0, 1), event("made", 104, 1, 1, 1)])
+    events, _ = totals([first, second])
+    assert events == [("made", 104, 1, 1)]
+
+
+def run_segments(frames, plan, fps, monkeypatch):
+    #every segment reads its own range of the clip, frame numbers of the stub frames are those of the whole clip
+    monkeypatch.setattr(chunked, "SegmentCapture", lambda path, read_start, own_start, own_end, video_hash=None:
+                        StubCapture(frames, start=read_start, end=own_end))
+    options = {"skip_stride": 1, "rim_lock": False, "batch_size": 8}
+    return chunked.stitch([chunked._run_segment("clip", *seg, options) for seg in plan], fps)
+
+
+def shots(events):
+    return [(e["type"], e["frame"], e["FGM"], e["FGA"]) for e in events]
+
+
+@pytest.mark.parametrize("workers", [2, 3, 5])
+def test_stitched_segments_match_a_single_pass(stub_model, monkeypatch, synthetic, workers):
+    frames, meta = synthetic(12, 3)
+    stub_model(frames)
+    single = []
+    results = process_video(StubCapture(frames), on_event=single.append, skip_stride=1, rim_lock=False)
+    plan = chunked.plan_segments(len(frames), meta["fps"], workers, segment_seconds=1e9)
+    assert len(plan) == workers
+    events, per_rim = run_segments(frames, plan, meta["fps"], monkeypatch)
+    assert shots(events) == shots(single)
+    assert per_rim == results["rims"]
+
+
+def test_shots_cut_in_half_are_counted_once(stub_model, monkeypatch, synthetic):
+    frames, meta = synthetic(12, 3)
+    stub_model(frames)
+    single = []
+    process_video(StubCapture(frames), on_event=single.append, skip_stride=1, rim_lock=False)
+    #keyframes halfway between every attempt and its make or miss, the cuts move onto them
+    keys, attempts = [0], {}
+    for e in single:
+        if e["type"] == "attempt":
+            attempts[e["ball_id"]] = e["frame"]
+        elif e["ball_id"] in attempts:
+            keys.append((attempts.pop(e["ball_id"]) + e["frame"]) // 2)
+    plan = chunked.plan_segments(len(frames), meta["fps"], 4, keys, segment_seconds=1e9)
+    assert sum(1 for _, own_start, _ in plan if own_start in keys[1:]) >= 2
+    events, _ = run_segments(frames, plan, meta["fps"], monkeypatch)
+    assert shots(events) == shots(single)
+
+
+@pytest.fixture
+def clip(tmp_path):
+    path = tmp_path / "long.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 36))
+    for _ in range(240):
+        writer.write(np.zeros((36, 64, 3), np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def inline_pool(monkeypatch):
+    #the segments run on threads of this process, where the stub detector is installed
+    pool = ThreadPoolExecutor(2)
+    monkeypatch.setattr(chunked, "segment_pool", lambda workers: pool)
+    monkeypatch.setattr(chunked, "CHUNK_MIN_SECONDS", 0)
+    yield pool
+    pool.shutdown()
+
+
+def test_segment_stage_times_and_profiles_are_merged_into_the_job(stub_model, inline_pool, clip, monkeypatch):
+    model = stub_model([])
+    predict = model.predict
+
+    def slow_predict(*args, **kwargs):
+        #long enough for the profiler to catch both segments running, they are over in a few milliseconds otherwise
+        time.sleep(0.005)
+        return predict(*args, **kwargs)
+    monkeypatch.setattr(model, "predict", slow_predict)
+    timer, profiler = StageTimer(), SamplingProfiler(interval=0.001)
+    results = chunked.process_video_chunked(clip, workers=2, timer=timer, profiler=profiler, skip_stride=1)
+    assert len(results["segments"]) == 2
+    #every frame of both segments went through the detector, warm up frames included
+    inferred = sum(seg["frames"][1] - seg["frames"][0] for seg in results["segments"])
+    assert results["stages"]["inference"]["calls"] >= inferred // 8
+    assert results["stages"]["decode"]["calls"] >= inferred
+    assert profiler.samples > 0 and not profiler.is_alive()
+    assert {stack.split(";")[0] for stack in profiler.stacks} == {"segment 0", "segment 1"}
+
+
+def test_segments_replay_their_detections_from_the_cache(stub_model, monkeypatch, inline_pool, clip, tmp_path):
+    import scripts.shot_tracker as shot_tracker
+    model = stub_model([])
+    monkeypatch.setattr(shot_tracker, "DETECTION_CACHE", True)
+    monkeypatch.setattr(chunked, "DETECTION_CACHE", True)
+    monkeypatch.chdir(tmp_path)
+    first = chunked.process_video_chunked(clip, workers=2, skip_stride=1)
+    calls = len(model.seen)
+    assert calls >= 240
+    second = chunked.process_video_chunked(clip, workers=2, skip_stride=1)
+    assert (first["cache"], second["cache"]) == ("miss", "hit")
+    assert len(model.seen) == calls
+    assert len(list((tmp_path / "cache" / "detections").glob("*_f*.npz"))) == 2
+
+
+def test_segment_pool_is_kept_between_videos():
+    pool = chunked.segment_pool(2)
+    try:
+        assert chunked.segment_pool(2) is pool
+        assert chunked.segment_pool(3) is not pool
+    finally:
+        chunked._drop_pool(2)
+        chunked._drop_pool(3)
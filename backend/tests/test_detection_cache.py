@@ -0,0 +1,130 @@
+import threading
+import cv2
+import numpy as np
+import pytest
+import scripts.shot_tracker as shot_tracker
+from scripts.detection_cache import content_hash, file_hash
+from scripts.ingest import GrowingFile, UPLOADING, COMPLETE
+from scripts.shot_tracker import ShotTracker, process_video
+from conftest import StubCapture
+
+
+@pytest.fixture
+def clip(tmp_path):
+    path = tmp_path / "clip.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 36))
+    for k in range(60):
+        writer.write(np.full((36, 64, 3), k * 4, np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def cache_on(stub_model, monkeypatch, tmp_path):
+    #stub_model with the cache on, in a folder of its own
+    monkeypatch.setattr(shot_tracker, "DETECTION_CACHE", True)
+    monkeypatch.chdir(tmp_path)
+    return stub_model
+
+
+def upload(clip, path, release=None, chunk=4096):
+    #writes the clip to path in chunks while the job reads it like main.queue_upload, the last chunk waits for release
+    data = clip.read_bytes()
+    state = {"state": UPLOADING, "size": len(data)}
+    path.write_bytes(b"")
+
+    def run():
+        digest = content_hash()
+        with open(path, "ab") as f:
+            for k in range(0, len(data), chunk):
+                if k + chunk >= len(data) and release is not None:
+                    release.wait(10)
+                f.write(data[k:k + chunk])
+                f.flush()
+                digest.update(data[k:k + chunk])
+        state["hash"] = digest.hexdigest()
+        state["state"] = COMPLETE
+    writer = threading.Thread(target=run)
+    writer.start()
+    return GrowingFile(str(path), state), writer
+
+
+def test_upload_hash_is_the_file_hash(clip, tmp_path):
+    source, writer = upload(clip, tmp_path / "upload.avi")
+    writer.join()
+    assert source.digest() == file_hash(clip)
+    source.close()
+
+
+def test_upload_is_cached_once_it_completes(cache_on, clip, tmp_path, monkeypatch):
+    model = cache_on([])
+    #the upload only completes after the job looked for its key, while it was still arriving
+    release, keys = threading.Event(), []
+
+    def source_key(source):
+        keys.append(real_source_key(source))
+        release.set()
+        return keys[-1]
+    real_source_key = shot_tracker.source_key
+    monkeypatch.setattr(shot_tracker, "source_key", source_key)
+    source, writer = upload(clip, tmp_path / "upload.avi", release)
+    first = process_video(source, skip_stride=1)
+    writer.join()
+    source.close()
+    assert keys[0] is None and keys[-1] == file_hash(clip)
+    calls = len(model.seen)
+    assert calls == first["frames"] == 60
+    assert first["cache"] == "miss"
+    #the same video uploaded again, or run from disk, replays the detections
+    second = process_video(str(clip), skip_stride=1)
+    assert second["cache"] == "hit"
+    assert len(model.seen) == calls
+
+
+def cached_capture(frames):
+    #stub capture the cache can key, like a segment of a video file
+    cap = StubCapture(frames)
+    cap.segment = ("synthetic", 0, 0, len(frames))
+    return cap
+
+
+def run(frames):
+    events = []
+    results = process_video(cached_capture(frames), on_event=events.append, skip_stride=1, rim_lock=False)
+    return results, [(e["type"], e["frame"], e["ball_id"]) for e in events]
+
+
+def test_a_new_threshold_is_replayed_from_the_cache(cache_on, synthetic, monkeypatch):
+    frames, _ = synthetic(12, 4)
+    model = cache_on(frames)
+    first, low = run(frames)
+    assert first["cache"] == "miss"
+    calls = len(model.seen)
+    monkeypatch.setattr(ShotTracker, "CONF_THRESHOLD", 0.6)
+    replayed, high = run(frames)
+    assert replayed["cache"] == "hit" and len(model.seen) == calls
+    #the same as running the detector at the new threshold
+    monkeypatch.setattr(shot_tracker, "DETECTION_CACHE", False)
+    fresh, expected = run(frames)
+    assert high == expected != low
+    assert (replayed["FGM"], replayed["FGA"]) == (fresh["FGM"], fresh["FGA"])
+
+
+def test_a_cached_run_replays_the_locked_rim(cache_on, synthetic):
+    frames, _ = synthetic(6, 2)
+    #the rim detections wobble a few pixels, so events only carry the same rim box if the replay holds the same lock
+    frames = [[(c, conf, tuple(v + 3 * (k % 2) for v in box) if c == "rim" else box) for c, conf, box in frame]
+              for k, frame in enumerate(frames)]
+    model = cache_on(frames)
+
+    def locked_run():
+        events = []
+        results = process_video(cached_capture(frames), on_event=events.append, skip_stride=1, rim_lock=True)
+        return results, [(e["type"], e["frame"], e["ball_id"], e["rim_box"]) for e in events]
+    first, recorded = locked_run()
+    assert first["cache"] == "miss" and first["cropped_frames"] > 0
+    calls = len(model.seen)
+    replayed, events = locked_run()
+    assert replayed["cache"] == "hit" and len(model.seen) == calls
+    assert events == recorded and len(events) > 0
+    assert (replayed["FGM"], replayed["FGA"]) == (first["FGM"], first["FGA"])
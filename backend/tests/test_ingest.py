@@ -0,0 +1,130 @@
+import io
+import os
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from scripts.detection_cache import file_hash
+from scripts.ingest import GrowingFile, UploadAborted, UPLOADING, COMPLETE, ABORTED
+from scripts.jobs import QueueFull
+
+
+def growing(tmp_path, size=None):
+    path = tmp_path / "upload.mp4"
+    path.write_bytes(b"")
+    upload = {"state": UPLOADING, "size": size}
+    return path, upload, GrowingFile(str(path), upload)
+
+
+def later(fn, delay=0.1):
+    #runs fn on its own thread after delay, like the request writing the upload
+    thread = threading.Thread(target=lambda: (time.sleep(delay), fn()), daemon=True)
+    thread.start()
+    return thread
+
+
+def append(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def test_reads_wait_for_the_bytes_they_need(tmp_path):
+    path, upload, source = growing(tmp_path, 10)
+
+    def write():
+        append(path, b"hello")
+        time.sleep(0.1)
+        append(path, b"world")
+        upload["state"] = COMPLETE
+    writer = later(write)
+    start = time.monotonic()
+    assert source.read(5) == b"hello"
+    assert time.monotonic() - start >= 0.1
+    #a read of everything waits for the upload to complete
+    assert source.read() == b"world"
+    writer.join()
+    source.close()
+
+
+def test_seek_past_the_end_waits_for_the_upload_to_get_there(tmp_path):
+    path, upload, source = growing(tmp_path, 10)
+    append(path, b"hello")
+    assert source.seek(5) == 5
+    writer = later(lambda: append(path, b"world"))
+    assert source.read(5) == b"world"
+    assert source.tell() == 10
+    writer.join()
+    source.close()
+
+
+def test_abort_wakes_up_a_waiting_read(tmp_path):
+    path, upload, source = growing(tmp_path, 10)
+    writer = later(lambda: upload.update(state=ABORTED))
+    with pytest.raises(UploadAborted):
+        source.read(5)
+    writer.join()
+    source.close()
+
+
+def test_seek_to_the_end_of_an_upload_still_arriving(tmp_path):
+    path, upload, source = growing(tmp_path)
+    append(path, b"hello")
+    #no size from the client, the decoder treats the video as a stream of unknown length
+    assert source.seek(0, io.SEEK_END) == -1
+    upload["size"] = 10
+    assert source.seek(-2, io.SEEK_END) == 8
+    #once it is complete the file itself is the end
+    upload["state"] = COMPLETE
+    assert source.seek(0, io.SEEK_END) == 5
+    source.close()
+
+
+class Jobs:
+    #stands in for the JobQueue of main, keeps the upload it was given instead of running a worker
+    def __init__(self, error=None):
+        self.error = error
+        self.submitted = []
+
+    def new_upload(self, size=None):
+        self.upload = {"state": UPLOADING, "size": size}
+        return self.upload
+
+    def submit(self, video_path, **kwargs):
+        self.submitted.append((video_path, kwargs))
+        if self.error is not None:
+            raise self.error
+        return "job"
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    import main
+    monkeypatch.chdir(tmp_path)
+
+    def start(jobs):
+        monkeypatch.setattr(main, "jobs", jobs)
+        return TestClient(main.app, raise_server_exceptions=False)
+    return start
+
+
+def test_stream_upload_is_written_and_hashed_for_its_job(server):
+    jobs = Jobs()
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    response = server(jobs).post("/upload/stream", params={"filename": "../clip.mp4"}, content=data)
+    assert response.status_code == 202 and response.json()["job_id"] == "job"
+    (path, kwargs), = jobs.submitted
+    assert kwargs["filename"] == "clip.mp4" and kwargs["upload"] is jobs.upload
+    assert jobs.upload["size"] == len(data) and jobs.upload["state"] == COMPLETE
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert jobs.upload["hash"] == file_hash(path)
+    os.remove(path)
+
+
+@pytest.mark.parametrize("error, status", [(QueueFull("busy"), 503), (RuntimeError("pool is shut down"), 500)])
+def test_stream_upload_that_gets_no_job_leaves_no_file(server, error, status):
+    jobs = Jobs(error)
+    response = server(jobs).post("/upload/stream", params={"filename": "clip.mp4"}, content=b"video")
+    assert response.status_code == status
+    (path, _), = jobs.submitted
+    assert not os.path.exists(path)
@@ -0,0 +1,101 @@
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import pytest
+from scripts.jobs import JobQueue, QueueFull, QUEUED, FAILED
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=1, max_queued=0)
+    yield queue
+    queue.shutdown()
+
+
+def call(fn):
+    #runs fn on its own thread, returns the thread and a list that gets its result or exception
+    out = []
+
+    def run():
+        try:
+            out.append(fn())
+        except Exception as e:
+            out.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, out
+
+
+def test_pending_waits_for_the_job_table_lock(queue):
+    queue.jobs["a"] = {"job_id": "a", "status": QUEUED}
+    with queue.lock:
+        thread, out = call(queue.pending)
+        thread.join(0.2)
+        assert thread.is_alive()
+    thread.join(5)
+    assert out == [1]
+
+
+def test_full_queue_is_refused_without_deadlocking(queue):
+    queue.jobs["a"] = {"job_id": "a", "status": QUEUED}
+    thread, out = call(lambda: queue.submit("video.mp4"))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(out[0], QueueFull)
+
+
+class HeldPool:
+    #a pool whose jobs never start, shutting it down cancels them like ProcessPoolExecutor with cancel_futures
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, *args):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        for future in self.futures:
+            future.cancel()
+
+
+def uploaded(tmp_path, queue):
+    path = tmp_path / "upload.mp4"
+    path.write_bytes(b"video")
+    return path, queue.new_upload(5)
+
+
+def wait_finished(queue, job_id, timeout=30):
+    start = time.monotonic()
+    while queue.status(job_id)["status"] != FAILED and time.monotonic() - start < timeout:
+        time.sleep(0.05)
+    return queue.status(job_id)
+
+
+def test_upload_is_removed_when_the_pool_breaks_before_the_job_runs(queue, tmp_path):
+    #every worker exits as it starts
+    queue.pool.shutdown()
+    queue.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=sys.exit, initargs=(1,))
+    path, upload = uploaded(tmp_path, queue)
+    status = wait_finished(queue, queue.submit(str(path), upload=upload))
+    assert "BrokenProcessPool" in status["error"]
+    assert not path.exists()
+
+
+def test_upload_is_removed_when_its_job_is_cancelled(queue, tmp_path):
+    queue.pool.shutdown()
+    queue.pool = HeldPool()
+    path, upload = uploaded(tmp_path, queue)
+    job_id = queue.submit(str(path), upload=upload)
+    assert path.exists()
+    queue.pool.shutdown(cancel_futures=True)
+    assert queue.status(job_id)["status"] == FAILED
+    assert not path.exists()
+
+
+def test_a_job_the_pool_refuses_is_not_kept(queue):
+    queue.pool.shutdown()
+    with pytest.raises(RuntimeError):
+        queue.submit("video.mp4")
+    assert queue.pending() == 0 and queue.jobs == {}
@@ -0,0 +1,112 @@
+import threading
+import time
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from scripts.live import LatestFrameSource, parse_sources
+from scripts.shot_tracker import process_video
+from conftest import StubModel, stub_frame
+
+INFERENCE_SECONDS = 0.15
+CAMERA_FPS = 50
+
+
+class SlowModel(StubModel):
+    #a detector that takes INFERENCE_SECONDS per call, remembers how old every frame was when it reached predict
+    def __init__(self, frames, pushed):
+        super().__init__(frames)
+        self.pushed = pushed
+        self.ages = []
+
+    def predict(self, source, conf=0.25, imgsz=None):
+        images = source if isinstance(source, list) else [source]
+        now = time.perf_counter()
+        self.ages += [now - self.pushed[image.index] for image in images]
+        time.sleep(INFERENCE_SECONDS)
+        return super().predict(source, conf, imgsz)
+
+
+def camera(frames, count):
+    #pushes count frames at CAMERA_FPS like a phone streaming over the socket, returns the push time of each
+    pushed = {}
+
+    def run():
+        for k in range(count):
+            pushed[k] = time.perf_counter()
+            frames.push(stub_frame(k, (72, 128, 3)))
+            time.sleep(1 / CAMERA_FPS)
+        frames.close()
+    threading.Thread(target=run, daemon=True).start()
+    return pushed
+
+
+def test_live_frames_are_fresh_when_inference_is_slower_than_the_camera(stub_model, monkeypatch):
+    import scripts.shot_tracker as shot_tracker
+    count = CAMERA_FPS * 2
+    frames = LatestFrameSource(CAMERA_FPS)
+    pushed = camera(frames, count)
+    model = SlowModel([[] for _ in range(count)], pushed)
+    monkeypatch.setattr(shot_tracker, "get_model", lambda name, **kwargs: model)
+    results = process_video(frames, skip_stride=1, rim_lock=False)
+    assert results["frames"] == len(model.ages) > 5
+    assert frames.dropped > 0
+    #a frame read ahead would wait out the inference before it, a fresh one is at most one camera frame old
+    assert max(model.ages) < INFERENCE_SECONDS
+
+
+def test_live_sources_are_parsed_by_name():
+    assert parse_sources(" court = 0 ,gym=rtsp://10.0.0.5/a=b,,bad,=1") == {"court": "0", "gym": "rtsp://10.0.0.5/a=b"}
+
+
+def test_live_socket_refuses_a_source_that_is_not_configured(monkeypatch, tmp_path):
+    import main
+    opened = []
+    monkeypatch.setattr(main, "LIVE_SOURCES", {"court": "0"})
+    monkeypatch.setattr(main, "LocalCameraFeed", lambda *args: opened.append(args))
+    client = TestClient(main.app)
+    for source in ("1", str(tmp_path / "video.mp4"), "http://169.254.169.254/latest"):
+        with client.websocket_connect(f"/ws/live?source={source}") as ws:
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_json()
+        assert closed.value.code == 1008
+    assert opened == []
+
+
+def test_live_socket_plays_a_configured_source(stub_model, monkeypatch, tmp_path):
+    import main
+    path = tmp_path / "court.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, (128, 72))
+    for _ in range(10):
+        writer.write(np.zeros((72, 128, 3), np.uint8))
+    writer.release()
+    monkeypatch.setattr(main, "LIVE_SOURCES", {"court": str(path)})
+    stub_model([])
+    with TestClient(main.app).websocket_connect("/ws/live?source=court") as ws:
+        summary = ws.receive_json()
+    assert summary["type"] == "summary"
+    assert summary["frames"]["received"] == 10
+
+
+def test_live_socket_sends_the_summary_when_the_event_sender_died(stub_model, monkeypatch, tmp_path):
+    import main
+    path = tmp_path / "court.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, (128, 72))
+    for _ in range(10):
+        writer.write(np.zeros((72, 128, 3), np.uint8))
+    writer.release()
+
+    class BrokenSession(main.LiveSession):
+        #the first event cannot be sent as json, the sender dies on it with the second one still queued
+        def __init__(self, send, fps=30.0):
+            super().__init__(send, fps)
+            send({"type": "attempt", "frame": 1, "ball": object()})
+            send({"type": "miss", "frame": 2})
+    monkeypatch.setattr(main, "LiveSession", BrokenSession)
+    monkeypatch.setattr(main, "LIVE_SOURCES", {"court": str(path)})
+    stub_model([])
+    with TestClient(main.app).websocket_connect("/ws/live?source=court") as ws:
+        summary = ws.receive_json()
+    assert summary["type"] == "summary"
+    assert summary["frames"]["received"] == 10
@@ -0,0 +1,34 @@
+from scripts.rim_lock import RimLock, RECHECK_EVERY
+from scripts.shot_tracker import process_video
+from conftest import StubCapture, stub_frame
+
+
+def test_rim_lock_is_off_by_default(stub_model, synthetic):
+    frames, meta = synthetic(6, 2)
+    stub_model(frames)
+    assert process_video(StubCapture(frames))["cropped_frames"] == 0
+
+
+def test_batch_size_does_not_change_how_many_frames_are_cropped(stub_model, synthetic):
+    frames, meta = synthetic(6, 2)
+    runs = {}
+    for batch_size in (1, 16):
+        stub_model(frames)
+        runs[batch_size] = process_video(StubCapture(frames), batch_size=batch_size, rim_lock=True)
+    single, batched = runs[1], runs[16]
+    assert single["cropped_frames"] > 0
+    #a batch is planned before it is observed, so the lock and every recheck can land up to one batch later,
+    #but a recheck must not turn the rest of its batch into full frames
+    assert abs(single["cropped_frames"] - batched["cropped_frames"]) < 16
+    assert (single["FGM"], single["FGA"]) == (batched["FGM"], batched["FGA"]) == (meta["FGM"], meta["FGA"])
+
+
+def test_recheck_is_planned_once_per_interval():
+    lock = RimLock((720, 1280))
+    frame = stub_frame(0, (720, 1280, 3))
+    for _ in range(10):
+        lock.observe(frame, [(600, 200, 660, 215)])
+    assert lock.locked
+    #a whole batch is planned before any of it is observed
+    full = [i for i in range(2 * RECHECK_EVERY) if lock.needs_full_frame(frame)]
+    assert full == [RECHECK_EVERY - 1, 2 * RECHECK_EVERY - 1]
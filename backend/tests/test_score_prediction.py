@@ -0,0 +1,93 @@
+import warnings
+from collections import deque
+import numpy as np
+from scripts.utils import score_prediction, score_prediction_batch
+
+RIM = (600, 200, 660, 215)
+
+
+def polyfit_prediction(ball_traj, rim_box):
+    #score_prediction as it was before the closed form, a least squares line through the same two points
+    if len(ball_traj) < 3 or rim_box is None:
+        return False
+    (rx1, ry1, rx2, ry2) = rim_box
+    rim_y = ry1 + 0.5 * (ry2 - ry1)
+    x, y = [], []
+    for i in reversed(range(len(ball_traj))):
+        bx, by = ball_traj[i]
+        if by < rim_y:
+            x.append(bx)
+            y.append(by)
+            if i + 1 < len(ball_traj):
+                bx2, by2 = ball_traj[i + 1]
+                x.append(bx2)
+                y.append(by2)
+            break
+    if len(x) > 1:
+        m, b = np.polyfit(x, y, 1)
+        pred_x = (rim_y - b) / m
+        return (rx1 + rx2) / 2 - 0.5 * (rx2 - rx1) < pred_x < (rx1 + rx2) / 2 + 0.5 * (rx2 - rx1)
+    return False
+
+
+def crossing_pair(traj):
+    #the two points both versions draw their line through, None when there are none
+    ys = np.array([p[1] for p in traj])
+    above = np.flatnonzero(ys < 207.5)
+    if len(above) == 0 or above[-1] == len(traj) - 1:
+        return None
+    i = above[-1]
+    return traj[i], traj[i + 1]
+
+
+def random_trajectories(n, seed=0):
+    #integer pixel positions like the detector gives, falling past the rim somewhere around it
+    rng = np.random.default_rng(seed)
+    trajs = []
+    for _ in range(n):
+        length = int(rng.integers(3, 50))
+        x0, dx = rng.uniform(450, 810), rng.uniform(-15, 15)
+        y0, dy = rng.uniform(0, 200), rng.uniform(2, 30)
+        trajs.append([(float(round(x0 + dx * k + rng.normal(0, 3))), float(round(y0 + dy * k))) for k in range(length)])
+    return trajs
+
+
+def test_closed_form_matches_polyfit():
+    vertical = 0
+    for traj in random_trajectories(5000):
+        pair = crossing_pair(traj)
+        if pair is not None and len(traj) >= 3 and pair[0][0] == pair[1][0]:
+            #a vertical line has no slope, polyfit returns a rank deficient fit that misses the rim,
+            #the closed form crosses the rim height at that x
+            vertical += 1
+            assert score_prediction(traj, RIM) == (RIM[0] < pair[0][0] < RIM[2])
+            continue
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = polyfit_prediction(traj, RIM)
+        assert score_prediction(traj, RIM) == expected
+    assert vertical > 0
+
+
+def test_ball_dropping_straight_through_the_rim_is_a_make():
+    traj = [(630.0, 150.0), (630.0, 180.0), (630.0, 205.0), (630.0, 230.0)]
+    assert score_prediction(traj, RIM)
+
+
+def test_batch_matches_single():
+    trajs = random_trajectories(500, seed=1)
+    L = 50
+    windows = np.zeros((len(trajs), L, 2), dtype=np.float32)
+    lengths = np.array([len(t) for t in trajs])
+    for k, traj in enumerate(trajs):
+        windows[k, L - len(traj):] = traj
+    batch = score_prediction_batch(windows, lengths, RIM)
+    assert list(batch) == [score_prediction(traj, RIM) for traj in trajs]
+
+
+def test_trajectory_can_be_a_deque_or_an_array():
+    #the tracker passes its deques, callers outside it lists or numpy arrays
+    for traj in random_trajectories(200, seed=2):
+        expected = score_prediction(traj, RIM)
+        assert score_prediction(deque(traj, maxlen=50), RIM) == expected
+        assert score_prediction(np.array(traj), RIM) == expected
@@ -0,0 +1,64 @@
+import pytest
+from fastapi.testclient import TestClient
+from scripts.session_store import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    for k in range(5):
+        store.add_session(k, 10, created=f"2026-01-0{k + 1}T10:00:00")
+    return store
+
+
+def test_history_pages_through_every_session_once(store):
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.history(limit=2, cursor=cursor)
+        seen = page + seen
+        if cursor is None:
+            break
+    assert [s["FGM"] for s in seen] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("cursor", ["abc", "2026-01-03T10:00:00", "2026-01-03T10:00:00|", "|3", "2026-01-03|x1", "2026|-1"])
+def test_malformed_cursor_raises_value_error(store, cursor):
+    with pytest.raises(ValueError):
+        store.history(cursor=cursor)
+
+
+def test_get_history_answers_a_malformed_cursor_with_400(store, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "sessions", store)
+    client = TestClient(main.app)
+    page = client.get("/get_history", params={"limit": 2}).json()
+    assert client.get("/get_history", params={"limit": 2, "cursor": page["next_cursor"]}).status_code == 200
+    response = client.get("/get_history", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert "cursor" in response.json()["error"]
+
+
+def test_workers_starting_together_import_the_old_log_once(tmp_path):
+    #every uvicorn worker imports on startup, each with its own connection
+    import json
+    import threading
+    log = tmp_path / "shot_log.json"
+    log.write_text(json.dumps([{"date": f"2026-02-0{k + 1}T10:00:00", "FGM": k, "FGA": 10} for k in range(8)]))
+    stores = [SessionStore(str(tmp_path / "sessions.db")) for _ in range(6)]
+    barrier, imported, errors = threading.Barrier(len(stores)), [], []
+
+    def start(store):
+        barrier.wait()
+        try:
+            imported.append(store.import_json(str(log)))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=start, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(imported) == [0] * (len(stores) - 1) + [8]
+    assert stores[0].count() == 8
+    assert not log.exists() and (tmp_path / "shot_log.json.imported").exists()
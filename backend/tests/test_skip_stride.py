@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from scripts.shot_tracker import process_video
+from conftest import StubCapture
+
+RIM = (600, 200, 660, 215)
+
+
+def ball(x, y):
+    return ("ball", 0.9, (int(x) - 12, int(y) - 12, int(x) + 12, int(y) + 12))
+
+
+def run(frames, stride):
+    return process_video(StubCapture(frames), skip_stride=stride, rim_lock=False, batch_size=8)
+
+
+@pytest.mark.parametrize("stride", [1, 3])
+def test_synthetic_clip_counts_the_truth_at_every_stride(stub_model, synthetic, stride):
+    frames, meta = synthetic(12, 3)
+    stub_model(frames)
+    results = run(frames, stride)
+    assert (results["FGM"], results["FGA"]) == (meta["FGM"], meta["FGA"])
+    if stride > 1:
+        assert results["skipped_frames"] > 0
+
+
+def test_fast_shot_after_a_dribble_is_counted_at_stride_3(stub_model):
+    #the dribbling ball is below the rim so it is marked missed, then it is shot so fast that at stride 1 the tracker
+    #loses it and starts a new ball while at stride 3 the wider gap keeps the old, missed track
+    frames = [[("rim", 0.9, RIM), ball(300, 620 - 60 * abs(np.sin(np.pi * k / 12)))] for k in range(67)]
+    for i in range(25):
+        u = i / 24
+        frames.append([("rim", 0.9, RIM), ball(300 + 330 * u, 560 - 353 * u - 1200 * u * (1 - u))])
+    frames += [[("rim", 0.9, RIM), ball(630, 207 + 14 * k)] for k in range(1, 28)]
+    frames += [[("rim", 0.9, RIM)] for _ in range(40)]
+    stub_model(frames)
+    single, skipped = run(frames, 1), run(frames, 3)
+    assert single["FGM"] == skipped["FGM"] == 1
+    assert single["FGA"] == skipped["FGA"]
@@ -87,7 +87,22 @@ export default function HomeScreen(){
       },
     });
 
-    const statsReponse = await vidResponse.json();
+    //the server queues the video and answers with a job id right away
+    //poll the job status until the video is done processing
+    const job = await vidResponse.json();
+    if (!job.job_id) {
+      throw new Error(job.error || "upload was not accepted");
+    }
+    let statsReponse = null;
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      const jobResponse = await fetch(`http://192.168.1.218:8000/jobs/${job.job_id}`);
+      statsReponse = await jobResponse.json();
+      if (statsReponse.status === "done") break;
+      if (statsReponse.status === "failed" || jobResponse.status === 404) {
+        throw new Error(statsReponse.error || "processing failed");
+      }
+    }
     setResult(statsReponse);
     setUploading(false);
     Alert.alert(
@@ -98,6 +113,7 @@ export default function HomeScreen(){
 
   }catch (error) {
     console.error("Upload error:", error);
+    setUploading(false);
     Alert.alert("Error", "Failed tp upload video")
   }
 